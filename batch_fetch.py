@@ -0,0 +1,118 @@
+"""
+File: batch_fetch.py
+Function: Read many postings lists from an index file with a few large
+          sequential reads.
+The (offset, size) ranges of the lists are sorted by offset, and ranges
+that touch or are less than max_gap bytes apart are merged into one read.
+Each list is then a slice of the buffer of its read.
+vbyte lists read together are also decoded together: one NumPy vbyte
+decode over all their bytes, then the delta decoding of docIds and
+positions for all lists with cumulative sums.
+"""
+import os
+
+import numpy as np
+
+from vbyte import vbyte_decode_batch
+
+# merge two ranges when at most this many unused bytes lie between them
+MAX_GAP = 64 * 1024
+# but do not let a single read grow past this
+MAX_READ = 8 * 1024 * 1024
+
+
+def coalesce_ranges(ranges, max_gap = MAX_GAP, max_read = MAX_READ):
+    """
+    ranges: (key, offset, size)
+    Returns [(start, end, [(key, offset, size), ...])], one entry per read,
+    in file order
+    """
+    runs = []
+    for key, offset, size in sorted(ranges, key = lambda r: r[1]):
+        if runs:
+            start, end, members = runs[-1]
+            if offset - end <= max_gap and max(end, offset + size) - start <= max_read:
+                runs[-1] = (start, max(end, offset + size), members)
+                members.append((key, offset, size))
+                continue
+        runs.append((offset, offset + size, [(key, offset, size)]))
+    return runs
+
+
+def read_ranges(filename, ranges, max_gap = MAX_GAP, max_read = MAX_READ):
+    """
+    Read every (key, offset, size) range of filename
+    Returns ({key: memoryview of its bytes}, number of reads done)
+    """
+    res = dict()
+    runs = coalesce_ranges(ranges, max_gap, max_read)
+    with open(filename, 'rb') as f:
+        for start, end, members in runs:
+            f.seek(start)
+            buf = memoryview(f.read(end - start))
+            for key, offset, size in members:
+                res[key] = buf[offset - start:offset - start + size]
+    return res, len(runs)
+
+
+def delta_decode_batch(chunks):
+    """
+    Decode several flat vbyte lists ([docDelta, cnt, pos1, posDelta...])
+    Returns a list of [docID, cnt, pos1, pos2, ...] lists with absolute
+    values, the same as Querier.delta_decoding of each
+    """
+    if not chunks:
+        return []
+    data = b''.join(chunks)
+    vals = vbyte_decode_batch(data)
+    # where each list ends in vals: the terminator bytes up to its end
+    flags = np.frombuffer(data, dtype = np.uint8) >= 0x80
+    seen = np.concatenate(([0], np.cumsum(flags)))
+    ends = seen[np.cumsum([len(c) for c in chunks])]
+    # walk the doc headers; only one step per document
+    vl = vals.tolist()
+    heads = []
+    first_heads = []
+    i = 0
+    for end in ends.tolist():
+        first_heads.append(len(heads))
+        while i < end:
+            heads.append(i)
+            i += 2 + vl[i + 1]
+    heads = np.array(heads, dtype = np.int64)
+    out = vals.copy()
+    if heads.size:
+        # docIds: running sum of docDeltas, restarted for every list
+        docs = np.cumsum(vals[heads])
+        list_of_head = np.searchsorted(ends, heads, side = 'right')
+        starts = np.array(first_heads, dtype = np.int64)
+        before = np.concatenate(([0], docs))[np.minimum(starts, len(docs))]
+        out[heads] = docs - before[list_of_head]
+        # positions: running sum inside each doc
+        is_pos = np.ones(len(vals), dtype = bool)
+        is_pos[heads] = False
+        is_pos[heads + 1] = False
+        pos_sum = np.cumsum(np.where(is_pos, vals, 0))
+        doc_of = np.cumsum(~is_pos) // 2 - 1
+        base = pos_sum[heads + 1]
+        out[is_pos] = pos_sum[is_pos] - base[doc_of[is_pos]]
+    res = []
+    prev = 0
+    for end in ends.tolist():
+        res.append(out[prev:end].tolist())
+        prev = end
+    return res
+
+
+def drop_file_cache(filename):
+    """
+    Ask the kernel to drop filename from the page cache, so the next reads
+    go to disk (Linux; a no-op where posix_fadvise is missing)
+    """
+    if not hasattr(os, 'posix_fadvise'):
+        return
+    fd = os.open(filename, os.O_RDONLY)
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
@@ -0,0 +1,734 @@
+"""
+File: benchmark.py
+Function: Timing experiments for the indexer and the querier.
+Run from the directory holding the index files, e.g.
+    python benchmark.py session
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from itertools import islice
+
+from query_index import *
+from postings_reader import PostingsReader
+from tfmatrix import CSRMatrix
+from dice import DiceEngine
+from lexicon import Lexicon
+from query_ops import ListCursor, phrase_matches
+from vbyte import vbyte_decode_batch, vbyte_decode_stream
+
+
+def bench_session(num_sets = 100):
+    """
+    Per-query latency of Querier.do_query (reloads every artifact on
+    every call) against a QuerySession (loads once), plus the time spent
+    only on reading and decoding postings
+    """
+    start = time.perf_counter()
+    for i in range(num_sets):
+        Querier.do_query(i)
+    before = (time.perf_counter() - start) / num_sets
+
+    start = time.perf_counter()
+    session = QuerySession()
+    load = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for i in range(num_sets):
+        session.query(i)
+    after = (time.perf_counter() - start) / num_sets
+
+    # cost of the postings reads alone, for the same terms
+    start = time.perf_counter()
+    for i in range(num_sets):
+        for tid in session.randomQueries[i] + session.highestMatch[i]:
+            session.postings(session.idtoterm[tid])
+    postings = (time.perf_counter() - start) / num_sets
+    session.close()
+
+    print("do_query        : {:9.3f} ms/query".format(before * 1000))
+    print("session load    : {:9.3f} ms (once)".format(load * 1000))
+    print("session.query   : {:9.3f} ms/query".format(after * 1000))
+    print("postings only   : {:9.3f} ms/query".format(postings * 1000))
+
+
+def bench_reader(repeat = 20):
+    """
+    Fetch the raw bytes of every term's postings with seek + read on a
+    file object against memoryview slices of PostingsReader
+    """
+    q = Querier()
+    q.read_offset_linenum()
+    entries = list(q.offset.values())
+
+    start = time.perf_counter()
+    with open('indx.dat', 'rb') as f:
+        for _ in range(repeat):
+            for offset, size in entries:
+                q.read_data_chunk(f, offset, size)
+    seek_read = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with PostingsReader('indx.dat') as reader:
+        for _ in range(repeat):
+            for offset, size in entries:
+                reader.read(offset, size)
+    mapped = time.perf_counter() - start
+
+    lookups = repeat * len(entries)
+    print("seek + read     : {:9.3f} us/lookup".format(seek_read / lookups * 1e6))
+    print("mmap slice      : {:9.3f} us/lookup".format(mapped / lookups * 1e6))
+
+
+def legacy_vbyte_decoding(byarr):
+    """
+    The decoder Indexer and Querier used before vbyte.py: restarts at
+    every byte offset, then drops the values that restart produced
+    Only kept here as the baseline for bench_vbyte
+    """
+    ol = []
+    for i in range(len(byarr)):
+        position = 0
+        res = int(byarr[i] & 0x7f)
+        while (byarr[i] & 0x80) == 0:
+            i += 1
+            position += 1
+            res |= (int(byarr[i] & 0x7f) << (7 * position))
+        ol.append(res)
+    res = []
+    igtag = False
+    for a in ol:
+        if igtag == False:
+            res.append(a)
+        else:
+            igtag = False
+            continue
+        if a >= 128:
+            igtag = True
+    return res
+
+
+def bench_vbyte(terms = ('the', 'and', 'i'), repeat = 5):
+    """
+    Decode the longest postings lists with the legacy decoder and the
+    batch and stream modes of vbyte.py
+    """
+    q = Querier()
+    q.read_offset_linenum()
+    decoders = [('legacy', legacy_vbyte_decoding),
+                ('stream', vbyte_decode_stream),
+                ('batch', lambda b: vbyte_decode_batch(b).tolist())]
+    with PostingsReader('indx.dat') as reader:
+        for term in terms:
+            offset, size = q.offset[term]
+            data = reader.read(offset, size)
+            expected = legacy_vbyte_decoding(data)
+            for name, decode in decoders:
+                assert decode(data) == expected
+                start = time.perf_counter()
+                for _ in range(repeat):
+                    decode(data)
+                elapsed = (time.perf_counter() - start) / repeat
+                print("{:>6} {:>7} bytes  {:>6}: {:9.3f} ms  {:7.1f} MB/s".format(
+                    term, size, name, elapsed * 1000, size / elapsed / 1e6))
+
+
+def bench_blocks(terms = ('the', 'and', 'i'), repeat = 200):
+    """
+    Look up the positions of one document in a long list: decode the whole
+    flat list against decoding only the block the skip table points at
+    """
+    with QuerySession() as session:
+        for term in terms:
+            doc = 700
+            start = time.perf_counter()
+            for _ in range(repeat):
+                session.postings(term)
+            flat = (time.perf_counter() - start) / repeat
+
+            start = time.perf_counter()
+            for _ in range(repeat):
+                session.block_postings(term).find(doc)
+            blocks = (time.perf_counter() - start) / repeat
+            print("{:>6} doc {}: flat {:8.3f} ms  block {:8.3f} ms".format(
+                term, doc, flat * 1000, blocks * 1000))
+
+
+def bench_tf(dense_file = 'tf.dat'):
+    """
+    Load time and size of the sparse tf table, and of the old dense
+    tf.dat if one is still around
+    """
+    start = time.perf_counter()
+    tf = CSRMatrix.load('tf', mmap_mode = None)
+    load = time.perf_counter() - start
+    print("csr   : {:9.3f} ms  {:12d} bytes  {} x {}  nnz {}".format(
+        load * 1000, tf.nbytes, tf.shape[0], tf.shape[1], tf.nnz))
+    if os.path.exists(dense_file):
+        start = time.perf_counter()
+        dense = np.fromfile(dense_file, dtype = int).reshape((tf.shape[0], -1))
+        load = time.perf_counter() - start
+        print("dense : {:9.3f} ms  {:12d} bytes".format(load * 1000, dense.nbytes))
+
+
+def bench_dice(sample = 5):
+    """
+    Top-10 Dice partners of every term with DiceEngine against the
+    per-term loop of get_highest_match_term, extrapolated from a sample
+    """
+    q = Querier()
+    q.read_term_info()
+    start = time.perf_counter()
+    for tid in range(sample):
+        q.get_highest_match_term(tid)
+    loop = (time.perf_counter() - start) / sample
+
+    start = time.perf_counter()
+    DiceEngine(q.tf).top_k(10)
+    engine = time.perf_counter() - start
+    print("term loop  : {:9.3f} ms/term, ~{:.0f} s for all {} terms".format(
+        loop * 1000, loop * q.TERMMAX, q.TERMMAX))
+    print("DiceEngine : {:9.3f} s for all terms, top 10 each".format(engine))
+
+
+BUILD_SCRIPT = """
+import json, resource, sys, time
+sys.path.insert(0, {repo!r})
+from invindex import Indexer
+start = time.perf_counter()
+ind = Indexer({corpus!r}, 'indx.dat', **{options!r})
+ind.build_and_save()
+elapsed = time.perf_counter() - start
+# peak RSS of this process only; ru_maxrss would carry over the high-water
+# mark of the parent from before the fork
+try:
+    with open('/proc/self/status') as f:
+        rss = next(int(l.split()[1]) for l in f if l.startswith('VmHWM:'))
+except OSError:
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({{'seconds': elapsed, 'max_rss_kb': rss}}))
+"""
+
+
+def run_build(options, corpus = 'shakespeare-scenes.json.gz'):
+    """
+    Build the compressed index in a fresh process inside a temporary
+    directory, return its build time and peak RSS
+    """
+    repo = os.path.dirname(os.path.abspath(__file__))
+    corpus = os.path.abspath(corpus)
+    with tempfile.TemporaryDirectory() as tmp:
+        script = BUILD_SCRIPT.format(repo = repo, corpus = corpus, options = options)
+        out = subprocess.run([sys.executable, '-c', script], cwd = tmp,
+                             capture_output = True, text = True, check = True)
+        return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def bench_build():
+    """
+    Build time and peak RSS of the old multi-copy pipeline against the
+    single pass PostingsBuilder, each in its own process
+    """
+    runs = [('pipeline', {}),
+            ('pipeline, streamed', {'stream': True}),
+            ('single pass', {'single_pass': True}),
+            ('single pass, streamed', {'single_pass': True, 'stream': True}),
+            ('spimi, 4 MB runs', {'stream': True, 'memory_budget': 4 << 20})]
+    for name, options in runs:
+        res = run_build(options)
+        print("{:<22}: {:7.2f} s  peak RSS {:8.1f} MB".format(
+            name, res['seconds'], res['max_rss_kb'] / 1024))
+
+
+def bench_scaling(max_workers = None):
+    """
+    Parallel build time for 1..N worker processes against the serial
+    single pass build
+    """
+    max_workers = max_workers or os.cpu_count() or 1
+    serial = run_build({'single_pass': True, 'stream': True})
+    print("serial     : {:7.2f} s".format(serial['seconds']))
+    for n in range(1, max_workers + 1):
+        res = run_build({'stream': True, 'workers': n})
+        print("{:2d} workers: {:7.2f} s  speedup {:5.2f}x".format(
+            n, res['seconds'], serial['seconds'] / res['seconds']))
+
+
+def bench_lexicon(lookups = 1000):
+    """
+    Cold start of a query process: parsing termid.json, idterm.json,
+    offset.json and linenum.json against mapping lexicon.dat, with the
+    Python heap they take (tracemalloc) and the cost of a term lookup
+    Builds no longer write the json files, so they are made from the
+    lexicon in a temporary directory first
+    """
+    lex = Lexicon('lexicon.dat')
+    all_terms = list(lex.terms())
+    terms = all_terms[::max(1, len(all_terms) // lookups)]
+    baseline = {'termid.json': {t: lex.term_id(t) for t in all_terms},
+                'idterm.json': {lex.term_id(t): t for t in all_terms},
+                'offset.json': {t: lex.offset_size(t) for t in all_terms},
+                'linenum.json': {t: lex.term_id(t) for t in all_terms}}
+    del lex
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, d in baseline.items():
+            with open(os.path.join(tmp, name), 'w') as f:
+                json.dump(d, f)
+        del baseline
+        tracemalloc.start()
+        start = time.perf_counter()
+        dicts = []
+        for name in ('termid.json', 'idterm.json', 'offset.json', 'linenum.json'):
+            with open(os.path.join(tmp, name)) as f:
+                dicts.append(json.load(f))
+        load = time.perf_counter() - start
+        heap = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+    start = time.perf_counter()
+    for t in terms:
+        dicts[2][t]
+    lookup = (time.perf_counter() - start) / len(terms)
+    del dicts
+    print("json    : load {:8.3f} ms  heap {:10d} bytes  lookup {:6.3f} us".format(
+        load * 1000, heap, lookup * 1e6))
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    lex = Lexicon('lexicon.dat')
+    load = time.perf_counter() - start
+    heap = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    start = time.perf_counter()
+    for t in terms:
+        lex.offset_size(t)
+    lookup = (time.perf_counter() - start) / len(terms)
+    print("lexicon : load {:8.3f} ms  heap {:10d} bytes  lookup {:6.3f} us".format(
+        load * 1000, heap, lookup * 1e6))
+
+
+def bench_formats(num_sets = 100):
+    """
+    The 100 query sets against the compressed index (vbyte + delta
+    decoding) and the binary uncompressed index (int32 views)
+    """
+    with QuerySession() as session:
+        session.read_ucmp_offset()
+        for compressed in (True, False):
+            start = time.perf_counter()
+            for i in range(num_sets):
+                session.query(i, compressed)
+            elapsed = (time.perf_counter() - start) / num_sets
+            print("{:<12}: {:9.3f} ms/query".format(
+                'compressed' if compressed else 'uncompressed', elapsed * 1000))
+
+
+def bench_codecs(terms = 2000):
+    """
+    Size and decode speed of each postings codec over the lists of the
+    terms with the most postings in indx.dat
+    """
+    from postings_codecs import CODECS
+    with QuerySession() as session:
+        ranked = sorted(session.offset.items(), key = lambda e: -e[1][1])[:terms]
+        lists = [session.vbyte_decoding(session.reader.read(o, s)) for t, (o, s) in ranked]
+    total = sum(len(l) for l in lists)
+    for name, codec in CODECS.items():
+        encoded = [codec.encode(l) for l in lists]
+        start = time.perf_counter()
+        for data in encoded:
+            codec.decode(data)
+        elapsed = time.perf_counter() - start
+        size = sum(len(d) for d in encoded)
+        print("{:<9}: {:10d} bytes {:6.2f} bits/int {:8.2f} M ints/s".format(
+            name, size, 8.0 * size / total, total / elapsed / 1e6))
+
+
+def naive_phrases(session, set_num, window = 1):
+    """
+    Decode both lists of every phrase completely, then match
+    """
+    res = dict()
+    for tid1, tid2 in zip(session.randomQueries[set_num], session.highestMatch[set_num]):
+        term1 = session.idtoterm[tid1]
+        term2 = session.idtoterm[tid2]
+        res[term1 + ' ' + term2] = list(phrase_matches(
+            ListCursor(session.postings(term1)), ListCursor(session.postings(term2)), window))
+    return res
+
+
+def bench_phrases(num_sets = 100, window = 1, common = 'the'):
+    """
+    The 7 phrases of each stored query set: full decoding vs lazy cursors
+    over indx.dat vs skipping over blk_indx.dat (if it has been built)
+    Then the same query terms paired with a very common term, where
+    skipping matters most
+    """
+    with QuerySession() as session:
+        runs = [('decode all', lambda i: naive_phrases(session, i, window)),
+                ('flat', lambda i: session.query_phrases(i, window, blocks = False))]
+        if session.block_reader is not None:
+            runs.append(('blocks', lambda i: session.query_phrases(i, window)))
+        time_phrase_runs(runs, num_sets)
+
+        def with_common(i, blocks):
+            return [session.phrase(session.idtoterm[tid], common, window, blocks = blocks)
+                    for tid in session.randomQueries[i]]
+        print("-- paired with '{}' --".format(common))
+        runs = [('decode all', lambda i: [list(phrase_matches(
+                    ListCursor(session.postings(session.idtoterm[tid])),
+                    ListCursor(session.postings(common)), window))
+                    for tid in session.randomQueries[i]]),
+                ('flat', lambda i: with_common(i, False))]
+        if session.block_reader is not None:
+            runs.append(('blocks', lambda i: with_common(i, True)))
+        time_phrase_runs(runs, num_sets)
+
+
+def time_phrase_runs(runs, num_sets):
+    expected = None
+    for name, run in runs:
+        start = time.perf_counter()
+        res = [run(i) for i in range(num_sets)]
+        elapsed = (time.perf_counter() - start) / num_sets
+        if expected is None:
+            expected = res
+        print("{:<12}: {:9.3f} ms/set  same result: {}".format(
+            name, elapsed * 1000, res == expected))
+
+
+def bench_ranking(num_sets = 100, k = 10, common = ('the', 'and', 'i')):
+    """
+    Top-k ranking of the stored query sets, then of the same sets with a
+    few very common terms added: exhaustive DAAT vs MaxScore, over the
+    flat index and over the block index (if it has been built)
+    """
+    with QuerySession() as session:
+        session.read_ranking_stats()
+        stored = [[session.idtoterm[tid] for tid in q] for q in session.randomQueries[:num_sets]]
+        for label, queries in (('stored sets', stored),
+                               ('with common terms', [q + list(common) for q in stored])):
+            print("-- {} --".format(label))
+            for model in ('bm25', 'ql'):
+                expected = None
+                for maxscore, blocks in ((False, False), (True, False), (True, True)):
+                    if blocks and session.block_reader is None:
+                        continue
+                    start = time.perf_counter()
+                    res = [session.search(q, k, model, maxscore, blocks) for q in queries]
+                    elapsed = (time.perf_counter() - start) / len(queries)
+                    if expected is None:
+                        expected = res
+                    same = [[d for d, s in r] for r in res] == [[d for d, s in r] for r in expected]
+                    print("{:<5} {:<10} {:<6}: {:9.3f} ms/query  same top {}: {}".format(
+                        model, 'maxscore' if maxscore else 'exhaustive',
+                        'blocks' if blocks else 'flat', elapsed * 1000, k, same))
+
+
+def naive_boolean(session, terms, operator):
+    """
+    Decode every list completely, then intersect / unite docId sets
+    """
+    sets = [set(ListCursor(session.postings(t)).docs) for t in terms]
+    if operator == 'and':
+        return sorted(set.intersection(*sets))
+    return sorted(set.union(*sets))
+
+
+def bench_boolean(num_sets = 100, first = 10):
+    """
+    AND / OR of the stored query sets, of each set's dice phrases (term
+    AND partner) and of the sets with 'the' added; full decoding vs the
+    lazy operators, and the lazy operators stopped after the first results
+    """
+    with QuerySession() as session:
+        sets = [[session.idtoterm[tid] for tid in q] for q in session.randomQueries[:num_sets]]
+        pairs = [[session.idtoterm[a], session.idtoterm[b]]
+                 for i in range(num_sets)
+                 for a, b in zip(session.randomQueries[i], session.highestMatch[i])]
+        for label, queries in (('stored sets', sets), ('phrase pairs', pairs),
+                               ("pairs + 'the'", [p + ['the'] for p in pairs])):
+            print("-- {} --".format(label))
+            for operator in ('and', 'or'):
+                lazy = session.boolean_and if operator == 'and' else session.boolean_or
+                runs = [('decode all', lambda q: naive_boolean(session, q, operator)),
+                        ('lazy', lambda q: list(lazy(q))),
+                        ('first {}'.format(first), lambda q: list(islice(lazy(q), first)))]
+                expected = None
+                for name, run in runs:
+                    start = time.perf_counter()
+                    res = [run(q) for q in queries]
+                    elapsed = (time.perf_counter() - start) / len(queries)
+                    if expected is None:
+                        expected = res
+                    same = all(r == e[:len(r)] for r, e in zip(res, expected))
+                    print("{:<3} {:<12}: {:9.3f} ms/query  {:7d} docs  same: {}".format(
+                        operator, name, elapsed * 1000, sum(len(r) for r in res), same))
+
+
+def bench_cache(num_sets = 100, sizes = (64 * 1024 * 1024, 256 * 1024)):
+    """
+    Replay the 100 stored sets without a cache, then with a cache of each
+    size: a cold pass followed by a warm one
+    """
+    with QuerySession() as session:
+        start = time.perf_counter()
+        for i in range(num_sets):
+            session.query(i)
+        print("{:<22}: {:9.3f} ms/set".format(
+            'no cache', (time.perf_counter() - start) / num_sets * 1000))
+    for size in sizes:
+        with QuerySession(cache_bytes = size) as session:
+            for label in ('cold', 'warm'):
+                start = time.perf_counter()
+                for i in range(num_sets):
+                    session.query(i)
+                elapsed = (time.perf_counter() - start) / num_sets
+                stats = session.cache.stats()
+                print("{:<22}: {:9.3f} ms/set  hits {} misses {} evictions {} ({} KB held)".format(
+                    '{} KB cache, {}'.format(size // 1024, label), elapsed * 1000,
+                    stats['hits'], stats['misses'], stats['evictions'], stats['bytes'] // 1024))
+
+
+def bench_batch(num_sets = 100, repeat = 3):
+    """
+    All stored sets as 1,400 separate lookups (Querier.query_compressed)
+    vs one batch (Querier.query_batch), each with the index file dropped
+    from the page cache first (cold) and then warm
+    """
+    from batch_fetch import coalesce_ranges, drop_file_cache
+    q = Querier()
+    q.read_term_ids()
+    q.read_offset_linenum()
+    q.load_term_and_phrase()
+    terms = set(q.idtoterm[t] for i in range(num_sets)
+                for t in q.randomQueries[i] + q.highestMatch[i])
+    reads = len(coalesce_ranges([(t,) + tuple(q.offset[t]) for t in terms]))
+    print("{} distinct terms, {} reads after coalescing".format(len(terms), reads))
+    expected = [q.query_compressed(i) for i in range(num_sets)]
+    runs = [('single lookups', lambda: [q.query_compressed(i) for i in range(num_sets)]),
+            ('batch', lambda: q.query_batch(range(num_sets)))]
+    for cold in (True, False):
+        for name, run in runs:
+            best = None
+            for r in range(repeat):
+                if cold:
+                    drop_file_cache('indx.dat')
+                start = time.perf_counter()
+                res = run()
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            print("{:<5} {:<15}: {:9.3f} ms for {} sets  same: {}".format(
+                'cold' if cold else 'warm', name, best * 1000, num_sets, res == expected))
+
+
+def bench_server(num_sets = 100, clients = (1, 4, 16), query = 'search'):
+    """
+    Start query_server.py, then have several concurrent clients send the
+    stored sets; reports throughput and the server-side latency
+    percentiles
+    """
+    import asyncio
+    from query_server import QueryClient
+    server = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'query_server.py')
+    proc = subprocess.Popen([sys.executable, server, '--port', '0'],
+                            stdout = subprocess.PIPE, text = True)
+    try:
+        line = proc.stdout.readline()
+        port = int(line.rsplit(':', 1)[1])
+
+        async def client(n):
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            latencies = []
+            for i in range(n, num_sets, nclients):
+                req = {'id': i, 'op': 'set', 'set_num': i, 'query': query}
+                writer.write(json.dumps(req).encode('utf-8') + b'\n')
+                await writer.drain()
+                resp = json.loads(await reader.readline())
+                latencies.append(resp['latency_ms'])
+            writer.close()
+            return latencies
+
+        async def run():
+            return await asyncio.gather(*[client(n) for n in range(nclients)])
+        for nclients in clients:
+            start = time.perf_counter()
+            lat = [l for res in asyncio.run(run()) for l in res]
+            elapsed = time.perf_counter() - start
+            p = np.percentile(lat, [50, 95, 99])
+            print("{:>3} clients: {:8.1f} queries/s  p50 {:7.3f}  p95 {:7.3f}  p99 {:7.3f} ms".format(
+                nclients, num_sets / elapsed, p[0], p[1], p[2]))
+        with QueryClient(port = port) as c:
+            print(c.request('stats')['result'])
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def bench_segments(batches = 8, batch_size = 10, num_sets = 100):
+    """
+    Time to add small batches of scenes as delta segments against a full
+    rebuild, and the stored set searches over many segments against the
+    same after compaction (in a copy of the index files)
+    """
+    import shutil
+    from ingest import iter_scenes
+    from segments import SegmentSet, create_manifest
+    rebuild = run_build({'single_pass': True, 'stream': True})
+    scenes = list(islice(iter_scenes('shakespeare-scenes.json.gz'), batches * batch_size))
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        for f in ('indx.dat', 'lexicon.dat', 'doc_table.dat', 'offset.json',
+                  'df.dat', 'random_term.txt', 'term_phrase.txt'):
+            shutil.copy(f, tmp)
+        os.chdir(tmp)
+        try:
+            create_manifest()
+            with SegmentSet() as segments:
+                start = time.perf_counter()
+                for i in range(batches):
+                    segments.add_scenes(scenes[i * batch_size:(i + 1) * batch_size])
+                add = (time.perf_counter() - start) / batches
+            print("full rebuild         : {:8.3f} s".format(rebuild['seconds']))
+            print("add {:3d} scenes       : {:8.3f} s".format(batch_size, add))
+
+            def time_search(session):
+                sets = [[session.idtoterm[t] for t in q] for q in session.randomQueries[:num_sets]]
+                session.search(sets[0])
+                start = time.perf_counter()
+                for terms in sets:
+                    session.search(terms)
+                return (time.perf_counter() - start) / len(sets) * 1000
+            with QuerySession() as session:
+                n = len(session.segments.segments)
+                print("search, {:2d} segments : {:8.3f} ms".format(n, time_search(session)))
+                start = time.perf_counter()
+                session.segments.compact(full = True)
+                merge = time.perf_counter() - start
+                n = len(session.segments.segments)
+                print("search, {:2d} segments : {:8.3f} ms  (compaction {:.3f} s)".format(
+                    n, time_search(session), merge))
+        finally:
+            os.chdir(cwd)
+
+
+def bench_plays(repeat = 1000):
+    """
+    Longest / shortest play from the play table against summing the
+    scene lengths per play in a dict, as get_longest_play used to
+    """
+    from plays import PlayTable
+    plays = PlayTable.load()
+    doc_length = dict(enumerate(plays.doc_length.tolist()))
+    play_map = {d: plays.play_of(d) for d in doc_length}
+    start = time.perf_counter()
+    for i in range(repeat):
+        lengths = dict()
+        for did, play in play_map.items():
+            lengths[play] = lengths.get(play, 0) + doc_length[did]
+        max(lengths, key = lengths.get), min(lengths, key = lengths.get)
+    walk = (time.perf_counter() - start) / repeat
+    start = time.perf_counter()
+    for i in range(repeat):
+        plays.longest_play()
+    table = (time.perf_counter() - start) / repeat
+    print("dict walk  : {:8.1f} us".format(walk * 1e6))
+    print("play table : {:8.1f} us  ({:.1f}x)".format(table * 1e6, walk / table))
+
+
+def bench_tokenize(corpus = 'shakespeare-scenes.json.gz', repeat = 3):
+    """
+    Indexing throughput in tokens/s over the corpus held in memory:
+    token lists into inv_index tuples (the in-memory pipeline before
+    interning), term id arrays into inv_index tuples (the pipeline now),
+    token lists into a PostingsBuilder, and term id arrays from
+    TermInterner into an InternedBuilder; best of repeat runs each
+    """
+    from builder import PostingsBuilder, InternedBuilder
+    from ingest import iter_scenes
+    from interner import TermInterner
+    from invindex import Indexer
+    scenes = [(scd['sceneNum'], scd['text']) for scd in iter_scenes(corpus)]
+    num_tokens = sum(len(tokenize(text)) for docId, text in scenes)
+
+    def inv_index():
+        ind = Indexer(corpus, 'indx.dat')
+        for docId, text in scenes:
+            ind.index_scene(docId, tokenize(text))
+
+    def inv_index_interned():
+        ind = Indexer(corpus, 'indx.dat')
+        for docId, text in scenes:
+            ind.index_ids(docId, ind.interner.encode(text))
+        ind.finish_index()
+
+    def token_lists():
+        builder = PostingsBuilder()
+        for docId, text in scenes:
+            builder.add_scene(docId, tokenize(text))
+        builder.term_frequency()
+
+    def interned():
+        interner = TermInterner()
+        builder = InternedBuilder(interner)
+        for docId, text in scenes:
+            builder.add_ids(docId, interner.encode(text))
+        builder.finish()
+        builder.term_frequency()
+
+    def tokenize_only():
+        for docId, text in scenes:
+            tokenize(text)
+
+    def encode_only():
+        interner = TermInterner()
+        for docId, text in scenes:
+            interner.encode(text)
+    runs = [('tokenize only', tokenize_only),
+            ('interning only', encode_only),
+            ('inv_index tuples', inv_index),
+            ('inv_index, ids', inv_index_interned),
+            ('PostingsBuilder', token_lists),
+            ('InternedBuilder', interned)]
+    for name, fn in runs:
+        best = None
+        for i in range(repeat):
+            start = time.perf_counter()
+            fn()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        print("{:<17}: {:7.3f} s  {:6.2f} M tokens/s".format(name, best, num_tokens / best / 1e6))
+
+
+BENCHMARKS = {
+    'session': bench_session,
+    'reader': bench_reader,
+    'vbyte': bench_vbyte,
+    'blocks': bench_blocks,
+    'tf': bench_tf,
+    'dice': bench_dice,
+    'build': bench_build,
+    'scaling': bench_scaling,
+    'lexicon': bench_lexicon,
+    'formats': bench_formats,
+    'codecs': bench_codecs,
+    'phrases': bench_phrases,
+    'ranking': bench_ranking,
+    'boolean': bench_boolean,
+    'cache': bench_cache,
+    'batch': bench_batch,
+    'server': bench_server,
+    'segments': bench_segments,
+    'plays': bench_plays,
+    'tokenize': bench_tokenize,
+}
+
+if __name__ == '__main__':
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        print("== {} ==".format(name))
+        BENCHMARKS[name]()
@@ -0,0 +1,182 @@
+"""
+File: blockindex.py
+Function: Block-based postings format with skip pointers.
+A term's compact list [docDelta, cnt, pos1, pos2..., docDelta2, cnt2...]
+is split into blocks of BLOCK_SIZE documents. Each term is stored as
+    header: vbyte [numBlocks, lastDocDelta1, blockSize1, lastDocDelta2, ...]
+    blocks: the vbyte bytes of the compact list, cut at document boundaries
+lastDocDelta is the last docId of a block minus the last docId of the
+previous block, and blockSize is the block's length in bytes. The first
+docDelta of a block is relative to the last docId of the previous block,
+so the blocks put together are exactly the flat indx.dat encoding of the
+term.
+A reader decodes the small header (the skip table) and then only the
+block that can hold the document it is looking for.
+"""
+import numpy as np
+
+from vbyte import vbyte_encode, vbyte_decode
+
+# documents per block
+BLOCK_SIZE = 64
+
+
+def split_docs(cmp_list):
+    """
+    Walk a compact list, yield (docId, start, end) for every document,
+    where cmp_list[start:end] is [docDelta, cnt, pos...] of that document
+    """
+    doc = 0
+    i = 0
+    while i < len(cmp_list):
+        doc += cmp_list[i]
+        end = i + 2 + cmp_list[i + 1]
+        yield doc, i, end
+        i = end
+
+
+def encode_block_postings(cmp_list, block_size = BLOCK_SIZE):
+    """
+    Encode a compact list in the block format, return a bytearray
+    """
+    docs = list(split_docs(cmp_list))
+    header = [0]
+    blocks = bytearray()
+    prev_last = 0
+    for b in range(0, len(docs), block_size):
+        chunk = docs[b:b + block_size]
+        start = chunk[0][1]
+        end = chunk[-1][2]
+        last = chunk[-1][0]
+        data = vbyte_encode(cmp_list[start:end])
+        header.extend([last - prev_last, len(data)])
+        blocks.extend(data)
+        prev_last = last
+        header[0] += 1
+    return vbyte_encode(header) + blocks
+
+
+def delta_decode_block(arry, base = 0):
+    """
+    Delta decode one block [docDelta, cnt, pos...] whose first docDelta is
+    relative to base. Returns [docID, cnt, pos1, pos2, ...] with absolute
+    docIDs and positions, like Querier.delta_decoding
+    """
+    res = []
+    doc = base
+    i = 0
+    while i < len(arry):
+        doc += arry[i]
+        cnt = arry[i + 1]
+        res.append(doc)
+        res.append(cnt)
+        pos = 0
+        for j in range(i + 2, i + 2 + cnt):
+            pos += arry[j]
+            res.append(pos)
+        i += 2 + cnt
+    return res
+
+
+def parse_skip_table(data):
+    """
+    Decode the header at the start of a term's data
+    Returns (last_docs, offsets, header_size): the last docId of every
+    block, the byte offset of every block relative to the end of the header
+    (one extra entry holds the total size), and the header length in bytes
+    """
+    num_blocks = None
+    values = []
+    pos = 0
+    res = 0
+    shift = 0
+    # stream decode until 1 + 2 * numBlocks numbers have been read
+    while num_blocks is None or len(values) < 2 * num_blocks:
+        b = data[pos]
+        pos += 1
+        res |= (b & 0x7F) << shift
+        if b & 0x80:
+            if num_blocks is None:
+                num_blocks = res
+            else:
+                values.append(res)
+            res = 0
+            shift = 0
+        else:
+            shift += 7
+    pairs = np.array(values, dtype = np.int64).reshape((-1, 2))
+    last_docs = np.cumsum(pairs[:, 0])
+    offsets = np.zeros(num_blocks + 1, dtype = np.int64)
+    np.cumsum(pairs[:, 1], out = offsets[1:])
+    return last_docs, offsets, pos
+
+
+def max_header_size(num_blocks):
+    """
+    Upper bound of the header size in bytes (5 bytes per 32-bit number)
+    """
+    return 5 * (1 + 2 * num_blocks)
+
+
+class BlockPostings:
+    """
+    Random access to one term's postings in the block format
+    data: the term's bytes (bytes, bytearray or memoryview)
+    """
+    def __init__(self, data):
+        self.data = data
+        self.last_docs, self.offsets, self.header_size = parse_skip_table(data)
+        self.num_blocks = len(self.last_docs)
+
+    def block_base(self, blk):
+        """
+        docId that the first docDelta of block blk is relative to
+        """
+        return int(self.last_docs[blk - 1]) if blk > 0 else 0
+
+    def block_bytes(self, blk):
+        start = self.header_size + self.offsets[blk]
+        end = self.header_size + self.offsets[blk + 1]
+        return self.data[start:end]
+
+    def decode_block(self, blk):
+        """
+        Decode block blk to [docID, cnt, pos1, ...] with absolute values
+        """
+        arry = vbyte_decode(self.block_bytes(blk))
+        return delta_decode_block(arry, self.block_base(blk))
+
+    def find_block(self, doc):
+        """
+        Index of the first block whose last docId is >= doc,
+        num_blocks if doc is past the end of the list
+        """
+        return int(np.searchsorted(self.last_docs, doc))
+
+    def find(self, doc):
+        """
+        Return the positions of doc, or None if the term is not in doc
+        Only the block that can hold doc is decoded
+        """
+        blk = self.find_block(doc)
+        if blk >= self.num_blocks:
+            return None
+        res = self.decode_block(blk)
+        i = 0
+        while i < len(res):
+            if res[i] == doc:
+                return res[i + 2:i + 2 + res[i + 1]]
+            if res[i] > doc:
+                return None
+            i += 2 + res[i + 1]
+        return None
+
+    def decode_all(self):
+        """
+        Decode every block, same result as Querier.delta_decoding over the
+        flat encoding
+        """
+        res = []
+        for blk in range(self.num_blocks):
+            res.extend(self.decode_block(blk))
+        return res
@@ -0,0 +1,270 @@
+"""
+File: builder.py
+Function: Defines the class PostingsBuilder, a single-pass builder of the
+          compressed index.
+Instead of going through inv_index -> delta_index -> cmp_index ->
+vbyte_index, each scene's postings are delta encoded, compacted and vbyte
+encoded as soon as the scene is added, and appended to one bytearray per
+term. The bytes of a term are exactly what Indexer.apply_vbyte produces
+for it, and terms keep the order of their first occurrence, so dumping the
+builder gives the same indx.dat and offset.json as the old pipeline.
+The docIds and counts for the tf table are kept in array('I') buffers.
+"""
+from array import array
+
+import numpy as np
+
+from vbyte import vbyte_encode, vbyte_encode_batch, vbyte_decode_batch
+from postings_codecs import index_header
+
+# rough bytes of Python object overhead per term held by the builder
+TERM_OVERHEAD = 400
+
+
+class PostingsBuilder:
+    def __init__(self):
+        # vbyte encoded [docDelta, cnt, pos1, posDelta2, ...] of each term
+        self.postings = dict()
+        # last docId added for each term
+        self.last_doc = dict()
+        # docIds each term occurs in
+        self.tf_docs = dict()
+        # count of each term in those docs
+        self.tf_counts = dict()
+        # running estimate of the memory held, see nbytes
+        self.size = 0
+
+    def add_scene(self, docId, tlist):
+        """
+        Add one tokenized scene. Scenes must come in increasing docId order
+        """
+        positions = dict()
+        for i in range(len(tlist)):
+            t = tlist[i]
+            if t not in positions:
+                positions[t] = array('I')
+            positions[t].append(i)
+        for t in positions:
+            pos = positions[t]
+            if t not in self.postings:
+                self.postings[t] = bytearray()
+                self.last_doc[t] = 0
+                self.tf_docs[t] = array('I')
+                self.tf_counts[t] = array('I')
+                self.size += TERM_OVERHEAD
+            # first position is absolute, the rest are deltas
+            entry = [docId - self.last_doc[t], len(pos), pos[0]]
+            for j in range(1, len(pos)):
+                entry.append(pos[j] - pos[j - 1])
+            data = vbyte_encode(entry)
+            self.postings[t].extend(data)
+            self.size += len(data) + 8
+            self.last_doc[t] = docId
+            self.tf_docs[t].append(docId)
+            self.tf_counts[t].append(len(pos))
+
+    def __len__(self):
+        return len(self.postings)
+
+    def term_frequency(self):
+        """
+        Collection frequency of every term
+        """
+        return {t: sum(self.tf_counts[t]) for t in self.tf_counts}
+
+    def iter_term_docs(self):
+        """
+        Yield (docIds, counts) of every term in index order, as ndarrays
+        """
+        for t in self.postings:
+            yield (np.frombuffer(self.tf_docs[t], dtype = np.uint32),
+                   np.frombuffer(self.tf_counts[t], dtype = np.uint32))
+
+    def extend(self, other):
+        """
+        Append the postings of another builder whose docIds all come after
+        the ones in this builder, e.g. the next shard of a parallel build
+        Its first docDelta of every term is rebased on our last docId
+        """
+        for t in other.postings:
+            data = other.postings[t]
+            if t not in self.postings:
+                self.postings[t] = data
+                self.tf_docs[t] = other.tf_docs[t]
+                self.tf_counts[t] = other.tf_counts[t]
+                self.size += TERM_OVERHEAD
+            else:
+                first = other.tf_docs[t][0]
+                self.postings[t].extend(vbyte_encode([first - self.last_doc[t]]))
+                self.postings[t].extend(data[first_number_size(data):])
+                self.tf_docs[t].extend(other.tf_docs[t])
+                self.tf_counts[t].extend(other.tf_counts[t])
+            self.last_doc[t] = other.last_doc[t]
+            self.size += len(data) + 8 * len(other.tf_docs[t])
+
+    def iter_partial(self, sort_terms = False):
+        """
+        Yield (term, firstDoc, lastDoc, df, cf, rest) for every term, where
+        rest is the term's bytes after its first docDelta (which, in a
+        fresh builder, is firstDoc itself). This is what partial indexes
+        over a docId range hand over for merging, see join_partials
+        """
+        terms = sorted(self.postings) if sort_terms else self.postings
+        for t in terms:
+            data = self.postings[t]
+            yield (t, self.tf_docs[t][0], self.last_doc[t], len(self.tf_docs[t]),
+                   sum(self.tf_counts[t]), data[first_number_size(data):])
+
+    def nbytes(self):
+        """
+        Rough size in bytes of the buffers held by the builder
+        """
+        return self.size
+
+    def dump(self, filename, codec = None):
+        """
+        Write every term's bytes to filename
+        codec: a PostingsCodec other than vbyte re-encodes every list and
+        starts the file with its index header
+        Returns the (term, (offset, size)) dictionary
+        """
+        offsets = dict()
+        header = b'' if codec is None else index_header(codec)
+        offset = len(header)
+        with open(filename, 'wb') as bf:
+            bf.write(header)
+            for t in self.postings:
+                data = transcode(self.postings[t], codec)
+                bf.write(data)
+                offsets[t] = (offset, len(data))
+                offset += len(data)
+        return offsets
+
+
+class InternedBuilder(PostingsBuilder):
+    """
+    PostingsBuilder fed with term id arrays from a TermInterner
+    Each scene is grouped by term with one stable argsort, its entries
+    [docDelta, cnt, pos1, posDelta...] are built and vbyte encoded as
+    arrays, and only the per-term appends are left in Python (once per
+    distinct term of a scene, not once per token). The tf table is kept
+    as (term ids, counts) arrays per scene and grouped in finish().
+    After finish() the builder holds the same postings, tf_docs and
+    tf_counts as a PostingsBuilder given the same scenes as token lists
+    """
+    def __init__(self, interner):
+        PostingsBuilder.__init__(self)
+        self.interner = interner
+        # vbyte bytes of every term id
+        self.lists = []
+        # last docId of every term id
+        self.last = np.zeros(0, dtype = np.int64)
+        # per scene: docId, the term ids in it and their counts
+        self.scene_docs = []
+        self.scene_tids = []
+        self.scene_counts = []
+
+    def add_ids(self, docId, ids):
+        """
+        Add one scene given as term ids. Scenes must come in increasing
+        docId order
+        """
+        num_terms = len(self.interner)
+        if len(self.lists) < num_terms:
+            self.lists.extend(bytearray() for i in range(num_terms - len(self.lists)))
+            self.last = np.concatenate((self.last, np.zeros(num_terms - len(self.last),
+                                                            dtype = np.int64)))
+        if not len(ids):
+            return
+        # positions grouped by term id, ascending inside every group
+        order = np.argsort(ids, kind = 'stable')
+        tids, starts, counts = np.unique(ids[order], return_index = True, return_counts = True)
+        # first position absolute, the rest deltas
+        pos = np.diff(order, prepend = 0)
+        pos[starts] = order[starts]
+        # two header numbers in front of every group
+        heads = starts + 2 * np.arange(len(tids))
+        vals = np.empty(len(ids) + 2 * len(tids), dtype = np.int64)
+        is_pos = np.ones(len(vals), dtype = bool)
+        is_pos[heads] = False
+        is_pos[heads + 1] = False
+        vals[heads] = docId - self.last[tids]
+        vals[heads + 1] = counts
+        vals[is_pos] = pos
+        data, nbytes = vbyte_encode_batch(vals)
+        byte_ends = np.concatenate(([0], np.cumsum(nbytes)))
+        cuts = byte_ends[np.append(heads, len(vals))].tolist()
+        data = data.tobytes()
+        lists = self.lists
+        for k, t in enumerate(tids.tolist()):
+            lists[t] += data[cuts[k]:cuts[k + 1]]
+        self.last[tids] = docId
+        self.scene_docs.append(docId)
+        self.scene_tids.append(tids)
+        self.scene_counts.append(counts)
+        self.size += len(data) + 8 * len(tids)
+
+    def finish(self):
+        """
+        Key everything by term, in term id order, so the PostingsBuilder
+        methods (dump, term_frequency, iter_term_docs...) work
+        """
+        terms = self.interner.terms()[:len(self.lists)]
+        self.postings = dict(zip(terms, self.lists))
+        self.last_doc = dict(zip(terms, self.last.tolist()))
+        if self.scene_tids:
+            tids = np.concatenate(self.scene_tids)
+            counts = np.concatenate(self.scene_counts).astype(np.uint32)
+            docs = np.repeat(np.array(self.scene_docs, dtype = np.uint32),
+                             [len(t) for t in self.scene_tids])
+        else:
+            tids = np.zeros(0, dtype = np.int64)
+            counts = docs = np.zeros(0, dtype = np.uint32)
+        self.cf = np.bincount(tids, weights = counts, minlength = len(terms)).astype(np.int64)
+        # stable, so every term's docs stay in docId order
+        order = np.argsort(tids, kind = 'stable')
+        bounds = np.searchsorted(tids[order], np.arange(len(terms) + 1)).tolist()
+        docs = docs[order]
+        counts = counts[order]
+        self.tf_docs = dict()
+        self.tf_counts = dict()
+        for i, t in enumerate(terms):
+            self.tf_docs[t] = docs[bounds[i]:bounds[i + 1]]
+            self.tf_counts[t] = counts[bounds[i]:bounds[i + 1]]
+
+    def term_frequency(self):
+        return dict(zip(self.postings, self.cf.tolist()))
+
+
+def transcode(data, codec):
+    """
+    Re-encode vbyte bytes with codec (nothing to do for vbyte)
+    """
+    if codec is None or codec.name == 'vbyte':
+        return data
+    return codec.encode(vbyte_decode_batch(data).tolist())
+
+
+def first_number_size(data):
+    """
+    Length in bytes of the first vbyte number of data
+    """
+    i = 0
+    while not data[i] & 0x80:
+        i += 1
+    return i + 1
+
+
+def join_partials(parts):
+    """
+    Join one term's partial postings from consecutive docId ranges
+    parts: (firstDoc, lastDoc, rest) in docId order, as from iter_partial
+    Each part's first docDelta is rebased on the previous part's last docId
+    """
+    res = bytearray()
+    prev_last = 0
+    for first, last, rest in parts:
+        res.extend(vbyte_encode([first - prev_last]))
+        res.extend(rest)
+        prev_last = last
+    return res
@@ -0,0 +1,117 @@
+"""
+File: dice.py
+Function: Defines the class DiceEngine, which finds the top-k Dice
+          coefficient partners of every term from the sparse tf table.
+Dice(a, b) = 2 n_ab / (n_a + n_b), where n_ab is the number of documents
+holding both terms. n_ab for a chunk of terms is the boolean product of
+their rows with the transposed table: every (term, doc) entry of the chunk
+is expanded into the terms of that doc and the pairs are counted with
+np.bincount. Chunks are sized so the work arrays stay under a memory
+budget, instead of building the V x V matrix at once.
+The result is a neighbor table: for every term id the ids of its k best
+partners (best first, ties to the lower id, -1 if there is none) and
+their scores.
+"""
+import numpy as np
+
+# bytes the work arrays of one chunk may use
+MEMORY_BUDGET = 64 * 1024 * 1024
+
+
+class DiceEngine:
+    def __init__(self, tf, memory_budget = MEMORY_BUDGET):
+        # CSRMatrix of shape #term x #doc
+        self.tf = tf
+        self.memory_budget = memory_budget
+        self.num_terms = tf.shape[0]
+        self.df = tf.row_nnz()
+        indices = np.asarray(tf.indices)
+        # transpose: the term ids of every doc, grouped by doc
+        rows = np.repeat(np.arange(self.num_terms, dtype = np.int32), self.df)
+        order = np.argsort(indices, kind = 'stable')
+        self.doc_terms = rows[order]
+        self.doc_ptr = np.zeros(tf.shape[1] + 1, dtype = np.int64)
+        np.cumsum(np.bincount(indices, minlength = tf.shape[1]), out = self.doc_ptr[1:])
+
+    def row_cost(self):
+        """
+        Number of (term, term) pairs each row expands to
+        """
+        doc_len = np.diff(self.doc_ptr)
+        cum = np.zeros(len(self.tf.indices) + 1, dtype = np.int64)
+        np.cumsum(doc_len[np.asarray(self.tf.indices)], out = cum[1:])
+        indptr = np.asarray(self.tf.indptr)
+        return cum[indptr[1:]] - cum[indptr[:-1]]
+
+    def chunks(self):
+        """
+        Yield (first, last) row ranges whose work arrays fit the budget
+        """
+        # nab and dice are #rows x V 8-byte arrays, the pair arrays are
+        # 8 bytes per expanded pair
+        row_bytes = 16 * self.num_terms
+        costs = 8 * self.row_cost()
+        first = 0
+        used = 0
+        for row in range(self.num_terms):
+            need = row_bytes + costs[row]
+            if row > first and used + need > self.memory_budget:
+                yield first, row
+                first = row
+                used = 0
+            used += need
+        if first < self.num_terms:
+            yield first, self.num_terms
+
+    def co_occurrence(self, first, last):
+        """
+        n_ab for rows first..last-1 against every term, shape (rows, V)
+        """
+        indptr = np.asarray(self.tf.indptr)
+        lo, hi = indptr[first], indptr[last]
+        docs = np.asarray(self.tf.indices[lo:hi])
+        rows = np.repeat(np.arange(last - first), np.diff(indptr[first:last + 1]))
+        # expand every (row, doc) entry into the terms of doc
+        starts = self.doc_ptr[docs]
+        lengths = self.doc_ptr[docs + 1] - starts
+        total = int(lengths.sum())
+        ends = np.cumsum(lengths)
+        take = np.arange(total) - np.repeat(ends - lengths - starts, lengths)
+        keys = np.repeat(rows, lengths) * self.num_terms + self.doc_terms[take]
+        nab = np.bincount(keys, minlength = (last - first) * self.num_terms)
+        return nab.reshape((last - first, self.num_terms))
+
+    def top_k(self, k = 1):
+        """
+        Return (neighbors, scores): int32 and float32 arrays of shape (V, k)
+        """
+        neighbors = np.full((self.num_terms, k), -1, dtype = np.int32)
+        scores = np.zeros((self.num_terms, k), dtype = np.float32)
+        kk = min(k, self.num_terms - 1)
+        if kk <= 0:
+            return neighbors, scores
+        df = self.df.astype(np.float64)
+        for first, last in self.chunks():
+            nab = self.co_occurrence(first, last)
+            dice = 2.0 * nab / (df[first:last, None] + df[None, :])
+            # a term is not its own partner
+            dice[np.arange(last - first), np.arange(first, last)] = -1.0
+            kth = np.partition(dice, self.num_terms - kk, axis = 1)[:, self.num_terms - kk]
+            for i in range(last - first):
+                # every candidate tied with the k-th best, in id order, then
+                # a stable sort so ties go to the lower id
+                cand = np.flatnonzero((dice[i] >= kth[i]) & (dice[i] > 0))
+                cand = cand[np.argsort(-dice[i, cand], kind = 'stable')][:kk]
+                neighbors[first + i, :len(cand)] = cand
+                scores[first + i, :len(cand)] = dice[i, cand]
+        return neighbors, scores
+
+
+def save_neighbors(neighbors, scores, prefix = 'dice'):
+    np.save(prefix + '_neighbors.npy', neighbors)
+    np.save(prefix + '_scores.npy', scores)
+
+
+def load_neighbors(prefix = 'dice', mmap_mode = 'r'):
+    return (np.load(prefix + '_neighbors.npy', mmap_mode = mmap_mode),
+            np.load(prefix + '_scores.npy', mmap_mode = mmap_mode))
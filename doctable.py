@@ -0,0 +1,123 @@
+"""
+File: doctable.py
+Function: Binary document table (doc_table.dat): per-scene lengths,
+          sceneIds and plays, with the collection statistics ranking
+          needs, so nothing has to go back to the corpus.
+Layout, little-endian, every array starting on its natural alignment:
+    header   : magic b'DOC1', uint32 numDocs, uint32 numPlays, 4 bytes pad,
+               uint64 totalTokens, float64 avgLength,
+               uint64 sceneBlobSize, uint64 playBlobSize
+    uint64   : sceneOffsets[numDocs + 1]  sceneId of doc d is
+                                          sceneBlob[sceneOffsets[d]:sceneOffsets[d+1]]
+    uint64   : playOffsets[numPlays + 1]  same for the playIds in playBlob
+    uint64   : playLength[numPlays]       tokens of every play
+    uint32   : length[numDocs]            tokens of every scene
+    uint32   : play[numDocs]              play number of every scene
+    bytes    : sceneBlob, playBlob        utf-8 ids, concatenated
+Rows are indexed by docId; plays are numbered in order of their first
+scene. The file is memory-mapped; the arrays are np.frombuffer views.
+"""
+import mmap
+import struct
+
+import numpy as np
+
+MAGIC = b'DOC1'
+HEADER = struct.Struct('<4sII4xQdQQ')
+
+
+def write_doc_table(filename, doc_length, sce_map, play_map):
+    """
+    doc_length, sce_map, play_map: docId -> length / sceneId / playId
+    (Indexer.doc_length, sce_map and play_map) for docIds 0..n-1
+    """
+    n = len(doc_length)
+    lengths = np.array([doc_length[d] for d in range(n)], dtype = '<u4')
+    plays = []
+    play_num = dict()
+    doc_play = np.zeros(n, dtype = '<u4')
+    for d in range(n):
+        p = play_map.get(d)
+        if p not in play_num:
+            play_num[p] = len(plays)
+            plays.append(p)
+        doc_play[d] = play_num[p]
+    play_length = np.bincount(doc_play, weights = lengths,
+                              minlength = len(plays)).astype('<u8')
+    scene_bytes = [str(sce_map.get(d, '')).encode('utf-8') for d in range(n)]
+    play_bytes = [str(p).encode('utf-8') for p in plays]
+    scene_offsets = np.zeros(n + 1, dtype = '<u8')
+    np.cumsum([len(b) for b in scene_bytes], out = scene_offsets[1:])
+    play_offsets = np.zeros(len(plays) + 1, dtype = '<u8')
+    np.cumsum([len(b) for b in play_bytes], out = play_offsets[1:])
+    total = int(lengths.sum())
+    scene_blob = b''.join(scene_bytes)
+    play_blob = b''.join(play_bytes)
+    with open(filename, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, n, len(plays), total, total / n if n else 0.0,
+                            len(scene_blob), len(play_blob)))
+        for a in (scene_offsets, play_offsets, play_length, lengths, doc_play):
+            f.write(a.tobytes())
+        f.write(scene_blob)
+        f.write(play_blob)
+
+
+class DocTable:
+    def __init__(self, filename = 'doc_table.dat'):
+        self.filename = filename
+        with open(filename, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+        (magic, n, num_plays, self.total_tokens, self.avg_length,
+         scene_blob, play_blob) = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC:
+            raise ValueError("{} is not a doc table file".format(filename))
+        self.num_docs = n
+        self.num_plays = num_plays
+        pos = HEADER.size
+
+        def take(dtype, count):
+            nonlocal pos
+            a = np.frombuffer(self.mm, dtype = dtype, count = count, offset = pos)
+            pos += a.nbytes
+            return a
+        self.scene_offsets = take('<u8', n + 1)
+        self.play_offsets = take('<u8', num_plays + 1)
+        self.play_length = take('<u8', num_plays)
+        self.length = take('<u4', n)
+        self.doc_play = take('<u4', n)
+        self.scene_start = pos
+        self.play_start = pos + scene_blob
+
+    def __len__(self):
+        return self.num_docs
+
+    def scene_id(self, docId):
+        start = self.scene_start + int(self.scene_offsets[docId])
+        end = self.scene_start + int(self.scene_offsets[docId + 1])
+        return self.mm[start:end].decode('utf-8')
+
+    def play_name(self, play):
+        start = self.play_start + int(self.play_offsets[play])
+        end = self.play_start + int(self.play_offsets[play + 1])
+        return self.mm[start:end].decode('utf-8')
+
+    def play_id(self, docId):
+        return self.play_name(int(self.doc_play[docId]))
+
+    def longest_scene(self):
+        """
+        (sceneId, length) of the longest and of the shortest scene, the
+        first one on ties, as Indexer.get_longest_scene
+        """
+        i = int(np.argmax(self.length))
+        j = int(np.argmin(self.length))
+        return (self.scene_id(i), int(self.length[i]), self.scene_id(j), int(self.length[j]))
+
+    def longest_play(self):
+        """
+        (playId, length) of the longest and of the shortest play
+        """
+        i = int(np.argmax(self.play_length))
+        j = int(np.argmin(self.play_length))
+        return (self.play_name(i), int(self.play_length[i]),
+                self.play_name(j), int(self.play_length[j]))
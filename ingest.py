@@ -0,0 +1,67 @@
+"""
+File: ingest.py
+Function: Incremental reading of the scene corpus.
+The corpus is one json object {"corpus": [scene, scene, ...]}, either
+plain or gzipped (shakespeare-scenes.json.gz). iter_scenes walks the
+scene list and yields one scene dictionary at a time, so only the scene
+being decoded and a small read buffer are ever in memory.
+"""
+import gzip
+import json
+import re
+
+# characters read from the file at a time
+CHUNK_SIZE = 1 << 16
+
+CORPUS_START = re.compile(r'"corpus"\s*:\s*\[')
+WHITESPACE = re.compile(r'[\s,]*')
+
+
+def open_corpus(filename):
+    """
+    Open a corpus file for reading text, gunzipping it if it ends in .gz
+    """
+    if filename.endswith('.gz'):
+        return gzip.open(filename, 'rt', encoding = 'utf-8')
+    return open(filename, encoding = 'utf-8')
+
+
+def iter_scenes(filename, chunk_size = CHUNK_SIZE):
+    """
+    Yield the scene dictionaries of the corpus one by one
+    """
+    decoder = json.JSONDecoder()
+    with open_corpus(filename) as f:
+        buf = ''
+        eof = False
+        # find the start of the scene list
+        while True:
+            m = CORPUS_START.search(buf)
+            if m:
+                pos = m.end()
+                break
+            if eof:
+                raise ValueError("no corpus list in {}".format(filename))
+            data = f.read(chunk_size)
+            eof = not data
+            buf += data
+        while True:
+            pos = WHITESPACE.match(buf, pos).end()
+            if pos < len(buf) and buf[pos] == ']':
+                return
+            try:
+                scene, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                # the next scene is not complete in the buffer yet
+                if eof:
+                    raise
+                data = f.read(chunk_size)
+                eof = not data
+                buf = buf[pos:] + data
+                pos = 0
+                continue
+            yield scene
+            pos = end
+            if pos > chunk_size:
+                buf = buf[pos:]
+                pos = 0
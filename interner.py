@@ -0,0 +1,37 @@
+"""
+File: interner.py
+Function: Defines the class TermInterner, the tokenizer of the single
+          pass build.
+Tokens get an integer term id the first time they are seen, through one
+dictionary lookup per token, and every scene comes out as an int32 array
+of term ids. Ids are given in order of first occurrence in the corpus,
+which is also the order the builders keep terms in, so they are the term
+ids of the index.
+Tokens are what inv_util.tokenize gives: the text split on single
+spaces, empty strings dropped.
+"""
+import numpy as np
+
+
+class TermInterner:
+    def __init__(self):
+        # term -> id; insertion order is id order
+        self.ids = dict()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def encode(self, text):
+        """
+        Term ids of the tokens of text, as an int32 array
+        """
+        ids = self.ids
+        # len(ids) is the next id when t is new
+        return np.array([ids.setdefault(t, len(ids)) for t in text.split(" ") if t],
+                        dtype = np.int32)
+
+    def terms(self):
+        """
+        Every term, in id order
+        """
+        return list(self.ids)
@@ -5,3 +5,6 @@ def jsonKeys2int(x):
     if isinstance(x, dict):
             return {int(k):v for k,v in x.items()}
     return x
+
+def tokenize(text):
+    return list(filter(None, text.split(" ")))
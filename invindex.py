@@ -18,6 +18,8 @@ For each Lists do sth!
 """
 
 import json
+import gzip
+import os
 # from pprint import pprint
 import linecache
 import numpy as np
@@ -25,13 +27,45 @@ import numpy as np
 
 # self-defined
 from inv_util import *
+from vbyte import vbyte_encode, vbyte_decode
+from blockindex import BLOCK_SIZE, encode_block_postings
+from tfmatrix import CSRMatrix
+from ingest import iter_scenes
+from builder import InternedBuilder
+from interner import TermInterner
+from spimi import SpimiIndexer
+from parallel import ParallelIndexBuilder
+from lexicon import Lexicon, write_lexicon
+from postings_codecs import get_codec, index_header
+from postings_reader import PostingsReader
+from segments import MANIFEST, SegmentSet, create_manifest
+from plays import PlayTable
+from doctable import write_doc_table
+
+def count_docs(lst):
+    """
+    Number of documents in a compact list [doc, cnt, pos1, ...]
+    """
+    n = 0
+    i = 0
+    while i < len(lst):
+        n += 1
+        i += 2 + lst[i + 1]
+    return n
+
 
 class Indexer:
     def __init__(self,
                  infilename,  # the file that feeds the program with json data
                  outfilename, # the one that used for dumping indexes
                  flag = True,
-                 verbose = False):
+                 verbose = False,
+                 block_size = 0, # > 0: also dump the block index
+                 stream = False, # index scenes while reading the corpus
+                 single_pass = False, # encode postings as scenes are added
+                 memory_budget = 0, # > 0: build on disk in runs of this many bytes
+                 workers = 0, # > 0: build with this many processes
+                 codec = 'vbyte'): # postings codec, see postings_codecs.py
         # a list of scenes, each element is a dictionary
         self.scenes = None
         # doc length
@@ -44,19 +78,46 @@ class Indexer:
         self.delta_index = dict()
         # need another map of (docID, sceneID)
         self.sce_map = dict()
+        # map of (docID, playID)
+        self.play_map = dict()
+        # read the corpus incrementally and drop each scene once indexed
+        self.stream = stream
+        # build the compressed index with InternedBuilder, skipping
+        # inv_index, delta_index, cmp_index and vbyte_index
+        self.single_pass = single_pass
+        # the builder holding the postings of the single pass (InternedBuilder)
+        # or parallel (PostingsBuilder) build
+        self.builder = None
+        # tokenizer of the pipeline build: scenes become term id arrays
+        self.interner = TermInterner()
+        # (docId, pos) lists of the pipeline build by term id, keyed by
+        # term into inv_index once every scene is in
+        self.id_lists = []
+        # memory budget in bytes of the external memory (SPIMI) build,
+        # 0 means build in memory
+        self.memory_budget = memory_budget
+        # worker processes of the parallel build, 0 means serial
+        self.workers = workers
         # compact index of the structure [docId, wordCount, pos1, pos2...]
         self.cmp_index = dict()
         # uncompressed index
         self.ucmp_index = dict()
         # a flag that indicates whether to compress or not
         self.compress = flag
-        # vbyte encoded index
+        # vbyte encoded index (encoded with self.codec)
         self.vbyte_index = dict()
+        # codec used for the postings in the compressed index
+        self.codec = get_codec(codec)
+        # documents per block of the block index, 0 means no block index
+        self.block_size = block_size
+        # block index file offset and size (term, (offset, size))
+        self.block_offset_size = dict()
         # vocabulary (term, term frequency)
         self.vocabulary = dict()
         # file offset and size (term, (offset, size))
         self.term_offset_size = dict()
-        # uncompressed file line number (term, linenumber)
+        # uncompressed file row (term, row of ucmp_offset.npy), rows follow
+        # the inv_index order, which is also the term id order
         self.ucmp_linenum = dict()
         # term frequency
         self.term_frequency = dict()
@@ -70,29 +131,19 @@ class Indexer:
         self.termtoid = dict()
         # id to term
         self.idtoterm = dict()
-        # tf table ndarray
+        # tf table, sparse (CSRMatrix of shape #term x #doc)
         self.tf = None
         # df array
         self.df = None
+        # scenes grouped into plays (PlayTable), built on first use
+        self.plays = None
 
 
     def get_longest_scene(self):
         """
         Get the longest scene name and play name
         """
-        # get longest scene
-        scene_max = 0
-        scene_longest = 0
-
-        scene_min = 100000
-        scene_shortest = 0
-        for did in self.doc_length:
-            if self.doc_length[did] > scene_max:
-                scene_max = self.doc_length[did]
-                scene_longest = did
-            if self.doc_length[did] < scene_min:
-                scene_min = self.doc_length[did]
-                scene_shortest = did
+        scene_longest, scene_max, scene_shortest, scene_min = self.play_table().longest_scene()
         longest_name = self.sce_map[scene_longest]
         shortest_name = self.sce_map[scene_shortest]
 
@@ -100,83 +151,312 @@ class Indexer:
         return (longest_name, scene_max, shortest_name, scene_min)
 
     def get_longest_play(self):
-        play_length_dic = dict()
-        for sce in self.scenes:
-            if sce['playId'] not in play_length_dic:
-                play_length_dic[sce['playId']] = self.doc_length[sce['sceneNum']]
-            else:
-                play_length_dic[sce['playId']] += self.doc_length[sce['sceneNum']]
-
-        play_max = 0
-        longest_name = None
-        
-        play_min = 100000
-        shortest_name = None
-        for play in play_length_dic:
-            if play_length_dic[play] > play_max:
-                play_max = play_length_dic[play]
-                longest_name = play
-            if play_length_dic[play] < play_min:
-                play_min = play_length_dic[play]
-                shortest_name = play
-        return (longest_name, play_max, shortest_name, play_min)
-            
+        return self.play_table().longest_play()
+
+    def play_table(self):
+        """
+        The PlayTable of the scenes indexed so far, built once (with
+        play-level postings if the tf table is there)
+        """
+        if self.plays is None or len(self.plays.doc_play) != len(self.doc_length) \
+                or (self.plays.tf is None and self.tf is not None):
+            self.plays = PlayTable.build(self.play_map, self.doc_length, self.tf)
+        return self.plays
+
+    def dump_plays(self, prefix = 'play'):
+        """
+        Save the play-level tf table, see plays.py
+        """
+        self.play_table().save(prefix)
 
     def count_tf_df(self):
         """
         Count term frequency and document frequency
+        tf is built straight from self.inv_index as a sparse CSR table,
+        one row per term id, in one pass over the postings
+        """
+        column_size = len(self.doc_length) # get how many documents
+        self.tf = CSRMatrix.from_rows(self.iter_term_docs(), column_size)
+        self.df = self.tf.row_nnz().astype(int)
+
+    def iter_term_docs(self):
+        """
+        Assign term ids in self.inv_index order and yield, for every term,
+        the docIds it occurs in and its count in each of them
         """
+        if self.builder is not None:
+            for tmid, term in enumerate(self.builder.postings):
+                self.termtoid[term] = tmid
+                self.idtoterm[tmid] = term
+            yield from self.builder.iter_term_docs()
+            return
+        if not self.inv_index and self.term_offset_size:
+            # external build: no postings in memory, read them back
+            yield from self.iter_index_docs()
+            return
         tmid = 0
-        row_size = len(self.inv_index.keys()) # get how many terms in total
-        column_size = len(self.scenes) # get how many documents
-        self.tf = np.zeros(shape = (row_size, column_size), dtype = int) # build the table
-        self.df = np.zeros(row_size, dtype = int)
         for term in self.inv_index:
             # store the tmid and term
             self.termtoid[term] = tmid
             self.idtoterm[tmid] = term
-            # update the row
-            for t in self.inv_index[term]: # for each tuple
-                if self.tf[tmid][t[0]] == 0: # first time increment
-                    self.df[tmid] += 1
-                self.tf[tmid][t[0]] += 1
+            docs = np.fromiter((t[0] for t in self.inv_index[term]), dtype = np.int32)
+            # postings are sorted by docId, so counting runs is enough
+            yield np.unique(docs, return_counts = True)
             tmid += 1
 
+    def iter_index_docs(self):
+        """
+        iter_term_docs for an index that is only on disk (build_external):
+        every list is decoded from self.dump_file in turn, terms in file order
+        """
+        reader = PostingsReader(self.dump_file)
+        for tmid, term in enumerate(self.term_offset_size):
+            self.termtoid[term] = tmid
+            self.idtoterm[tmid] = term
+            vals = self.codec.decode(reader.read(*self.term_offset_size[term])).tolist()
+            docs = []
+            counts = []
+            doc = 0
+            i = 0
+            while i < len(vals):
+                # [docDelta, cnt, pos1, posDelta2, ...]
+                doc += vals[i]
+                docs.append(doc)
+                counts.append(vals[i + 1])
+                i += 2 + vals[i + 1]
+            yield docs, counts
+        reader.close()
+
     def dump_tfdf(self):
-        with open('termid.json', 'w') as f:
-            json.dump(self.termtoid, f)
-        with open('idterm.json', 'w') as f:
-            json.dump(self.idtoterm, f)
-        with open('tf.dat', 'w') as f:
-            # dump ndarray
-            self.tf.tofile(f)
-            # read this with np.fromfile(fobj, dtype = int)
+        # term <-> id, offsets, df and cf all go to lexicon.dat
+        self.dump_lexicon()
+        # tf_indptr.npy, tf_indices.npy, tf_data.npy, tf_shape.npy
+        # read this with CSRMatrix.load('tf')
+        self.tf.save('tf')
         with open('df.dat', 'w') as f:
             # dump list
             self.df.tofile(f)
+        self.dump_doc_table()
+        self.dump_plays()
+
+    def dump_doc_table(self, filename = 'doc_table.dat'):
+        """
+        Save doc lengths, sceneIds, plays and the collection statistics
+        in one binary file, see doctable.py; the only copy of them on disk
+        """
+        write_doc_table(filename, self.doc_length, self.sce_map, self.play_map)
+
+    def set_term_ids(self, terms, df):
+        """
+        Number terms in the given order, with their df
+        """
+        self.termtoid = {t: i for i, t in enumerate(terms)}
+        self.idtoterm = {i: t for i, t in enumerate(terms)}
+        self.df = np.array(df, dtype = int)
+
+    def dump_lexicon(self, filename = 'lexicon.dat'):
+        """
+        Save the binary term dictionary, see lexicon.py
+        Needs term ids and df, i.e. count_tf_df (or build_external) first
+        An uncompressed build has no offsets of its own: it keeps the ones
+        into indx.dat of the lexicon already there
+        """
+        cf = [self.term_frequency.get(self.idtoterm[i], 0) for i in range(len(self.idtoterm))]
+        offsets = self.term_offset_size
+        if not offsets and os.path.exists(filename):
+            old = Lexicon(filename)
+            offsets = {t: old.offset_size(t) for t in old.terms()}
+            del old
+        offsets = {t: offsets.get(t, (0, 0)) for t in self.termtoid}
+        write_lexicon(filename, self.termtoid, offsets, self.df, cf)
             
 
 
     def build_and_save(self):
-        # read in the json file
-        self.readIn()
-        # do some preprocessing
-        self.prepocess_scenes()
-        # build the inverted index
-        self.build_inverted_index()
+        if self.memory_budget > 0 and self.compress:
+            self.build_external()
+            return
+        if self.workers > 0 and self.compress:
+            self.build_parallel()
+            return
+        if self.single_pass and self.compress:
+            self.build_single_pass()
+            return
+        if self.stream:
+            # read, tokenize and index one scene at a time
+            self.read_and_index()
+        else:
+            # read in the json file
+            self.readIn()
+            # do some preprocessing
+            self.prepocess_scenes()
+            # build the inverted index
+            self.build_inverted_index()
         # if compress tag set to true, compress it
         if self.compress:
             self.delta_encoding()
             self.compact_index()
             self.apply_vbyte()
             self.dump_compressed_index()
+            if self.block_size > 0:
+                self.dump_block_index()
         # then dump the index to file
         else:
             self.process_uncompressed_index()
             self.dump_index()
 
+    def build_single_pass(self):
+        """
+        Build and dump the compressed index in one pass over the scenes
+        Gives the same indx.dat and offset.json as the delta_encoding,
+        compact_index, apply_vbyte, dump_compressed_index pipeline
+        Scenes are tokenized straight into term id arrays (interner.py)
+        """
+        interner = TermInterner()
+        self.builder = InternedBuilder(interner)
+        for docId, text in self.iter_raw_scenes():
+            ids = interner.encode(text)
+            self.doc_length[docId] = len(ids)
+            self.builder.add_ids(docId, ids)
+        self.builder.finish()
+        self.dump_builder()
+
+    def build_parallel(self):
+        """
+        Single pass build sharded over self.workers processes with
+        ParallelIndexBuilder; the output is byte-identical to the serial
+        build
+        """
+        pib = ParallelIndexBuilder(self.workers)
+        self.builder = pib.build(self.iter_raw_scenes())
+        self.doc_length = pib.doc_length
+        self.dump_builder()
+
+    def dump_builder(self):
+        """
+        Dump the index held by self.builder, with its offsets
+        """
+        self.term_frequency = self.builder.term_frequency()
+        self.term_offset_size = self.builder.dump(self.dump_file, self.codec)
+        with open('offset.json', "w") as f:
+            json.dump(self.term_offset_size, f)
+        # keep lexicon.dat in step with offset.json, the querier prefers it
+        terms = list(self.builder.postings)
+        self.set_term_ids(terms, [len(self.builder.tf_docs[t]) for t in terms])
+        self.dump_lexicon()
+        if self.block_size > 0:
+            self.dump_block_index()
+
+    def build_external(self):
+        """
+        Build the compressed index with SpimiIndexer: partial indexes are
+        flushed to sorted run files whenever self.memory_budget is reached
+        and merged into self.dump_file at the end
+        Terms end up in sorted order in indx.dat; only the offsets, the
+        doc lengths and the collection frequencies are kept in memory
+        No tf table is built here: count_tf_df and dump_tfdf afterwards
+        decode the lists back from indx.dat (iter_index_docs), a second
+        pass over the index that the tf table, df.dat, the play-level
+        postings, neighbours and exact bounds need
+        With block_size the block index is written the same way, from the
+        lists decoded back from indx.dat
+        """
+        spimi = SpimiIndexer(self.dump_file, self.memory_budget, codec = self.codec)
+        for docId, tlist in self.iter_tokenized_scenes():
+            self.doc_length[docId] = len(tlist)
+            spimi.add_scene(docId, tlist)
+        self.term_offset_size = spimi.finish()
+        self.term_frequency = spimi.cf
+        spimi.dump_offsets('offset.json')
+        # ids in index order, no tf table in this mode
+        for tmid, term in enumerate(self.term_offset_size):
+            self.termtoid[term] = tmid
+            self.idtoterm[tmid] = term
+        self.df = np.array([spimi.df[t] for t in self.term_offset_size], dtype = int)
+        self.dump_lexicon()
+        self.dump_doc_table()
+        if self.block_size > 0:
+            self.dump_block_index()
+
+    def add_scenes(self, scenes, manifest = MANIFEST, compact = True):
+        """
+        Add new scenes to a built index without rebuilding it
+        They go to a new delta segment (see segments.py); the manifest is
+        started from the full build on the first call
+        compact: merge delta segments afterwards (a long running process
+        would call SegmentSet.compact_in_background instead)
+        Returns the docIds given to the scenes
+        """
+        segments = self.open_segments(manifest)
+        docIds = segments.add_scenes(scenes)
+        if compact:
+            segments.compact()
+        segments.close()
+        return docIds
+
+    def delete_scenes(self, scene_ids, manifest = MANIFEST, compact = True):
+        """
+        Delete scenes by sceneId: their docs are marked in the segments'
+        deletion bitmaps, and compaction drops them once enough of a
+        segment is deleted
+        Returns the docIds deleted
+        """
+        segments = self.open_segments(manifest)
+        docIds = segments.delete_scenes(scene_ids)
+        if compact:
+            segments.compact()
+        segments.close()
+        return docIds
+
+    def update_scenes(self, scenes, manifest = MANIFEST, compact = True):
+        """
+        Replace scenes (corpus dictionaries) by sceneId: the new version
+        is added with a new docId and the old one deleted
+        Returns the new docIds
+        """
+        segments = self.open_segments(manifest)
+        docIds = segments.update_scenes(scenes)
+        if compact:
+            segments.compact()
+        segments.close()
+        return docIds
+
+    def open_segments(self, manifest = MANIFEST):
+        """
+        The SegmentSet of the index, its manifest started from the full
+        build (and its doc table) if there is none yet
+        """
+        if not os.path.exists(manifest):
+            if not os.path.exists('doc_table.dat') and self.doc_length:
+                self.dump_doc_table()
+            create_manifest(manifest, self.dump_file)
+        return SegmentSet(manifest)
+
+    def iter_tokenized_scenes(self):
+        """
+        Yield (docId, token list) for every scene, streaming from the
+        corpus if self.stream is set; token lists are not kept
+        """
+        for docId, text in self.iter_raw_scenes():
+            yield docId, self.tokenize(text)
+
+    def iter_raw_scenes(self):
+        """
+        Yield (docId, text) for every scene, streaming from the corpus if
+        self.stream is set
+        """
+        scenes = iter_scenes(self.filename) if self.stream else self.read_scenes()
+        for scd in scenes:
+            self.record_scene(scd)
+            yield scd['sceneNum'], scd['text']
+
+    def read_scenes(self):
+        self.readIn()
+        return self.scenes
+
     def readIn(self):
-        with open(self.filename) as f:
+        opener = gzip.open if self.filename.endswith('.gz') else open
+        with opener(self.filename, 'rt') as f:
             # load dic from json file
             scdata= json.load(f)
             # then get the list of scenes
@@ -189,37 +469,87 @@ class Indexer:
         # for each doc
         for sce in self.scenes:
             # use sec['sceneNum'] as the
-            docId = sce['sceneNum']
-            # update doc lengths ds
-            self.doc_length[docId] = len(sce['tlist'])
-            # for each term in that scene:
-            for i in range(len(sce['tlist'])):
-                t = sce['tlist'][i]
-                if t not in self.term_frequency:
-                    self.term_frequency[t] = 1;
-                else:
-                    self.term_frequency[t] += 1;
-                
-                if t not in self.inv_index:
-                    self.inv_index[t] = []
-                self.inv_index[t].append((docId, i))
-            # if it is already presented in self.inv_index
-            # then add (docId, position) to its value
-            # else if it is not, first add an array to self.inv_index[term]
-            # then add (docId, position) to its value
+            self.index_ids(sce['sceneNum'], sce['tlist'])
+        self.finish_index()
+
+    def index_ids(self, docId, ids):
+        """
+        index_scene for a scene given as term ids from self.interner
+        Lists are appended to by term id, so no token string is hashed
+        again after interning; finish_index keys them by term
+        """
+        self.doc_length[docId] = len(ids)
+        lists = self.id_lists
+        if len(lists) < len(self.interner):
+            lists.extend([] for i in range(len(self.interner) - len(lists)))
+        for i, t in enumerate(ids.tolist()):
+            lists[t].append((docId, i))
+
+    def finish_index(self):
+        """
+        Move the lists of index_ids into self.inv_index and count the term
+        frequencies; ids are in order of first occurrence, so inv_index
+        gets its terms in the same order index_scene would give
+        """
+        for term, lst in zip(self.interner.terms(), self.id_lists):
+            self.inv_index[term] = lst
+            self.term_frequency[term] = len(lst)
+        self.id_lists = []
+
+    def index_scene(self, docId, tlist):
+        """
+        Add one tokenized scene to the inverted index
+        """
+        # update doc lengths ds
+        self.doc_length[docId] = len(tlist)
+        # for each term in that scene:
+        for i in range(len(tlist)):
+            t = tlist[i]
+            if t not in self.term_frequency:
+                self.term_frequency[t] = 1;
+            else:
+                self.term_frequency[t] += 1;
+
+            if t not in self.inv_index:
+                self.inv_index[t] = []
+            self.inv_index[t].append((docId, i))
+        # if it is already presented in self.inv_index
+        # then add (docId, position) to its value
+        # else if it is not, first add an array to self.inv_index[term]
+        # then add (docId, position) to its value
+
+    def read_and_index(self):
+        """
+        Streaming version of readIn + prepocess_scenes + build_inverted_index
+        Scenes are read one at a time from the (possibly gzipped) corpus,
+        tokenized and indexed right away; the text is not kept, so
+        self.scenes stays None
+        """
+        for docId, text in self.iter_raw_scenes():
+            self.index_ids(docId, self.interner.encode(text))
+        self.finish_index()
+
+    def tokenize(self, text):
+        return tokenize(text)
+
+    def record_scene(self, scd):
+        """
+        Keep the (sceneNum, sceneID) and (sceneNum, playID) mappings
+        """
+        self.sce_map[scd['sceneNum']] = scd['sceneId']
+        self.play_map[scd['sceneNum']] = scd['playId']
 
     def prepocess_scenes(self):
         """
         Function that will seperate words in the 'text' of each scene
-        It will add a key value pair ('tlist', text_list) 
-        to each element in self.scenes
+        It will add a key value pair ('tlist', term id array from
+        self.interner) to each element in self.scenes
         """
         # for each scene
         for scd in self.scenes:
-            text_list = scd['text'].split(" ")
-            scd['tlist'] = list(filter(None, text_list))
+            scd['tlist'] = self.interner.encode(scd['text'])
             # for each scene, add (sceneNum, sceneID) into the mapping
-            self.sce_map[scd['sceneNum']] = scd['sceneId']
+            self.record_scene(scd)
 
 
     def delta_encoding(self):
@@ -333,71 +663,46 @@ class Indexer:
 
     def apply_vbyte(self):
         """
-        Apply vbyte to every term's array
+        Apply vbyte (or the codec chosen in self.codec) to every term's array
         """
         for word in self.cmp_index.keys():
-            encode_arr = self.vbyte_encoding(self.cmp_index[word])
+            encode_arr = self.codec.encode(self.cmp_index[word])
             self.vbyte_index[word] = encode_arr
                     
     def vbyte_encoding(self, arr):
         """
         Encode content using vbyte
         """
-        ol = bytearray()
-        for i in arr:
-            while i >= 128:
-               ol.append(i & 0x7F)
-               i = rshift(i, 7)
-            ol.append( i | 0x80)
-        return ol
+        return vbyte_encode(arr)
 
-    def vbyte_decoding(self, byarr):
+    def vbyte_decoding(self, byarr, mode = 'auto'):
         """
         Decode vbyte encoded strings
+        mode: 'batch' (NumPy), 'stream' (single pass) or 'auto'
         """
-        ol = []
-        for i in range(len(byarr)):
-            position = 0
-            res = int( byarr[i] & 0x7f)
-
-            while (byarr[i] & 0x80) == 0:
-                i += 1
-                position += 1
-                unsignedByte = int( byarr[i] & 0x7f)
-                res |= ( unsignedByte << (7 * position))
-            ol.append(res)
-        ol = self.remove_after_big(ol)
-        return ol
-
-    def remove_after_big(self, arr):
-        res = []
-        igtag = False
-        for a in arr:
-            if igtag == False:
-                res.append(a)
-            else:
-                igtag = False
-                continue
-            if a >= 128 :
-                igtag = True
-        return res
+        return vbyte_decode(byarr, mode)
 
     def dump_index(self):
         """
         dump uncompressed data to file
         Data that needs to be dumped: self.inv_index
-        For this method, each list will take up a whole line in the file
+        Each list [docid, cnt, pos1, ...] is written as little-endian int32,
+        one after the other. ucmp_offset.npy holds, for row r, where list r
+        starts (in int32 units); row r + 1 is where it ends. ucmp_terms.json
+        lists the term of every row, so rows are found by term whatever
+        numbering the term ids of the other files use
         """
         fn = 'ucmp_' + self.dump_file
-        uf = open(fn, 'w')
-        lnum = 1
-        for word in self.ucmp_index:
-            self.ucmp_linenum[word] = lnum
-            uf.write(str(self.ucmp_index[word]) + '\n')
-            lnum += 1
-        uf.close()
-        with open('linenum.json', "w") as f:
-            json.dump(self.ucmp_linenum, f)
+        offsets = np.zeros(len(self.ucmp_index) + 1, dtype = np.int64)
+        with open(fn, 'wb') as uf:
+            for row, word in enumerate(self.ucmp_index):
+                self.ucmp_linenum[word] = row
+                arr = np.asarray(self.ucmp_index[word], dtype = '<i4')
+                uf.write(arr.tobytes())
+                offsets[row + 1] = offsets[row] + arr.size
+        np.save('ucmp_offset.npy', offsets)
+        with open('ucmp_terms.json', 'w') as f:
+            json.dump(list(self.ucmp_linenum), f)
 
     def dump_compressed_index(self):
         """
@@ -406,7 +711,10 @@ class Indexer:
         it. That is, update self.term_offset_size
         """
         bf = open(self.dump_file, "wb")# when writing, should open with 'wb'
-        offset = 0 # offset starts from zero
+        # the header recording the codec, empty for vbyte
+        header = index_header(self.codec)
+        bf.write(header)
+        offset = len(header) # offset starts right after the header
         for term in self.vbyte_index:
             size = self.write_data(bf, offset, self.vbyte_index[term])
             self.term_offset_size[term] = (offset, size)
@@ -417,8 +725,47 @@ class Indexer:
         # save offset data to file as well
         with open('offset.json', "w") as f:
             json.dump(self.term_offset_size, f)
+        # and the lexicon, in the term id order count_tf_df gives
+        terms = list(self.inv_index) if self.inv_index else list(self.cmp_index)
+        self.set_term_ids(terms, [count_docs(self.cmp_index[t]) for t in terms])
+        self.dump_lexicon()
             
 
+    def dump_block_index(self, filename = 'blk_indx.dat'):
+        """
+        Save the compact index (self.cmp_index) in the block format with
+        skip pointers, see blockindex.py
+        Offsets and sizes go to blk_offset.json
+        """
+        block_size = self.block_size if self.block_size > 0 else BLOCK_SIZE
+        bf = open(filename, "wb")
+        offset = 0
+        for term, cmp_list in self.iter_compact_lists():
+            data = encode_block_postings(cmp_list, block_size)
+            size = self.write_data(bf, offset, data)
+            self.block_offset_size[term] = (offset, size)
+            offset += size
+        bf.close()
+        with open('blk_offset.json', "w") as f:
+            json.dump(self.block_offset_size, f)
+
+    def iter_compact_lists(self):
+        """
+        Yield (term, compact list) for every term of the index just built:
+        from self.cmp_index, from the builder, or decoded back one at a
+        time from self.dump_file after build_external
+        """
+        if self.builder is not None:
+            for term, data in self.builder.postings.items():
+                yield term, vbyte_decode(data)
+        elif self.cmp_index:
+            yield from self.cmp_index.items()
+        else:
+            reader = PostingsReader(self.dump_file)
+            for term, (offset, size) in self.term_offset_size.items():
+                yield term, self.codec.decode(reader.read(offset, size)).tolist()
+            reader.close()
+
     def write_data(self, filevar, offset, lst_data):
         bdata = bytearray(lst_data) # convert it to bytearray if it is not
         size = len(bdata)# get the length of bytes of the bytearray
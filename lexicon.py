@@ -0,0 +1,217 @@
+"""
+File: lexicon.py
+Function: Binary term dictionary (lexicon.dat) replacing termid.json,
+          idterm.json and offset.json.
+Layout, little-endian, every array starting on its natural alignment:
+    header   : magic b'LEX1', uint32 numTerms, uint64 blobSize
+    uint64   : strOffsets[numTerms + 1]   term i is blob[strOffsets[i]:strOffsets[i+1]]
+    uint64   : offsets[numTerms]          postings offset in indx.dat
+    uint64   : cf[numTerms]               collection frequency
+    uint32   : termIds[numTerms]
+    uint32   : sizes[numTerms]            postings size in bytes
+    uint32   : df[numTerms]
+    uint32   : ranks[numTerms]            ranks[termId] = entry of that term
+    bytes    : blob                       utf-8 terms, sorted, concatenated
+Entries are sorted by the utf-8 bytes of the term, so a term is found by
+binary search over the blob, and an id is turned back into a term through
+ranks, without any separate mapping file.
+The file is memory-mapped; the arrays are np.frombuffer views of it.
+"""
+import mmap
+import struct
+
+import numpy as np
+
+MAGIC = b'LEX1'
+HEADER = struct.Struct('<4sIQ')
+
+
+def write_lexicon(filename, termtoid, offsets, df, cf):
+    """
+    termtoid: (term, termId) with ids 0..n-1
+    offsets: (term, (offset, size))
+    df, cf: indexed by termId
+    """
+    n = len(termtoid)
+    terms = sorted(termtoid, key = lambda t: t.encode('utf-8'))
+    encoded = [t.encode('utf-8') for t in terms]
+    str_offsets = np.zeros(n + 1, dtype = '<u8')
+    np.cumsum([len(b) for b in encoded], out = str_offsets[1:])
+    ids = np.array([termtoid[t] for t in terms], dtype = '<u4')
+    ranks = np.zeros(n, dtype = '<u4')
+    ranks[ids] = np.arange(n, dtype = '<u4')
+    arrays = [str_offsets,
+              np.array([offsets[t][0] for t in terms], dtype = '<u8'),
+              np.asarray(cf, dtype = '<u8')[ids],
+              ids,
+              np.array([offsets[t][1] for t in terms], dtype = '<u4'),
+              np.asarray(df, dtype = '<u4')[ids],
+              ranks]
+    blob = b''.join(encoded)
+    with open(filename, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, n, len(blob)))
+        for a in arrays:
+            f.write(a.tobytes())
+        f.write(blob)
+
+
+class Lexicon:
+    def __init__(self, filename = 'lexicon.dat'):
+        self.filename = filename
+        with open(filename, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+        magic, n, blob_size = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC:
+            raise ValueError("{} is not a lexicon file".format(filename))
+        self.num_terms = n
+        pos = HEADER.size
+
+        def take(dtype, count):
+            nonlocal pos
+            a = np.frombuffer(self.mm, dtype = dtype, count = count, offset = pos)
+            pos += a.nbytes
+            return a
+        # plain memoryview of the same bytes, indexing it is much cheaper
+        # than indexing the ndarray inside the binary search
+        self.so = memoryview(self.mm)[pos:pos + 8 * (n + 1)].cast('Q')
+        self.str_offsets = take('<u8', n + 1)
+        self.offsets = take('<u8', n)
+        self.cf = take('<u8', n)
+        self.term_ids = take('<u4', n)
+        self.sizes = take('<u4', n)
+        self.df = take('<u4', n)
+        self.ranks = take('<u4', n)
+        # terms are read with slices of the mapping starting here
+        self.blob_start = pos
+
+    def __len__(self):
+        return self.num_terms
+
+    def term_at(self, rank):
+        """
+        The term of entry rank
+        """
+        return self.term_bytes(rank).decode('utf-8')
+
+    def term_bytes(self, rank):
+        return self.mm[self.blob_start + self.so[rank]:self.blob_start + self.so[rank + 1]]
+
+    def find(self, term):
+        """
+        Binary search, return the entry of term or -1
+        """
+        key = term.encode('utf-8')
+        lo = 0
+        hi = self.num_terms
+        while lo < hi:
+            mid = (lo + hi) // 2
+            cur = self.term_bytes(mid)
+            if cur < key:
+                lo = mid + 1
+            elif cur > key:
+                hi = mid
+            else:
+                return mid
+        return -1
+
+    def rank(self, term):
+        r = self.find(term)
+        if r < 0:
+            raise KeyError(term)
+        return r
+
+    def term_id(self, term):
+        return int(self.term_ids[self.rank(term)])
+
+    def term(self, tid):
+        """
+        The term with id tid
+        """
+        if not 0 <= tid < self.num_terms:
+            raise KeyError(tid)
+        return self.term_at(self.ranks[tid])
+
+    def offset_size(self, term):
+        r = self.rank(term)
+        return int(self.offsets[r]), int(self.sizes[r])
+
+    def offset_size_by_id(self, tids):
+        """
+        (offsets, sizes) arrays for an array of term ids, no search needed
+        """
+        r = self.ranks[np.asarray(tids, dtype = np.int64)]
+        return self.offsets[r].astype(np.int64), self.sizes[r].astype(np.int64)
+
+    def data_end(self):
+        """
+        End of the last postings list in the index file, 0 if no term has
+        any; a lexicon of the index ends exactly where indx.dat does
+        """
+        if not self.num_terms:
+            return 0
+        return int((self.offsets + self.sizes).max())
+
+    def df_by_id(self):
+        """
+        df as an array indexed by termId, like df.dat
+        """
+        return self.df[self.ranks].astype(int)
+
+    def cf_by_id(self):
+        return self.cf[self.ranks].astype(int)
+
+    def terms(self):
+        """
+        Every term, in sorted order
+        """
+        for r in range(self.num_terms):
+            yield self.term_at(r)
+
+
+class LexiconMap:
+    """
+    Read-only dictionary view over a Lexicon, so code written against
+    termtoid / idtoterm / offset dictionaries keeps working
+    kind: 'termid' (term -> id), 'idterm' (id -> term) or
+          'offset' (term -> (offset, size))
+    """
+    def __init__(self, lexicon, kind):
+        self.lexicon = lexicon
+        self.kind = kind
+
+    def __getitem__(self, key):
+        if self.kind == 'termid':
+            return self.lexicon.term_id(key)
+        if self.kind == 'idterm':
+            return self.lexicon.term(key)
+        return self.lexicon.offset_size(key)
+
+    def __contains__(self, key):
+        if self.kind == 'idterm':
+            return isinstance(key, (int, np.integer)) and 0 <= key < len(self.lexicon)
+        return self.lexicon.find(key) >= 0
+
+    def get(self, key, default = None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __len__(self):
+        return len(self.lexicon)
+
+    def keys(self):
+        if self.kind == 'idterm':
+            return iter(range(len(self.lexicon)))
+        return self.lexicon.terms()
+
+    def __iter__(self):
+        return self.keys()
+
+    def items(self):
+        for k in self.keys():
+            yield k, self[k]
+
+    def values(self):
+        for k in self.keys():
+            yield self[k]
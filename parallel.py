@@ -0,0 +1,75 @@
+"""
+File: parallel.py
+Function: Defines the class ParallelIndexBuilder, which builds the
+          compressed index with a pool of worker processes.
+Scenes are cut into shards of consecutive docIds. Each worker tokenizes
+its shard and builds a PostingsBuilder for it, which does the delta,
+compact and vbyte encoding of every term's list over that docId range.
+The partial builders are merged in shard order with
+PostingsBuilder.extend, which only rebases the first docDelta of each
+term, so the result is byte-identical to the serial single pass build
+(terms keep the order of their first occurrence).
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+
+from builder import PostingsBuilder
+from inv_util import tokenize
+
+# scenes per shard
+SHARD_SIZE = 64
+
+
+def build_shard(shard):
+    """
+    Worker: index a list of (docId, text) scenes
+    Returns the shard's PostingsBuilder and its (docId, length) pairs
+    """
+    builder = PostingsBuilder()
+    lengths = []
+    for docId, text in shard:
+        tlist = tokenize(text)
+        builder.add_scene(docId, tlist)
+        lengths.append((docId, len(tlist)))
+    return builder, lengths
+
+
+class ParallelIndexBuilder:
+    def __init__(self, workers = None, shard_size = SHARD_SIZE):
+        # number of worker processes, None for one per CPU
+        self.workers = workers
+        self.shard_size = shard_size
+        # the merged index
+        self.builder = PostingsBuilder()
+        # doc length of every docId
+        self.doc_length = dict()
+
+    def build(self, scenes):
+        """
+        Index (docId, text) pairs given in increasing docId order
+        Shards are submitted while scenes are read and merged in order as
+        they finish, so at most a few shards wait in memory
+        """
+        pending = deque()
+        limit = 2 * (self.workers or os.cpu_count() or 1)
+        with ProcessPoolExecutor(max_workers = self.workers) as pool:
+            shard = []
+            for docId, text in scenes:
+                shard.append((docId, text))
+                if len(shard) == self.shard_size:
+                    pending.append(pool.submit(build_shard, shard))
+                    shard = []
+                    while len(pending) >= limit:
+                        self.merge(pending.popleft().result())
+            if shard:
+                pending.append(pool.submit(build_shard, shard))
+            while pending:
+                self.merge(pending.popleft().result())
+        return self.builder
+
+    def merge(self, result):
+        builder, lengths = result
+        self.builder.extend(builder)
+        for docId, length in lengths:
+            self.doc_length[docId] = length
@@ -0,0 +1,161 @@
+"""
+File: plays.py
+Function: Defines the class PlayTable, the play level of the index.
+Scenes (docIds) are grouped into plays once, at build time. The playIds,
+the play number of every docId and the scene lengths are in the doc table
+(doc_table.dat, see doctable.py); the play level only adds
+    play_tf_*.npy     term x play tf table (CSRMatrix), the play-level
+                      postings: row t lists the plays term t occurs in
+                      and how often
+The longest / shortest scene or play and per-play term statistics are
+then array lookups (argmax, CSR row slices) instead of a walk over the
+scenes, and play-scoped queries filter docIds with doc_play.
+"""
+import numpy as np
+
+from doctable import DocTable
+from ranking import BM25
+from tfmatrix import CSRMatrix
+
+
+class PlayTable:
+    def __init__(self, names, doc_play, doc_length, tf = None):
+        # playId of every play number
+        self.names = names
+        self.play_num = {name: i for i, name in enumerate(names)}
+        # play number of every docId
+        self.doc_play = doc_play
+        self.doc_length = doc_length
+        self.play_length = np.bincount(doc_play, weights = doc_length,
+                                       minlength = len(names)).astype(np.int64)
+        # term x play tf, None if built without the term x scene table
+        self.tf = tf
+
+    @staticmethod
+    def build(play_map, doc_length, tf = None):
+        """
+        play_map: docId -> playId (Indexer.play_map)
+        doc_length: length of every docId (array or docId -> length dict)
+        tf: the term x scene CSRMatrix, grouped into term x play
+        """
+        if isinstance(doc_length, dict):
+            lengths = np.zeros(max(doc_length) + 1 if doc_length else 0, dtype = np.int64)
+            lengths[list(doc_length)] = list(doc_length.values())
+        else:
+            lengths = np.asarray(doc_length, dtype = np.int64)
+        num_docs = len(lengths)
+        names = []
+        seen = dict()
+        doc_play = np.zeros(num_docs, dtype = np.int32)
+        for docId in sorted(play_map):
+            play = play_map[docId]
+            if play not in seen:
+                seen[play] = len(names)
+                names.append(play)
+            doc_play[docId] = seen[play]
+        play_tf = tf.group_columns(doc_play, len(names)) if tf is not None else None
+        return PlayTable(names, doc_play, lengths, play_tf)
+
+    @staticmethod
+    def from_doc_table(doc_table, tf = None):
+        """
+        The plays of a DocTable, with the play-level tf table tf
+        """
+        names = [doc_table.play_name(i) for i in range(doc_table.num_plays)]
+        return PlayTable(names, doc_table.doc_play, doc_table.length, tf)
+
+    def save(self, prefix = 'play'):
+        """
+        Save the play-level tf table, the rest is in the doc table
+        """
+        if self.tf is not None:
+            self.tf.save(prefix + '_tf')
+
+    @staticmethod
+    def load(prefix = 'play', doc_table = 'doc_table.dat', mmap_mode = 'r'):
+        """
+        Load the plays of doc_table (filename or DocTable) and the tf
+        table save() wrote, if there is one
+        """
+        if not isinstance(doc_table, DocTable):
+            doc_table = DocTable(doc_table)
+        tf = None
+        try:
+            tf = CSRMatrix.load(prefix + '_tf', mmap_mode)
+        except FileNotFoundError:
+            pass
+        return PlayTable.from_doc_table(doc_table, tf)
+
+    def num_plays(self):
+        return len(self.names)
+
+    def play_of(self, docId):
+        return self.names[self.doc_play[docId]]
+
+    def docs(self, play):
+        """
+        DocIds of the scenes of a play
+        """
+        return np.flatnonzero(self.doc_play == self.play_num[play])
+
+    def longest_scene(self):
+        """
+        (docId, length) of the longest and of the shortest scene; the
+        first one on ties
+        """
+        i = int(np.argmax(self.doc_length))
+        j = int(np.argmin(self.doc_length))
+        return (i, int(self.doc_length[i]), j, int(self.doc_length[j]))
+
+    def longest_play(self):
+        """
+        (playId, length) of the longest and of the shortest play
+        """
+        i = int(np.argmax(self.play_length))
+        j = int(np.argmin(self.play_length))
+        return (self.names[i], int(self.play_length[i]), self.names[j], int(self.play_length[j]))
+
+    def postings(self, tid):
+        """
+        Play-level postings of a term id: (play numbers, tf in each)
+        """
+        return self.tf.row_indices(tid), self.tf.row_data(tid)
+
+    def term_stats(self, tid):
+        """
+        {playId: tf} of a term id
+        """
+        plays, tfs = self.postings(tid)
+        return {self.names[p]: int(tf) for p, tf in zip(plays.tolist(), tfs.tolist())}
+
+    def play_df(self):
+        """
+        Number of plays every term occurs in
+        """
+        return self.tf.row_nnz()
+
+    def in_play(self, docs, play):
+        """
+        The docIds of docs (array) that belong to play
+        """
+        docs = np.asarray(docs, dtype = np.int64)
+        return docs[self.doc_play[docs] == self.play_num[play]]
+
+    def search(self, tids, k = 10, k1 = 1.2, b = 0.75):
+        """
+        BM25 over whole plays, from the play-level postings
+        All plays are scored at once, term by term, with array operations
+        Returns [(playId, score)] best first
+        """
+        model = BM25(self.play_length, k1, b)
+        df = self.play_df()
+        scores = np.zeros(self.num_plays())
+        for tid in set(tids):
+            plays, tfs = self.postings(tid)
+            if not len(plays):
+                continue
+            w = model.weight(int(df[tid]), 0)
+            tfs = tfs.astype(float)
+            scores[plays] += w * tfs * (k1 + 1) / (tfs + model.norm[plays])
+        order = np.argsort(-scores, kind = 'stable')[:k]
+        return [(self.names[i], float(scores[i])) for i in order if scores[i] > 0]
@@ -0,0 +1,74 @@
+"""
+File: postings_cache.py
+Function: Defines the class PostingsCache, an LRU cache of decoded
+          postings lists bounded by their total size in bytes.
+Lists are kept as int32 ndarrays ([docID, cnt, pos1, ...], absolute
+values), keyed by term id. When adding a list would go over the budget,
+the least recently used lists are evicted first. A list bigger than the
+whole budget is not cached at all.
+The cache may be shared by threads (query_server.py); every operation
+holds a lock.
+"""
+import threading
+from collections import OrderedDict
+
+# default budget for the decoded lists
+CACHE_BYTES = 64 * 1024 * 1024
+
+
+class PostingsCache:
+    def __init__(self, max_bytes = CACHE_BYTES):
+        self.max_bytes = max_bytes
+        # term id -> ndarray, least recently used first
+        self.lists = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.lists)
+
+    def __contains__(self, tid):
+        return tid in self.lists
+
+    def get(self, tid):
+        """
+        The cached list of tid, or None; counts a hit or a miss
+        """
+        with self.lock:
+            arr = self.lists.get(tid)
+            if arr is None:
+                self.misses += 1
+                return None
+            self.lists.move_to_end(tid)
+            self.hits += 1
+            return arr
+
+    def put(self, tid, arr):
+        if arr.nbytes > self.max_bytes:
+            return
+        with self.lock:
+            if tid in self.lists:
+                self.nbytes -= self.lists.pop(tid).nbytes
+            while self.nbytes + arr.nbytes > self.max_bytes:
+                old_tid, old = self.lists.popitem(last = False)
+                self.nbytes -= old.nbytes
+                self.evictions += 1
+            self.lists[tid] = arr
+            self.nbytes += arr.nbytes
+
+    def clear(self):
+        with self.lock:
+            self.lists.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / total if total else 0.0,
+                'lists': len(self.lists),
+                'bytes': self.nbytes}
@@ -0,0 +1,291 @@
+"""
+File: postings_codecs.py
+Function: Pluggable codecs for the integers of a postings list
+          ([docDelta, cnt, pos1, posDelta2, ...], all non-negative).
+Every codec has encode(list of ints) -> bytes and decode(bytes) -> int64
+ndarray. Codecs:
+- vbyte:  7 bits per byte, see vbyte.py (the format of the original indx.dat)
+- simple8b: 64-bit words, a 4-bit selector says how many equal-width
+          values fill the other 60 bits
+- pfor:   PForDelta, blocks of 128 values bit-packed with the width that
+          fits 90% of them; the high bits of the rest are patched in
+- gamma:  Elias gamma code of value + 1, bit-packed
+- delta:  Elias delta code of value + 1, bit-packed
+All codecs but vbyte start with a uint32 count of the values.
+An index file written with a codec other than vbyte starts with
+INDEX_HEADER (magic + version + codec id); a file without the header is a
+plain vbyte index. The magic is 6 bytes without the high bit, which no
+vbyte stream of 32-bit numbers can start with.
+"""
+import struct
+
+import numpy as np
+
+from vbyte import vbyte_encode, vbyte_decode_batch
+
+INDEX_MAGIC = b'\x00INDX\x00'
+INDEX_VERSION = 1
+INDEX_HEADER = struct.Struct('<6sBB')
+COUNT = struct.Struct('<I')
+
+
+class PostingsCodec:
+    # short name used in options and benchmarks
+    name = None
+    # id recorded in the index header
+    codec_id = None
+
+    def encode(self, arr):
+        raise NotImplementedError
+
+    def decode(self, data):
+        raise NotImplementedError
+
+
+class VByteCodec(PostingsCodec):
+    name = 'vbyte'
+    codec_id = 0
+
+    def encode(self, arr):
+        return vbyte_encode(arr)
+
+    def decode(self, data):
+        return vbyte_decode_batch(data)
+
+
+# (values per word, bits per value) of every Simple-8b selector
+SIMPLE8B_SELECTORS = [(240, 0), (120, 0), (60, 1), (30, 2), (20, 3), (15, 4),
+                      (12, 5), (10, 6), (8, 7), (7, 8), (6, 10), (5, 12),
+                      (4, 15), (3, 20), (2, 30), (1, 60)]
+
+
+class Simple8bCodec(PostingsCodec):
+    name = 'simple8b'
+    codec_id = 1
+
+    def encode(self, arr):
+        words = []
+        widths = [v.bit_length() for v in arr]
+        i = 0
+        n = len(arr)
+        while i < n:
+            for sel, (count, bits) in enumerate(SIMPLE8B_SELECTORS):
+                # the most values that fit; only the last word can be
+                # partly filled
+                if widths[i] <= bits and max(widths[i:i + count]) <= bits:
+                    break
+            else:
+                raise ValueError("value does not fit in 60 bits")
+            chunk = arr[i:i + count]
+            word = sel << 60
+            for j, v in enumerate(chunk):
+                word |= v << (bits * j)
+            words.append(word)
+            i += len(chunk)
+        return COUNT.pack(n) + np.array(words, dtype = '<u8').tobytes()
+
+    def decode(self, data):
+        n = COUNT.unpack_from(data, 0)[0]
+        words = np.frombuffer(data, dtype = '<u8', offset = COUNT.size)
+        selectors = (words >> np.uint64(60)).astype(np.int64)
+        counts = np.array([c for c, b in SIMPLE8B_SELECTORS])[selectors]
+        starts = np.zeros(len(words), dtype = np.int64)
+        np.cumsum(counts[:-1], out = starts[1:])
+        out = np.zeros(int(counts.sum()), dtype = np.int64)
+        for sel, (count, bits) in enumerate(SIMPLE8B_SELECTORS):
+            mask = selectors == sel
+            if bits == 0 or not mask.any():
+                continue
+            shifts = (bits * np.arange(count)).astype(np.uint64)
+            vals = (words[mask][:, None] >> shifts) & np.uint64((1 << bits) - 1)
+            idx = starts[mask][:, None] + np.arange(count)
+            out[idx] = vals
+        return out[:n]
+
+
+def pack_bits(vals, bits):
+    """
+    Pack ints into bits-wide little-endian bit fields
+    """
+    if bits == 0 or len(vals) == 0:
+        return b''
+    v = np.asarray(vals, dtype = np.uint64)
+    fields = (v[:, None] >> np.arange(bits, dtype = np.uint64)) & np.uint64(1)
+    return np.packbits(fields.astype(np.uint8).ravel(), bitorder = 'little').tobytes()
+
+
+def unpack_bits(data, count, bits):
+    """
+    Inverse of pack_bits, returns int64 ndarray of count values
+    """
+    if bits == 0 or count == 0:
+        return np.zeros(count, dtype = np.int64)
+    raw = np.unpackbits(np.frombuffer(data, dtype = np.uint8), count = count * bits,
+                        bitorder = 'little')
+    weights = np.left_shift(1, np.arange(bits, dtype = np.int64))
+    return raw.reshape((count, bits)).astype(np.int64) @ weights
+
+
+class PForDeltaCodec(PostingsCodec):
+    name = 'pfor'
+    codec_id = 2
+    # values per block
+    block = 128
+    # share of values that must fit the block's bit width
+    coverage = 0.9
+
+    def encode(self, arr):
+        out = bytearray(COUNT.pack(len(arr)))
+        for b in range(0, len(arr), self.block):
+            vals = arr[b:b + self.block]
+            widths = sorted(v.bit_length() for v in vals)
+            bits = widths[min(len(widths) - 1, int(self.coverage * len(widths)))]
+            limit = 1 << bits
+            exceptions = []
+            for j, v in enumerate(vals):
+                if v >= limit:
+                    exceptions.extend([j, v >> bits])
+            out.append(bits)
+            out.extend(vbyte_encode([len(exceptions) // 2]))
+            out.extend(pack_bits([v & (limit - 1) for v in vals], bits))
+            out.extend(vbyte_encode(exceptions))
+        return bytes(out)
+
+    def decode(self, data):
+        n = COUNT.unpack_from(data, 0)[0]
+        data = memoryview(data)
+        out = np.zeros(n, dtype = np.int64)
+        pos = COUNT.size
+        for b in range(0, n, self.block):
+            count = min(self.block, n - b)
+            bits = data[pos]
+            pos += 1
+            # number of exceptions
+            num_exc = 0
+            shift = 0
+            while True:
+                c = data[pos]
+                pos += 1
+                num_exc |= (c & 0x7F) << shift
+                shift += 7
+                if c & 0x80:
+                    break
+            size = (count * bits + 7) // 8
+            out[b:b + count] = unpack_bits(data[pos:pos + size], count, bits)
+            pos += size
+            if num_exc:
+                # exceptions are vbyte pairs; find where they end
+                end = pos
+                seen = 0
+                while seen < 2 * num_exc:
+                    if data[end] & 0x80:
+                        seen += 1
+                    end += 1
+                exc = vbyte_decode_batch(data[pos:end]).reshape((-1, 2))
+                out[b + exc[:, 0]] |= exc[:, 1] << bits
+                pos = end
+        return out
+
+
+def bits_to_bytes(bitstr):
+    """
+    '0'/'1' string -> bytes, MSB first, zero padded
+    """
+    bits = np.frombuffer(bitstr.encode('ascii'), dtype = np.uint8) - ord('0')
+    return np.packbits(bits).tobytes()
+
+
+def bytes_to_bits(data):
+    return (np.unpackbits(np.frombuffer(data, dtype = np.uint8)) + ord('0')).tobytes().decode('ascii')
+
+
+class EliasGammaCodec(PostingsCodec):
+    name = 'gamma'
+    codec_id = 3
+
+    def encode(self, arr):
+        parts = []
+        for v in arr:
+            b = bin(v + 1)[2:]
+            parts.append('0' * (len(b) - 1))
+            parts.append(b)
+        return COUNT.pack(len(arr)) + bits_to_bytes(''.join(parts))
+
+    def decode(self, data):
+        n = COUNT.unpack_from(data, 0)[0]
+        s = bytes_to_bits(data[COUNT.size:])
+        out = np.zeros(n, dtype = np.int64)
+        pos = 0
+        for i in range(n):
+            one = s.index('1', pos)
+            end = 2 * one - pos + 1
+            out[i] = int(s[one:end], 2) - 1
+            pos = end
+        return out
+
+
+class EliasDeltaCodec(PostingsCodec):
+    name = 'delta'
+    codec_id = 4
+
+    def encode(self, arr):
+        parts = []
+        for v in arr:
+            b = bin(v + 1)[2:]
+            lb = bin(len(b))[2:]
+            parts.append('0' * (len(lb) - 1))
+            parts.append(lb)
+            parts.append(b[1:])
+        return COUNT.pack(len(arr)) + bits_to_bytes(''.join(parts))
+
+    def decode(self, data):
+        n = COUNT.unpack_from(data, 0)[0]
+        s = bytes_to_bits(data[COUNT.size:])
+        out = np.zeros(n, dtype = np.int64)
+        pos = 0
+        for i in range(n):
+            one = s.index('1', pos)
+            end = 2 * one - pos + 1
+            length = int(s[one:end], 2)
+            out[i] = int('1' + s[end:end + length - 1], 2) - 1
+            pos = end + length - 1
+        return out
+
+
+CODECS = dict()
+for codec in (VByteCodec(), Simple8bCodec(), PForDeltaCodec(),
+              EliasGammaCodec(), EliasDeltaCodec()):
+    CODECS[codec.name] = codec
+CODEC_IDS = {c.codec_id: c for c in CODECS.values()}
+
+
+def get_codec(name):
+    if isinstance(name, PostingsCodec):
+        return name
+    if name not in CODECS:
+        raise ValueError("unknown postings codec: {}".format(name))
+    return CODECS[name]
+
+
+def index_header(codec):
+    """
+    Bytes to put at the start of an index file written with codec,
+    empty for vbyte so plain vbyte indexes stay as they were
+    """
+    if codec.codec_id == VByteCodec.codec_id:
+        return b''
+    return INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, codec.codec_id)
+
+
+def read_index_header(data):
+    """
+    Return the codec of an index file given its first bytes
+    (INDEX_HEADER.size of them suffice)
+    """
+    if len(data) >= INDEX_HEADER.size:
+        magic, version, codec_id = INDEX_HEADER.unpack_from(data, 0)
+        if magic == INDEX_MAGIC:
+            if version != INDEX_VERSION or codec_id not in CODEC_IDS:
+                raise ValueError("unsupported index header")
+            return CODEC_IDS[codec_id]
+    return CODECS['vbyte']
@@ -0,0 +1,78 @@
+"""
+File: postings_reader.py
+Function: Defines the class PostingsReader, a memory-mapped reader for the
+          compressed index file (indx.dat).
+Postings are handed out as memoryview slices of the mapping using the
+(offset, size) pairs from offset.json, so a lookup costs no system call
+and no copy. Several processes mapping the same file share one copy of it
+in the page cache.
+"""
+import mmap
+
+
+class PostingsReader:
+    def __init__(self, filename = 'indx.dat'):
+        # index file name, kept so the reader can be re-opened after pickling
+        self.filename = filename
+        self.file = None
+        self.mm = None
+        self.view = None
+        self.open()
+
+    def open(self):
+        self.file = open(self.filename, 'rb')
+        try:
+            self.mm = mmap.mmap(self.file.fileno(), 0, access = mmap.ACCESS_READ)
+            self.view = memoryview(self.mm)
+        except ValueError:
+            # an empty file cannot be mapped
+            self.mm = None
+            self.view = memoryview(b'')
+
+    def close(self):
+        if self.view is not None:
+            try:
+                self.view.release()
+            except BufferError:
+                # arrays built on the view (np.frombuffer) are still alive
+                pass
+            self.view = None
+        if self.mm is not None:
+            try:
+                self.mm.close()
+            except BufferError:
+                # slices handed out are still alive; the mapping goes away
+                # together with the last of them
+                pass
+            self.mm = None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __getstate__(self):
+        # only the file name crosses process boundaries, each worker maps
+        # the file itself
+        return {'filename': self.filename}
+
+    def __setstate__(self, state):
+        self.filename = state['filename']
+        self.file = None
+        self.mm = None
+        self.view = None
+        self.open()
+
+    def __len__(self):
+        return len(self.view)
+
+    def read(self, offset, size):
+        """
+        Return the postings bytes at (offset, size) as a memoryview
+        Slices still alive when the reader is closed keep the mapping open
+        """
+        return self.view[offset:offset + size]
@@ -0,0 +1,205 @@
+"""
+File: query_bench.py
+Function: Reproducible query benchmark harness.
+Replays workloads against the compressed (indx.dat) and uncompressed
+(ucmp_indx.dat) query paths and reports throughput and latency
+percentiles per (workload, path, cache state):
+- stored: the 100 stored query sets (random_term.txt / term_phrase.txt),
+          one query = the 14 lists of a set, as Querier.do_query fetches
+- zipf:   synthetic 7-term queries, terms drawn with a Zipf law over the
+          df ranking from df.dat (rank r has weight 1 / r ** s)
+cold: the index files are dropped from the page cache (posix_fadvise)
+      and a fresh session is opened before the pass
+warm: the same pass repeated after a warm-up pass
+The uncompressed path reads int32 views of the mapped file; run_query
+copies them, so its time includes reading every list from the pages, as
+the compressed path includes decoding them.
+Results are written as JSON together with the git commit, so runs can be
+compared between commits (--baseline prints the change against an older
+results file).
+Usage:
+    python query_bench.py --output results.json
+    python query_bench.py --workload zipf --queries 2000 --zipf-s 1.1
+    python query_bench.py --baseline old.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from batch_fetch import drop_file_cache
+from query_index import QuerySession
+
+INDEX_FILES = ('indx.dat', 'ucmp_indx.dat', 'lexicon.dat', 'blk_indx.dat')
+
+
+def zipf_queries(df, num_queries, terms_per_query = 7, s = 1.0, seed = 0):
+    """
+    num_queries lists of term ids, ids drawn by Zipf weight of their df rank
+    """
+    rng = np.random.default_rng(seed)
+    by_df = np.argsort(-np.asarray(df), kind = 'stable')
+    weights = 1.0 / np.arange(1, len(by_df) + 1) ** s
+    ranks = rng.choice(len(by_df), size = (num_queries, terms_per_query),
+                       p = weights / weights.sum())
+    return by_df[ranks].tolist()
+
+
+def run_query(session, query, compressed):
+    """
+    One query: a stored set number, or a list of term ids
+    The uncompressed lists are views on the mapped file, so they are copied
+    here: otherwise the pages are never read and only the lookup is timed
+    """
+    if isinstance(query, int):
+        res = session.query(query, compressed)
+    else:
+        res = dict()
+        for tid in query:
+            term = session.idtoterm[tid]
+            if compressed:
+                res[term] = session.restore_compressed_data(*session.offset[term])
+            else:
+                res[term] = session.read_uncompressed(term)
+    if not compressed:
+        res = {term: np.array(lst) for term, lst in res.items()}
+    return res
+
+
+def time_pass(session, queries, compressed):
+    """
+    Latency of every query in seconds, and the wall time of the pass
+    """
+    lat = []
+    start = time.perf_counter()
+    for q in queries:
+        t = time.perf_counter()
+        run_query(session, q, compressed)
+        lat.append(time.perf_counter() - t)
+    return lat, time.perf_counter() - start
+
+
+def summarize(lat, wall):
+    ms = np.array(lat) * 1000
+    p = np.percentile(ms, [50, 95, 99])
+    return {'queries': len(lat),
+            'throughput_qps': len(lat) / wall,
+            'mean_ms': float(ms.mean()),
+            'p50_ms': float(p[0]),
+            'p95_ms': float(p[1]),
+            'p99_ms': float(p[2]),
+            'max_ms': float(ms.max())}
+
+
+def open_session(compressed):
+    session = QuerySession()
+    if not compressed:
+        session.read_ucmp_offset()
+    return session
+
+
+def bench(queries, compressed, mode, repeat):
+    """
+    Run one configuration repeat times, return the summaries
+    """
+    runs = []
+    for r in range(repeat):
+        if mode == 'cold':
+            for f in INDEX_FILES:
+                if os.path.exists(f):
+                    drop_file_cache(f)
+        with open_session(compressed) as session:
+            if mode == 'warm':
+                time_pass(session, queries, compressed)
+            runs.append(summarize(*time_pass(session, queries, compressed)))
+    return runs
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], text = True,
+                                       cwd = os.path.dirname(os.path.abspath(__file__)),
+                                       stderr = subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline):
+    """
+    Print the p50 / p99 / throughput change of every configuration that is
+    in both results
+    """
+    old = {(r['workload'], r['path'], r['mode']): r for r in baseline['results']}
+    print("change against {} ({})".format(baseline.get('commit'), baseline.get('timestamp')))
+    for r in results['results']:
+        key = (r['workload'], r['path'], r['mode'])
+        if key not in old:
+            continue
+        o = old[key]
+        print("{:<7} {:<13} {:<5} p50 {:+7.1%}  p99 {:+7.1%}  throughput {:+7.1%}".format(
+            key[0], key[1], key[2],
+            r['p50_ms'] / o['p50_ms'] - 1, r['p99_ms'] / o['p99_ms'] - 1,
+            r['throughput_qps'] / o['throughput_qps'] - 1))
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Query latency benchmark')
+    parser.add_argument('--workload', nargs = '+', default = ['stored', 'zipf'],
+                        choices = ['stored', 'zipf'])
+    parser.add_argument('--path', nargs = '+', default = ['compressed', 'uncompressed'],
+                        choices = ['compressed', 'uncompressed'])
+    parser.add_argument('--mode', nargs = '+', default = ['cold', 'warm'],
+                        choices = ['cold', 'warm'])
+    parser.add_argument('--queries', type = int, default = 1000,
+                        help = 'number of zipf queries')
+    parser.add_argument('--zipf-s', type = float, default = 1.0)
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--repeat', type = int, default = 3,
+                        help = 'runs per configuration, the median run is reported')
+    parser.add_argument('--output', help = 'write the results as JSON here')
+    parser.add_argument('--baseline', help = 'results JSON of an earlier run to compare with')
+    args = parser.parse_args(argv)
+
+    with QuerySession() as session:
+        workloads = {'stored': list(range(len(session.randomQueries))),
+                     'zipf': zipf_queries(session.df, args.queries, s = args.zipf_s,
+                                          seed = args.seed)}
+    results = []
+    for workload in args.workload:
+        for path in args.path:
+            compressed = path == 'compressed'
+            if not compressed and not os.path.exists('ucmp_offset.npy'):
+                print("skipping {} {}: no uncompressed index".format(workload, path))
+                continue
+            for mode in args.mode:
+                runs = bench(workloads[workload], compressed, mode, args.repeat)
+                # the run with the median throughput
+                run = sorted(runs, key = lambda r: r['throughput_qps'])[len(runs) // 2]
+                res = dict(run, workload = workload, path = path, mode = mode)
+                results.append(res)
+                print("{:<7} {:<13} {:<5}: {:9.1f} q/s  p50 {:8.3f}  p95 {:8.3f}  p99 {:8.3f} ms".format(
+                    workload, path, mode, res['throughput_qps'],
+                    res['p50_ms'], res['p95_ms'], res['p99_ms']))
+    out = {'commit': git_commit(),
+           'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+           'python': sys.version.split()[0],
+           'numpy': np.__version__,
+           'platform': platform.platform(),
+           'args': vars(args),
+           'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(out, f, indent = 2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(out, json.load(f))
+    return out
+
+
+if __name__ == '__main__':
+    main()
@@ -8,11 +8,29 @@ TODO:
 3. Do query with the 100 set and perform a timing experiment
 """
 import json
-import linecache
+import os
 import numpy as np
 from inv_util import *
 from random import randint
 import re
+from concurrent.futures import ThreadPoolExecutor
+
+from postings_reader import PostingsReader
+from vbyte import vbyte_decode, iter_vbyte
+from tfmatrix import CSRMatrix
+from dice import DiceEngine, save_neighbors, load_neighbors
+from lexicon import Lexicon, LexiconMap
+from postings_codecs import INDEX_HEADER, read_index_header
+from blockindex import (BlockPostings, delta_decode_block, parse_skip_table,
+                        max_header_size)
+from query_ops import (FlatCursor, ListCursor, BlockCursor, LiveCursor, intersect,
+                       union, phrase_matches)
+from ranking import BM25, DirichletQL, top_k
+from postings_cache import PostingsCache
+from batch_fetch import MAX_GAP, read_ranges, delta_decode_batch
+from segments import MANIFEST, SegmentSet, iter_counts
+from plays import PlayTable
+from doctable import DocTable
 
 class Querier:
     def __init__(self):
@@ -24,8 +42,18 @@ class Querier:
         self.query_index = dict()
         # compressed file offset
         self.offset = None
-        # linenumber
-        self.linenum = None
+        # postings codec of the compressed index, read from its header
+        self.codec = None
+        # uncompressed index: where each row's list starts, in int32s
+        self.ucmp_offset = None
+        # uncompressed index: term -> row
+        self.ucmp_row = None
+        # memory-mapped uncompressed index file
+        self.ucmp_reader = None
+        # binary term dictionary, replaces the json dictionaries if present
+        self.lexicon = None
+        # block index file offset
+        self.block_offset = None
 
         # term num
         self.TERMMAX = 0
@@ -33,10 +61,18 @@ class Querier:
         self.termtoid = None
         # id to term
         self.idtoterm = None
-        # tf (table of shape #term x #doc)
+        # tf (sparse CSRMatrix of shape #term x #doc)
         self.tf = None
         # df (1darray where index represents termid)
         self.df = None
+        # collection frequency, indexed by termid (only loaded for ranking)
+        self.cf = None
+        # length of every scene, indexed by docId (only loaded for ranking)
+        self.doc_length = None
+        # memory-mapped doc table (doc_table.dat), if it has been built
+        self.doc_table = None
+        # ranking models already set up, by name
+        self.models = dict()
         # data structure for holding randomly generated terms
         self.randomQueries = []
         # random word's highest match
@@ -45,15 +81,18 @@ class Querier:
         self.selectedTermInfo = []
         # term to term dice coefficient
         self.coefficient = None
+        # top-k dice partners of every term id (#term x k), best first
+        self.neighbors = None
+        # their dice coefficients
+        self.neighbor_scores = None
         # highest score phrase
         self.phrases = []
 
     @staticmethod
     def get_vocabulary():
         q = Querier()
-        q.read_term_info()
-        q.read_offset_linenum()
-        return q.linenum.keys()
+        q.read_term_ids()
+        return q.termtoid.keys()
 
     @staticmethod
     def do_query(set_num, compressed = True):
@@ -83,7 +122,10 @@ class Querier:
     def get_highest_match_term(self, tid):
         """
         get highest term id that have highest dice coefficient with tid
+        Uses the neighbor table when it is loaded, see load_neighbor_table
         """
+        if self.neighbors is not None:
+            return int(self.neighbors[tid, 0])
         max_match = -1
         max_val = 0
         for i in range(self.TERMMAX):
@@ -113,6 +155,7 @@ class Querier:
         'random_term.txt'
         'term_phrase.txt'
         """
+        self.load_neighbor_table()
         f1 = open('random_term.txt', 'w')
         f2 = open('term_phrase.txt', 'w')
         for lst in self.randomQueries:
@@ -155,10 +198,11 @@ class Querier:
         """
         OPTIMIZATION IN ORDER TO SPEED UP self.get_highest_match_term
         Compute term with term dice coefficient using numpy
+        Dense V x V, only usable on small vocabularies; see
+        compute_neighbors for the sparse, chunked version
         """
         # matrix for nab
-        bm = self.tf.astype(np.bool)
-        im = bm.astype(np.int)
+        im = (self.tf.toarray() > 0).astype(int)
         nab = np.dot(im, im.T)
         t = np.tile(self.df, (self.TERMMAX, 1))
         plus = t + t.T
@@ -170,9 +214,45 @@ class Querier:
 
     def read_coefficient_from_file(self):
         self.coefficient = np.fromfile('coefficient.dat', dtype = float)
-        
+
+    def compute_neighbors(self, k = 10):
+        """
+        Compute the top-k dice partners of every term with DiceEngine and
+        save them to dice_neighbors.npy / dice_scores.npy
+        """
+        if self.tf is None:
+            self.read_term_info()
+        engine = DiceEngine(self.tf)
+        self.neighbors, self.neighbor_scores = engine.top_k(k)
+        save_neighbors(self.neighbors, self.neighbor_scores)
+
+    def read_neighbors(self):
+        self.neighbors, self.neighbor_scores = load_neighbors()
+
+    def load_neighbor_table(self):
+        """
+        Read the neighbor table from file, computing it first if it has
+        not been saved yet, or was saved before the tf table or lexicon it
+        depends on (a rebuild may have renumbered the terms)
+        """
+        if self.neighbors is not None:
+            return
+        if os.path.exists('dice_neighbors.npy') and not self.neighbors_stale():
+            self.read_neighbors()
+        else:
+            self.compute_neighbors()
+
+    def neighbors_stale(self, filename = 'dice_neighbors.npy'):
+        """
+        True if filename is older than tf_*.npy or lexicon.dat, the same
+        mtime check read_term_ids does for the lexicon
+        """
+        mtime = os.path.getmtime(filename)
+        return any(os.path.exists(f) and os.path.getmtime(f) > mtime
+                   for f in ('tf_indptr.npy', 'tf_indices.npy', 'tf_data.npy', 'lexicon.dat'))
 
     def find_highest_phrase(self):
+        self.load_neighbor_table()
         for lst in self.randomQueries:# for each 7term query
             res = []
             for tid in lst: # for each term id
@@ -188,19 +268,34 @@ class Querier:
         """
         res = []
         for tmid in query:
-            match = get_highest_match_term(tmid)
+            match = self.get_highest_match_term(tmid)
             res.append(match)
         return res
             
 
 
     def read_offset_linenum(self):
-        with open('offset.json') as f:
-            self.offset = json.load(f)
-        with open('linenum.json') as f:
-            self.linenum = json.load(f)
+        if self.lexicon is None:
+            with open('offset.json') as f:
+                self.offset = json.load(f)
+        if os.path.exists('ucmp_offset.npy'):
+            self.read_ucmp_offset()
+
+    def read_ucmp_offset(self, filename = 'ucmp_indx.dat'):
+        """
+        Load the uncompressed offset table and term rows, and map the
+        uncompressed index
+        """
+        self.ucmp_offset = np.load('ucmp_offset.npy', mmap_mode = 'r')
+        with open('ucmp_terms.json') as f:
+            self.ucmp_row = {t: row for row, t in enumerate(json.load(f))}
+        self.ucmp_reader = PostingsReader(filename)
+
+
+    def read_block_offset(self):
+        with open('blk_offset.json') as f:
+            self.block_offset = json.load(f)
 
-        
     def record_queries_info(self):
         for lst in self.randomQueries: # for each 7 term query
             res = []
@@ -224,18 +319,132 @@ class Querier:
         """
         Read in informations from file that are related to terms
         df.dat: read with np.fromfile: 1darray
-        tf.dat: np.fromfile: 2darray
+        tf_*.npy: CSRMatrix.load, memory-mapped
         idterm.json: 
         termjd.json:
         """
+        self.read_term_ids()
+        self.tf = CSRMatrix.load('tf')
+
+    def read_term_ids(self, index_file = 'indx.dat'):
+        """
+        Read the term <-> id mappings and df, but not the tf table
+        This is all that is needed for fetching postings
+        Uses lexicon.dat when it exists, the json files otherwise
+        A lexicon older than index_file, or whose offsets do not end where
+        index_file does, is left over from another build and is not used
+        """
+        if os.path.exists('lexicon.dat'):
+            if not os.path.exists(index_file):
+                self.read_lexicon()
+                return
+            if os.path.getmtime('lexicon.dat') >= os.path.getmtime(index_file):
+                self.read_lexicon()
+                if self.lexicon.data_end() == os.path.getsize(index_file):
+                    return
+                self.lexicon = self.termtoid = self.idtoterm = self.offset = None
+            if not os.path.exists('termid.json'):
+                raise ValueError("lexicon.dat does not match {}, rebuild the index".format(index_file))
         self.df = np.fromfile('df.dat', dtype = int)
-        self.tf = np.fromfile('tf.dat', dtype = int).reshape((self.df.size,-1))
         with open('termid.json', 'r') as f:
             self.termtoid = json.load(f)
         with open('idterm.json', 'r') as f:
             self.idtoterm = json.load(f, object_hook = jsonKeys2int)
         self.TERMMAX = self.df.size
 
+    def read_lexicon(self, filename = 'lexicon.dat'):
+        """
+        Memory-map the binary term dictionary. termtoid, idtoterm and
+        offset become read-only views over it, df comes from it as well
+        """
+        self.lexicon = Lexicon(filename)
+        self.termtoid = LexiconMap(self.lexicon, 'termid')
+        self.idtoterm = LexiconMap(self.lexicon, 'idterm')
+        self.offset = LexiconMap(self.lexicon, 'offset')
+        self.df = self.lexicon.df_by_id()
+        self.TERMMAX = len(self.lexicon)
+
+    def read_ranking_stats(self):
+        """
+        Load what ranking needs: doc lengths, cf, and the tf table if it
+        is there (for exact score bounds)
+        """
+        if self.doc_table is None:
+            self.read_doc_table()
+        self.doc_length = self.doc_table.length
+        if self.tf is None and os.path.exists('tf_indptr.npy'):
+            self.tf = CSRMatrix.load('tf')
+        if self.lexicon is not None:
+            self.cf = self.lexicon.cf_by_id()
+        elif self.tf is not None:
+            self.cf = self.tf.row_sums()
+        else:
+            self.cf = self.count_cf()
+
+    def count_cf(self, index_file = 'indx.dat'):
+        """
+        cf of every term id counted from the postings, for an index with
+        neither lexicon.dat nor the tf table (as segments.base_lexicon)
+        """
+        if self.termtoid is None:
+            self.read_term_ids(index_file)
+        if self.offset is None:
+            self.read_offset_linenum()
+        reader = PostingsReader(index_file)
+        codec = read_index_header(reader.read(0, INDEX_HEADER.size))
+        cf = np.zeros(self.TERMMAX, dtype = np.int64)
+        for term, tid in self.termtoid.items():
+            if term in self.offset:
+                cf[tid] = sum(iter_counts(codec.decode(reader.read(*self.offset[term])).tolist()))
+        reader.close()
+        return cf
+
+    def get_model(self, model = 'bm25'):
+        """
+        The ranking model 'bm25' or 'ql' (query likelihood, Dirichlet)
+        """
+        if self.doc_length is None:
+            self.read_ranking_stats()
+        if model not in self.models:
+            if model == 'bm25':
+                self.models[model] = BM25(self.doc_length)
+            elif model == 'ql':
+                self.models[model] = DirichletQL(self.doc_length, self.total_tokens())
+            else:
+                raise ValueError("unknown ranking model: {}".format(model))
+        return self.models[model]
+
+    def read_doc_table(self, filename = 'doc_table.dat'):
+        self.doc_table = DocTable(filename)
+
+    def total_tokens(self):
+        if self.doc_table is not None and len(self.doc_table) == len(self.doc_length):
+            return self.doc_table.total_tokens
+        return int(self.doc_length.sum())
+
+    def get_longest_scene(self):
+        """
+        (sceneId, length) of the longest and the shortest scene, from the
+        doc table, as Indexer.get_longest_scene
+        """
+        if self.doc_table is None:
+            self.read_doc_table()
+        return self.doc_table.longest_scene()
+
+    def get_longest_play(self):
+        if self.doc_table is None:
+            self.read_doc_table()
+        return self.doc_table.longest_play()
+
+    def term_bound(self, model, tid, w):
+        """
+        Upper bound of the score of term id tid in any doc
+        Exact from the tf table, otherwise from cf and the shortest doc
+        """
+        if self.tf is not None:
+            return model.bound(w, self.tf.row_data(tid), self.tf.row_indices(tid))
+        return model.bound(w, [self.cf[tid]], [int(np.argmin(self.doc_length))])
+
     def generate_queries_randomly(self):
         """
         Generate 100 x (7 terms) query sets.
@@ -250,8 +459,9 @@ class Querier:
         """
         na = self.df[tid1]
         nb = self.df[tid2]
-        # multiply self.tf[tid1] and self.tf[tid2] elementwise, and count # > 0
-        nab = np.count_nonzero(np.multiply(self.tf[tid1], self.tf[tid2]))
+        # count the documents both rows have
+        nab = np.intersect1d(self.tf.row_indices(tid1), self.tf.row_indices(tid2),
+                             assume_unique = True).size
         return 2.0 * nab / (na + nb)
         
 
@@ -281,13 +491,78 @@ class Querier:
         return res
 
 
+    def fetch_batch(self, terms, workers = 4, max_gap = MAX_GAP, filename = 'indx.dat'):
+        """
+        Decoded postings of many terms at once, see fetch_ids
+        Returns {term: decoded list}
+        """
+        terms = list(dict.fromkeys(terms))
+        lists = self.fetch_ids([self.termtoid[t] for t in terms], workers, max_gap, filename)
+        return {t: lists[self.termtoid[t]] for t in terms}
+
+    def fetch_ids(self, tids, workers = 4, max_gap = MAX_GAP, filename = 'indx.dat'):
+        """
+        Decoded postings of many term ids at once
+        The ranges are read in offset order, nearby ranges merged into one
+        read (see batch_fetch.py), then decoded on a thread pool: vbyte
+        lists in one vectorized batch per worker, other codecs one list
+        at a time
+        Returns {term id: decoded list}
+        """
+        tids = list(dict.fromkeys(int(t) for t in tids))
+        if self.codec is None:
+            with open(filename, 'rb') as f:
+                self.codec = read_index_header(self.read_data_chunk(f, 0, INDEX_HEADER.size))
+        if self.lexicon is not None:
+            offsets, sizes = self.lexicon.offset_size_by_id(tids)
+            ranges = list(zip(tids, offsets.tolist(), sizes.tolist()))
+        else:
+            ranges = [(t,) + tuple(self.offset[self.idtoterm[t]]) for t in tids]
+        chunks = read_ranges(filename, ranges, max_gap)[0]
+        if self.codec.name == 'vbyte':
+            step = max(1, -(-len(tids) // workers))
+            groups = [tids[i:i + step] for i in range(0, len(tids), step)]
+
+            def decode(group):
+                return delta_decode_batch([chunks[t] for t in group])
+        else:
+            groups = [[t] for t in tids]
+
+            def decode(group):
+                return [self.delta_decoding(self.decode_postings(chunks[group[0]]))]
+        res = dict()
+        with ThreadPoolExecutor(max_workers = workers) as pool:
+            for group, lists in zip(groups, pool.map(decode, groups)):
+                res.update(zip(group, lists))
+        return res
+
+    def query_batch(self, set_nums, workers = 4, max_gap = MAX_GAP):
+        """
+        query_compressed for several query sets, fetched as one batch
+        Returns a list with the result of each set
+        """
+        pairs = [list(zip(self.randomQueries[i], self.highestMatch[i])) for i in set_nums]
+        tids = [t for p in pairs for pair in p for t in pair]
+        lists = self.fetch_ids(tids, workers, max_gap)
+        terms = {t: self.idtoterm[t] for t in lists}
+        res = []
+        for p in pairs:
+            d = dict()
+            for tid1, tid2 in p:
+                d[terms[tid1]] = lists[tid1]
+                d[terms[tid2]] = lists[tid2]
+            res.append(d)
+        return res
+
     def restore_compressed_data(self, offset, size):
         """
         Read data and apply vbyte decoding and delta decoding
         """
         f = open('indx.dat', 'rb')
+        if self.codec is None:
+            self.codec = read_index_header(self.read_data_chunk(f, 0, INDEX_HEADER.size))
         data = self.read_data_chunk(f, offset, size)
-        decoded = self.vbyte_decoding(data)
+        decoded = self.decode_postings(data)
         # apply delta decoding
         real_index = self.delta_decoding(decoded)
         f.close()
@@ -329,6 +604,8 @@ class Querier:
         """
         Query the uncomprssed
         """
+        if self.ucmp_offset is None:
+            self.read_ucmp_offset()
         res = dict()
         query_ids = self.randomQueries[set_num]
         query_phrase = self.highestMatch[set_num]
@@ -336,11 +613,9 @@ class Querier:
             term1 = self.idtoterm[query_ids[i]]
             term2 = self.idtoterm[query_phrase[i]]
             #print("Processing uncompressed data to fetch Index for term {},{}".format(term1, term2))
-            linenum1 = self.linenum[term1]
-            linenum2 = self.linenum[term2]
             # next read the index
-            index1 = eval(linecache.getline('ucmp_indx.dat', linenum1))
-            index2 = eval(linecache.getline('ucmp_indx.dat', linenum2))
+            index1 = self.read_uncompressed(term1)
+            index2 = self.read_uncompressed(term2)
             #print("Index for {} : {}".format(term1, index1))
             #print("Index for {} : {}".format(term2, index2))
             res[term1] = index1
@@ -354,41 +629,376 @@ class Querier:
         filevar.seek(offset)
         return filevar.read(size)
 
-    def read_line(self, filename, linenum):
+    def read_skip_table(self, filevar, offset, size):
         """
-        Read a line of data from uncompressed index file
+        Read the skip table of a term stored in the block index
+        Returns (last_docs, block_offsets, header_size), see blockindex.py
         """
-        theline = linecache.getline(filename, linenum)
-        dt = eval(theline)
-        return dt
+        head = self.read_data_chunk(filevar, offset, min(size, 5))
+        num_blocks = next(iter_vbyte(head))
+        head = self.read_data_chunk(filevar, offset, min(size, max_header_size(num_blocks)))
+        return parse_skip_table(head)
 
-    def remove_after_big(self, arr):
-        res = []
-        igtag = False
-        for a in arr:
-            if igtag == False:
-                res.append(a)
+    def read_block_chunk(self, filevar, offset, skip_table, blk):
+        """
+        Read the bytes of block blk only
+        offset: where the term starts in the block index file
+        skip_table: what read_skip_table returned for that term
+        """
+        last_docs, block_offsets, header_size = skip_table
+        start = offset + header_size + block_offsets[blk]
+        return self.read_data_chunk(filevar, start,
+                                    block_offsets[blk + 1] - block_offsets[blk])
+
+    def delta_decoding_block(self, arry, base):
+        """
+        Decode delta encoded data of one block
+        (docDelta, cnt, pos1, pos2, ... docDelta2, cnt2)
+        where the first docDelta is relative to base, the last docID of
+        the previous block
+        """
+        return delta_decode_block(arry, base)
+
+    def read_uncompressed(self, term):
+        """
+        Read the list of term from the uncompressed index
+        Returns an int32 ndarray viewing the mapped file, no copy
+        """
+        row = self.ucmp_row[term]
+        start = int(self.ucmp_offset[row])
+        end = int(self.ucmp_offset[row + 1])
+        return np.frombuffer(self.ucmp_reader.view, dtype = '<i4',
+                             count = end - start, offset = 4 * start)
+
+    def decode_postings(self, data):
+        """
+        Decode a term's bytes with the codec of the index
+        """
+        if self.codec.name == 'vbyte':
+            return self.vbyte_decoding(data)
+        return self.codec.decode(data).tolist()
+
+    def vbyte_decoding(self, byarr, mode = 'auto'):
+        """
+        Decode vbyte encoded strings
+        mode: 'batch' (NumPy), 'stream' (single pass) or 'auto'
+        """
+        return vbyte_decode(byarr, mode)
+
+
+class QuerySession(Querier):
+    """
+    Long-lived query engine
+    Loads the index metadata and the stored query sets once, keeps the
+    compressed index file mapped, and then serves any number of lookups.
+    Use this instead of calling Querier.do_query in a loop.
+    cache_bytes > 0 keeps up to that many bytes of decoded lists in an
+    LRU cache (see postings_cache.py); lookups then return int32 ndarrays
+    If the segment manifest (segments.json) exists, postings, Boolean,
+    phrase and ranked queries run over all segments (see segments.py);
+    the stored query sets still use the ids of the full build
+    With the play table (plays.py), cursor, phrase, boolean and search
+    take play = playId to only look at the scenes of one play
+    """
+    def __init__(self, index_file = 'indx.dat', block_file = 'blk_indx.dat',
+                 cache_bytes = 0, manifest = MANIFEST):
+        Querier.__init__(self)
+        self.read_term_ids(index_file)
+        if self.lexicon is None:
+            with open('offset.json') as f:
+                self.offset = json.load(f)
+        self.load_term_and_phrase()
+        # compressed index, mapped for the lifetime of the session
+        self.reader = PostingsReader(index_file)
+        self.codec = read_index_header(self.reader.read(0, INDEX_HEADER.size))
+        # block index with skip pointers, if it has been built for this
+        # index (one older than index_file is left over from another build)
+        self.block_reader = None
+        if os.path.exists(block_file) and \
+                os.path.getmtime(block_file) >= os.path.getmtime(index_file):
+            self.read_block_offset()
+            self.block_reader = PostingsReader(block_file)
+        # decoded postings by term id, None when caching is off
+        self.cache = PostingsCache(cache_bytes) if cache_bytes > 0 else None
+        # segmented index, None when there is no manifest
+        self.segments = None
+        self.generation = 0
+        if os.path.exists(manifest):
+            self.segments = SegmentSet(manifest)
+            self.generation = self.segments.generation
+        # lengths, sceneIds, plays and collection statistics, mapped up
+        # front; the plays are None if there is no doc table
+        self.plays = None
+        if os.path.exists('doc_table.dat'):
+            self.read_doc_table()
+            self.plays = PlayTable.load(doc_table = self.doc_table)
+        # play -> bool array, True for the docIds outside it
+        self.play_masks = dict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.reader.close()
+        if self.ucmp_reader is not None:
+            self.ucmp_reader.close()
+        if self.block_reader is not None:
+            self.block_reader.close()
+        if self.segments is not None:
+            self.segments.close()
+
+    def check_segments(self):
+        """
+        Drop cached lists and ranking models after segments changed
+        """
+        if self.segments is None or self.segments.generation == self.generation:
+            return
+        self.generation = self.segments.generation
+        if self.cache is not None:
+            self.cache.clear()
+        self.models = dict()
+        self.doc_length = None
+        self.play_masks = dict()
+
+    def has_term(self, term):
+        if self.segments is not None:
+            return self.segments.has_term(term)
+        return term in self.termtoid
+
+    def term_df(self, term):
+        if self.segments is not None:
+            return self.segments.df(term)
+        return int(self.df[self.termtoid[term]])
+
+    def term_cf(self, term):
+        if self.segments is not None:
+            return self.segments.cf(term)
+        return int(self.cf[self.termtoid[term]])
+
+    def read_ranking_stats(self):
+        if self.segments is None:
+            return Querier.read_ranking_stats(self)
+        self.doc_length = self.segments.doc_lengths()
+
+    def get_model(self, model = 'bm25'):
+        self.check_segments()
+        return Querier.get_model(self, model)
+
+    def query(self, set_num, compressed = True):
+        """
+        Same as Querier.do_query, without reloading anything
+        """
+        if compressed:
+            return self.query_compressed(set_num)
+        return self.query_uncompressed(set_num)
+
+    def query_compressed(self, set_num):
+        """
+        Querier.query_compressed, going through the cache when it is on
+        """
+        if self.cache is None and self.segments is None:
+            return Querier.query_compressed(self, set_num)
+        get = self.postings if self.cache is None else self.fetch
+        res = dict()
+        for tid1, tid2 in zip(self.randomQueries[set_num], self.highestMatch[set_num]):
+            term1 = self.idtoterm[tid1]
+            term2 = self.idtoterm[tid2]
+            res[term1] = get(term1)
+            res[term2] = get(term2)
+        return res
+
+    def fetch(self, term):
+        """
+        Decoded postings of term as an int32 ndarray, from the cache if
+        it is there
+        """
+        self.check_segments()
+        # new terms of delta segments have no id, key those by the term
+        key = term if self.segments is not None else self.termtoid[term]
+        if self.cache is not None:
+            arr = self.cache.get(key)
+            if arr is not None:
+                return arr
+        arr = np.array(self.postings(term), dtype = np.int32)
+        if self.cache is not None:
+            self.cache.put(key, arr)
+        return arr
+
+    def postings(self, term):
+        """
+        Fetch the decoded postings list of a single term
+        """
+        if self.segments is not None:
+            return self.segments.postings(term)
+        offset, size = self.offset[term]
+        return self.restore_compressed_data(offset, size)
+
+    def block_postings(self, term):
+        """
+        Random access to a term's postings through the block index
+        """
+        offset, size = self.block_offset[term]
+        return BlockPostings(self.block_reader.read(offset, size))
+
+    def restore_compressed_data(self, offset, size):
+        """
+        Same as Querier.restore_compressed_data but takes a zero-copy
+        slice of the memory-mapped index file
+        """
+        data = self.reader.read(offset, size)
+        decoded = self.decode_postings(data)
+        return self.delta_decoding(decoded)
+
+    def cursor(self, term, blocks = True, play = None):
+        """
+        A cursor over the postings of term, see query_ops.py
+        Uses the cached list when the cache is on, the block index when it
+        is there (and blocks is set), and decodes the flat vbyte bytes
+        lazily otherwise
+        play: only the scenes of this playId
+        """
+        if play is None:
+            return self.term_cursor(term, blocks)
+        return LiveCursor(self.term_cursor(term, blocks), self.play_mask(play))
+
+    def play_mask(self, play):
+        """
+        Bool array over docIds, True for the scenes not in play
+        """
+        self.check_segments()
+        mask = self.play_masks.get(play)
+        if mask is None:
+            if self.segments is not None:
+                doc_plays = self.segments.doc_plays()
+                if self.plays is not None:
+                    # docs of the full build whose segment has no scene list
+                    base = self.plays.doc_play
+                    doc_plays = [self.plays.names[base[d]] if p is None and d < len(base) else p
+                                 for d, p in enumerate(doc_plays)]
+                mask = np.array([p != play for p in doc_plays], dtype = bool)
             else:
-                igtag = False
+                plays = self.play_table()
+                mask = plays.doc_play != plays.play_num.get(play, -1)
+            self.play_masks[play] = mask
+        return mask
+
+    def play_table(self, tf = False):
+        """
+        self.plays, or a clear error if it was not built
+        tf: the play-level tf table is needed too
+        """
+        if self.plays is None:
+            raise ValueError("no doc table (doc_table.dat), the plays have not been built")
+        if tf and self.plays.tf is None:
+            raise ValueError("no play-level tf table (play_tf_*.npy), "
+                             "run count_tf_df and dump_tfdf after the build")
+        return self.plays
+
+    def play_postings(self, term):
+        """
+        {playId: occurrences} of term, from the play-level postings
+        """
+        return self.play_table(tf = True).term_stats(self.termtoid[term])
+
+    def search_plays(self, terms, k = 10):
+        """
+        BM25 over whole plays, returns [(playId, score)] best first
+        """
+        plays = self.play_table(tf = True)
+        return plays.search([self.termtoid[t] for t in terms if t in self.termtoid], k)
+
+    def term_cursor(self, term, blocks = True):
+        if self.cache is not None and self.has_term(term):
+            return ListCursor(self.fetch(term))
+        if self.segments is not None:
+            return self.segments.cursor(term)
+        if term not in self.offset:
+            return ListCursor([])
+        if blocks and self.block_reader is not None:
+            return BlockCursor(self.block_postings(term))
+        offset, size = self.offset[term]
+        if self.codec.name == 'vbyte':
+            return FlatCursor(self.reader.read(offset, size))
+        return ListCursor(self.restore_compressed_data(offset, size))
+
+    def phrase(self, term1, term2, window = 1, ordered = True, blocks = True, play = None):
+        """
+        Scenes where term2 follows term1 (window 1), or comes within window
+        positions after it; if not ordered, within window on either side
+        Returns a list of (docId, positions of term1 starting a match)
+        """
+        return list(phrase_matches(self.cursor(term1, blocks, play),
+                                   self.cursor(term2, blocks, play), window, ordered))
+
+    def boolean_and(self, terms, blocks = True, play = None):
+        """
+        Lazy iterator of the docIds containing every term
+        Lists are intersected rarest first (by df), the rarest driving the
+        skips of the others; an unknown term gives no results
+        """
+        if not terms or not all(self.has_term(term) for term in terms):
+            return iter(())
+        terms = sorted(set(terms), key = self.term_df)
+        return intersect([self.cursor(t, blocks, play) for t in terms])
+
+    def boolean_or(self, terms, blocks = True, play = None):
+        """
+        Lazy iterator of the docIds containing any of the terms
+        """
+        terms = [t for t in set(terms) if self.has_term(t)]
+        return union([self.cursor(t, blocks, play) for t in terms])
+
+    def query_boolean(self, set_num, operator = 'and', blocks = True):
+        """
+        AND or OR of the 7 terms of a stored query set, as a docId list
+        """
+        terms = [self.idtoterm[tid] for tid in self.randomQueries[set_num]]
+        if operator == 'and':
+            return list(self.boolean_and(terms, blocks))
+        return list(self.boolean_or(terms, blocks))
+
+    def search(self, terms, k = 10, model = 'bm25', maxscore = True, blocks = True, play = None):
+        """
+        Ranked retrieval: the top k scenes for the query terms
+        model: 'bm25' or 'ql'; terms not in the vocabulary are dropped
+        Returns [(docId, score)] best first
+        """
+        model = self.get_model(model)
+        cursors = []
+        weights = []
+        bounds = []
+        for term in terms:
+            if not self.has_term(term):
                 continue
-            if a >= 128 :
-                igtag = True
-        return res
+            cf = self.term_cf(term)
+            w = model.weight(self.term_df(term), cf)
+            cursors.append(self.cursor(term, blocks, play))
+            weights.append(w)
+            if self.segments is not None:
+                # the tf table only covers the full build
+                bounds.append(model.bound(w, [cf], [int(np.argmin(self.doc_length))]))
+            else:
+                bounds.append(self.term_bound(model, self.termtoid[term], w))
+        return top_k(cursors, weights, bounds, model, k, maxscore)
 
-    def vbyte_decoding(self, byarr):
+    def search_set(self, set_num, k = 10, model = 'bm25', maxscore = True, blocks = True):
         """
-        Decode vbyte encoded strings
+        Ranked retrieval with the 7 terms of a stored query set
+        """
+        terms = [self.idtoterm[tid] for tid in self.randomQueries[set_num]]
+        return self.search(terms, k, model, maxscore, blocks)
+
+    def query_phrases(self, set_num, window = 1, ordered = True, blocks = True):
+        """
+        Run the 7 phrases of a stored query set (term and its highest dice
+        partner), returns {'term1 term2': phrase matches}
         """
-        ol = []
-        for i in range(len(byarr)):
-            position = 0
-            res = int( byarr[i] & 0x7f)
-
-            while (byarr[i] & 0x80) == 0:
-                i += 1
-                position += 1
-                unsignedByte = int( byarr[i] & 0x7f)
-                res |= ( unsignedByte << (7 * position))
-            ol.append(res)
-        ol = self.remove_after_big(ol)
-        return ol
+        res = dict()
+        for tid1, tid2 in zip(self.randomQueries[set_num], self.highestMatch[set_num]):
+            term1 = self.idtoterm[tid1]
+            term2 = self.idtoterm[tid2]
+            res[term1 + ' ' + term2] = self.phrase(term1, term2, window, ordered, blocks)
+        return res
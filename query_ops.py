@@ -0,0 +1,282 @@
+"""
+File: query_ops.py
+Function: Cursors over postings lists, and the Boolean (AND / OR) and
+          phrase / proximity operators built on them.
+A cursor sits on one document of a term's list:
+    doc          current docId (END once the list is exhausted)
+    count        occurrences of the term in doc
+    positions()  absolute positions of the term in doc
+    next()       move to the next document, returns the new doc
+    skip_to(d)   move to the first document >= d, returns the new doc
+Cursors:
+- FlatCursor:  decodes the flat vbyte bytes of indx.dat lazily, one number
+               at a time, and only decodes positions that are asked for
+- ListCursor:  over an already decoded [docID, cnt, pos1, ...] list;
+               skip_to gallops over the docIds
+- BlockCursor: over the block index (blockindex.py); skip_to uses the skip
+               table to decode only the block that can hold the target
+- LiveCursor:  wraps another cursor and passes over deleted documents
+Intersections stop as soon as one list runs out, so the rest of the other
+lists is never decoded. intersect and union are generators, so a caller
+that stops early also stops the decoding.
+"""
+import heapq
+import sys
+from bisect import bisect_left, bisect_right
+from collections import deque
+from itertools import islice
+
+from vbyte import iter_vbyte
+
+# docId of an exhausted cursor
+END = sys.maxsize
+
+
+def gallop(docs, lo, target):
+    """
+    Index of the first entry >= target in the sorted docs, starting at lo
+    Exponential search from lo, then binary search in the last step
+    """
+    step = 1
+    hi = lo
+    while hi < len(docs) and docs[hi] < target:
+        lo = hi + 1
+        hi = lo + step
+        step *= 2
+    return bisect_left(docs, target, lo, min(hi, len(docs)))
+
+
+class FlatCursor:
+    """
+    data: a term's bytes in indx.dat (vbyte, [docDelta, cnt, pos1, posDelta...])
+    """
+    def __init__(self, data):
+        self.it = iter_vbyte(data)
+        self.doc = 0
+        self.count = 0
+        # decoded positions of the current doc, None until asked for
+        self.pos = None
+        # position numbers of the current doc not decoded yet
+        self.left = 0
+        self.next()
+
+    def next(self):
+        if self.doc == END:
+            return END
+        # skip the positions nobody asked for
+        deque(islice(self.it, self.left), maxlen = 0)
+        delta = next(self.it, None)
+        if delta is None:
+            self.doc = END
+            self.count = 0
+            self.left = 0
+            return END
+        self.doc += delta
+        self.count = next(self.it)
+        self.left = self.count
+        self.pos = None
+        return self.doc
+
+    def skip_to(self, target):
+        while self.doc < target:
+            self.next()
+        return self.doc
+
+    def positions(self):
+        if self.pos is None:
+            res = []
+            p = 0
+            for delta in islice(self.it, self.left):
+                p += delta
+                res.append(p)
+            self.left = 0
+            self.pos = res
+        return self.pos
+
+
+class ListCursor:
+    """
+    postings: decoded [docID, cnt, pos1, pos2, ...] with absolute values,
+    as from Querier.delta_decoding or the uncompressed index
+    """
+    def __init__(self, postings):
+        self.load(postings)
+
+    def load(self, postings):
+        self.data = postings
+        # docIds and where each doc starts in data
+        self.docs = []
+        self.starts = []
+        i = 0
+        while i < len(postings):
+            self.docs.append(int(postings[i]))
+            self.starts.append(i)
+            i += 2 + int(postings[i + 1])
+        self.i = 0
+        self.set_doc()
+
+    def set_doc(self):
+        if self.i < len(self.docs):
+            self.doc = self.docs[self.i]
+            self.count = int(self.data[self.starts[self.i] + 1])
+        else:
+            self.doc = END
+            self.count = 0
+
+    def next(self):
+        if self.doc == END:
+            return END
+        self.i += 1
+        self.set_doc()
+        return self.doc
+
+    def skip_to(self, target):
+        if self.doc < target:
+            self.i = gallop(self.docs, self.i, target)
+            self.set_doc()
+        return self.doc
+
+    def positions(self):
+        start = self.starts[self.i] + 2
+        return list(self.data[start:start + self.count])
+
+
+class BlockCursor(ListCursor):
+    """
+    block_postings: a BlockPostings over a term's bytes in the block index
+    """
+    def __init__(self, block_postings):
+        self.bp = block_postings
+        self.blk = -1
+        self.load_block(0)
+
+    def load_block(self, blk):
+        self.blk = blk
+        if blk < self.bp.num_blocks:
+            self.load(self.bp.decode_block(blk))
+        else:
+            self.load([])
+
+    def next(self):
+        if self.doc == END:
+            return END
+        self.i += 1
+        if self.i >= len(self.docs):
+            self.load_block(self.blk + 1)
+        else:
+            self.set_doc()
+        return self.doc
+
+    def skip_to(self, target):
+        if self.doc >= target:
+            return self.doc
+        if target > self.bp.last_docs[self.blk]:
+            self.load_block(self.bp.find_block(target))
+        return ListCursor.skip_to(self, target)
+
+
+class LiveCursor:
+    """
+    cursor: any cursor; deleted: bool array, deleted[docId - first_doc]
+    One array lookup per document the inner cursor stops on, so skip_to
+    still skips over whatever the inner cursor skips
+    """
+    def __init__(self, cursor, deleted, first_doc = 0):
+        self.cursor = cursor
+        self.deleted = deleted
+        self.first_doc = first_doc
+        self.settle()
+
+    def settle(self):
+        c = self.cursor
+        while c.doc != END and self.deleted[c.doc - self.first_doc]:
+            c.next()
+        self.doc = c.doc
+        self.count = c.count
+
+    def next(self):
+        if self.doc == END:
+            return END
+        self.cursor.next()
+        self.settle()
+        return self.doc
+
+    def skip_to(self, target):
+        if self.doc >= target:
+            return self.doc
+        self.cursor.skip_to(target)
+        self.settle()
+        return self.doc
+
+    def positions(self):
+        return self.cursor.positions()
+
+
+def intersect(cursors):
+    """
+    Yield the docIds every cursor has, in increasing order
+    Each cursor is left on the yielded doc until the next one is asked
+    for. Put the rarest list first: it drives the skipping
+    """
+    target = max(c.doc for c in cursors)
+    while target != END:
+        for c in cursors:
+            if c.skip_to(target) > target:
+                target = c.doc
+                break
+        else:
+            yield target
+            target = max(target + 1, cursors[0].next())
+
+
+def iter_docs(cursor):
+    """
+    Yield the docIds of a cursor from where it is
+    """
+    doc = cursor.doc
+    while doc != END:
+        yield doc
+        doc = cursor.next()
+
+
+def union(cursors):
+    """
+    Yield the docIds any cursor has, in increasing order, once each
+    k-way merge of the lists on a heap
+    """
+    last = None
+    for doc in heapq.merge(*[iter_docs(c) for c in cursors]):
+        if doc != last:
+            yield doc
+            last = doc
+
+
+def match_positions(pos1, pos2, window = 1, ordered = True):
+    """
+    Positions p of pos1 that have a q in pos2 with
+        ordered:   p < q <= p + window (window 1 is an exact phrase)
+        unordered: 0 < |q - p| <= window
+    Both lists sorted
+    """
+    res = []
+    for p in pos1:
+        if ordered:
+            j = bisect_right(pos2, p)
+        else:
+            j = bisect_left(pos2, p - window)
+            if j < len(pos2) and pos2[j] == p:
+                j += 1
+        if j < len(pos2) and pos2[j] <= p + window and pos2[j] != p:
+            res.append(p)
+    return res
+
+
+def phrase_matches(cur1, cur2, window = 1, ordered = True):
+    """
+    Yield (docId, positions of term1 starting a match) for every doc where
+    term2 follows term1 within window (or is near it, if not ordered)
+    """
+    for doc in intersect([cur1, cur2]):
+        starts = match_positions(cur1.positions(), cur2.positions(), window, ordered)
+        if starts:
+            yield doc, starts
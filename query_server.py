@@ -0,0 +1,279 @@
+"""
+File: query_server.py
+Function: Local query service: one QuerySession held warm behind an
+          asyncio TCP server, shared by any number of clients.
+Protocol: JSON lines. Every request is one line, e.g.
+    {"id": 1, "op": "search", "terms": ["king", "queen"], "k": 10, "model": "bm25"}
+and gets one line back
+    {"id": 1, "ok": true, "result": ..., "latency_ms": ..., "queue_ms": ...}
+or {"id": 1, "ok": false, "error": "..."}. Replies on one connection may
+come back out of order; match them by id.
+Ops:
+    postings  term                                   decoded postings list
+    and, or   terms, limit (optional)                docIds
+    phrase    term1, term2, window = 1, ordered = true   [[docId, positions]]
+    search    terms, k = 10, model = 'bm25' | 'ql'   [[docId, score]]
+    set       set_num, query = 'search' | 'and' | 'or' | 'phrases' (and its
+              arguments) over a stored query set
+    stats     server counters and latency percentiles
+Connections are read on the event loop; requests go to a bounded queue
+and a few worker tasks run them on a thread pool, so decoding never
+blocks the loop. When the queue is full a request is refused at once
+with "server busy" instead of piling up.
+Run: python query_server.py --port 7654 [--workers 4] [--queue-size 256]
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+import numpy as np
+
+from query_index import QuerySession
+
+HOST = '127.0.0.1'
+PORT = 7654
+# requests waiting for a worker before new ones are refused
+QUEUE_SIZE = 256
+# requests run at the same time
+WORKERS = 4
+# latencies kept for the percentiles in stats
+LATENCY_WINDOW = 10000
+
+
+class Connection:
+    """
+    One client: replies go out on writer under lock, one at a time;
+    pending counts its requests still queued or running
+    """
+    def __init__(self, writer):
+        self.writer = writer
+        self.lock = asyncio.Lock()
+        self.pending = 0
+        # set while nothing is pending
+        self.idle = asyncio.Event()
+        self.idle.set()
+
+    def add(self):
+        self.pending += 1
+        self.idle.clear()
+
+    def done(self):
+        self.pending -= 1
+        if not self.pending:
+            self.idle.set()
+
+
+class QueryServer:
+    def __init__(self, session, host = HOST, port = PORT,
+                 workers = WORKERS, queue_size = QUEUE_SIZE):
+        self.session = session
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.queue_size = queue_size
+        self.queue = None
+        self.pool = ThreadPoolExecutor(max_workers = workers)
+        self.server = None
+        self.tasks = []
+        # handle_client tasks of the open connections
+        self.clients = set()
+        self.served = 0
+        self.failed = 0
+        self.rejected = 0
+        self.latencies = deque(maxlen = LATENCY_WINDOW)
+        # set the ranking models up front, not from several threads
+        if os.path.exists('doc_table.dat'):
+            session.get_model('bm25')
+            session.get_model('ql')
+
+    async def start(self):
+        self.queue = asyncio.Queue(maxsize = self.queue_size)
+        self.server = await asyncio.start_server(self.handle_client, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.tasks = [asyncio.create_task(self.worker()) for i in range(self.workers)]
+
+    async def serve_forever(self):
+        await self.start()
+        print("serving on {}:{}".format(self.host, self.port), flush = True)
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def stop(self):
+        self.server.close()
+        for t in self.clients:
+            t.cancel()
+        await asyncio.gather(*self.clients, return_exceptions = True)
+        await self.server.wait_closed()
+        for t in self.tasks:
+            t.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions = True)
+        self.pool.shutdown()
+
+    async def handle_client(self, reader, writer):
+        task = asyncio.current_task()
+        self.clients.add(task)
+        conn = Connection(writer)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                received = time.perf_counter()
+                try:
+                    req = json.loads(line)
+                except ValueError:
+                    await self.reply(conn, {'id': None, 'ok': False, 'error': 'bad json'})
+                    continue
+                if not isinstance(req, dict):
+                    await self.reply(conn, {'id': None, 'ok': False, 'error': 'bad request'})
+                    continue
+                if req.get('op') == 'stats':
+                    await self.reply(conn, {'id': req.get('id'), 'ok': True,
+                                                    'result': self.stats()})
+                    continue
+                try:
+                    self.queue.put_nowait((req, conn, received))
+                    conn.add()
+                except asyncio.QueueFull:
+                    self.rejected += 1
+                    await self.reply(conn, {'id': req.get('id'), 'ok': False,
+                                            'error': 'server busy'})
+            # end of input: the queued requests still reply on this writer
+            await conn.idle.wait()
+        except ConnectionError:
+            pass
+        except asyncio.CancelledError:
+            # stop(); ending as cancelled would make asyncio's stream
+            # callback log the CancelledError (task.exception() raises it)
+            pass
+        finally:
+            writer.close()
+            self.clients.discard(task)
+
+    async def worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            req, conn, received = await self.queue.get()
+            started = time.perf_counter()
+            try:
+                result = await loop.run_in_executor(self.pool, self.execute, req)
+                resp = {'id': req.get('id'), 'ok': True, 'result': result}
+                self.served += 1
+            except Exception as e:
+                resp = {'id': req.get('id'), 'ok': False,
+                        'error': '{}: {}'.format(type(e).__name__, e)}
+                self.failed += 1
+            done = time.perf_counter()
+            resp['latency_ms'] = (done - received) * 1000
+            resp['queue_ms'] = (started - received) * 1000
+            self.latencies.append(resp['latency_ms'])
+            try:
+                await self.reply(conn, resp)
+            finally:
+                conn.done()
+                self.queue.task_done()
+
+    async def reply(self, conn, resp):
+        async with conn.lock:
+            try:
+                conn.writer.write(json.dumps(resp).encode('utf-8') + b'\n')
+                await conn.writer.drain()
+            except ConnectionError:
+                pass
+
+    def execute(self, req):
+        """
+        Run one request on the session (on a pool thread)
+        """
+        s = self.session
+        op = req.get('op')
+        if op == 'set':
+            op = req.get('query', 'search')
+            if op == 'phrases':
+                res = s.query_phrases(req['set_num'], req.get('window', 1), req.get('ordered', True))
+                return {k: [[doc, [int(p) for p in starts]] for doc, starts in v]
+                        for k, v in res.items()}
+            req = dict(req, terms = [s.idtoterm[t] for t in s.randomQueries[req['set_num']]])
+        if op == 'postings':
+            res = s.fetch(req['term']) if s.cache is not None else s.postings(req['term'])
+            return [int(x) for x in res]
+        if op in ('and', 'or'):
+            docs = s.boolean_and(req['terms']) if op == 'and' else s.boolean_or(req['terms'])
+            return list(islice(docs, req.get('limit')))
+        if op == 'phrase':
+            return [[doc, [int(p) for p in starts]]
+                    for doc, starts in s.phrase(req['term1'], req['term2'],
+                                                req.get('window', 1), req.get('ordered', True))]
+        if op == 'search':
+            res = s.search(req['terms'], req.get('k', 10), req.get('model', 'bm25'))
+            return [[int(doc), float(score)] for doc, score in res]
+        raise ValueError("unknown op: {}".format(op))
+
+    def stats(self):
+        res = {'served': self.served,
+               'failed': self.failed,
+               'rejected': self.rejected,
+               'queued': self.queue.qsize()}
+        if self.latencies:
+            p = np.percentile(list(self.latencies), [50, 95, 99])
+            res['latency_ms'] = {'p50': p[0], 'p95': p[1], 'p99': p[2]}
+        if self.session.cache is not None:
+            res['cache'] = self.session.cache.stats()
+        return res
+
+
+class QueryClient:
+    """
+    Blocking client, one request at a time, for notebooks and scripts
+    """
+    def __init__(self, host = HOST, port = PORT):
+        self.sock = socket.create_connection((host, port))
+        self.f = self.sock.makefile('rwb')
+        self.next_id = 0
+
+    def request(self, op, **args):
+        """
+        Send one request, return the whole reply dictionary
+        """
+        self.next_id += 1
+        req = dict(args, op = op, id = self.next_id)
+        self.f.write(json.dumps(req).encode('utf-8') + b'\n')
+        self.f.flush()
+        return json.loads(self.f.readline())
+
+    def close(self):
+        self.f.close()
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Serve the index over JSON lines on TCP')
+    parser.add_argument('--host', default = HOST)
+    parser.add_argument('--port', type = int, default = PORT)
+    parser.add_argument('--workers', type = int, default = WORKERS)
+    parser.add_argument('--queue-size', type = int, default = QUEUE_SIZE)
+    parser.add_argument('--cache-bytes', type = int, default = 0,
+                        help = 'LRU cache of decoded lists, 0 for none')
+    args = parser.parse_args()
+    with QuerySession(cache_bytes = args.cache_bytes) as session:
+        server = QueryServer(session, args.host, args.port, args.workers, args.queue_size)
+        try:
+            asyncio.run(server.serve_forever())
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+"""
+File: ranking.py
+Function: Ranked retrieval: BM25 and query likelihood with Dirichlet
+          smoothing, scored document-at-a-time over postings cursors
+          (query_ops.py) into a bounded top-k heap.
+Both models split a document's score into
+    doc_score(doc, n) + sum of score(weight, tf, doc) over the query terms
+    the document contains
+where weight is a per-term constant (from df / cf) and doc_score does not
+depend on the terms (0 for BM25). Only documents containing at least one
+query term are scored.
+top_k uses MaxScore: every term has an upper bound on its score. Once the
+heap is full, the terms with the smallest bounds whose bounds add up to
+less than the k-th score cannot put a document in the heap on their own
+("non-essential"); documents are only taken from the other lists, and the
+non-essential lists are merely probed with skip_to while the document can
+still make it.
+"""
+import heapq
+import math
+
+import numpy as np
+
+from query_ops import END
+
+
+class BM25:
+    name = 'bm25'
+
+    def __init__(self, doc_length, k1 = 1.2, b = 0.75):
+        dl = np.asarray(doc_length, dtype = float)
+        self.k1 = k1
+        self.b = b
+        self.num_docs = len(dl)
+        self.avg_length = dl.mean() if len(dl) else 0.0
+        # k1 * (1 - b + b * dl / avgdl) of every doc
+        self.norm = k1 * (1 - b + b * dl / self.avg_length)
+        self.norm_list = self.norm.tolist()
+
+    def weight(self, df, cf):
+        """
+        idf, in the form that never goes negative
+        """
+        return math.log(1 + (self.num_docs - df + 0.5) / (df + 0.5))
+
+    def score(self, w, tf, doc):
+        return w * tf * (self.k1 + 1) / (tf + self.norm_list[doc])
+
+    def bound(self, w, tfs, docs):
+        """
+        Highest score of a term over (tf, doc) pairs, vectorized
+        """
+        tfs = np.asarray(tfs, dtype = float)
+        return float((w * tfs * (self.k1 + 1) / (tfs + self.norm[docs])).max())
+
+    def doc_score(self, doc, n):
+        return 0.0
+
+    def constant(self, weights):
+        return 0.0
+
+
+class DirichletQL:
+    """
+    log P(q|d) = sum over query terms of log((tf + mu P(t|C)) / (dl + mu))
+    rewritten as
+        n log(mu / (dl + mu))                  doc_score, <= 0
+      + sum over terms in d of log(1 + tf / (mu P(t|C)))
+      + sum over query terms of log P(t|C)     constant
+    """
+    name = 'ql'
+
+    def __init__(self, doc_length, total_tokens, mu = 2000):
+        dl = np.asarray(doc_length, dtype = float)
+        self.mu = mu
+        self.total_tokens = total_tokens
+        self.num_docs = len(dl)
+        # log(mu / (dl + mu)) of every doc
+        self.length_part = np.log(mu / (dl + mu)).tolist()
+
+    def weight(self, df, cf):
+        """
+        mu P(t|C)
+        """
+        return self.mu * cf / self.total_tokens
+
+    def score(self, w, tf, doc):
+        return math.log(1 + tf / w)
+
+    def bound(self, w, tfs, docs):
+        return math.log(1 + float(np.max(tfs)) / w)
+
+    def doc_score(self, doc, n):
+        return n * self.length_part[doc]
+
+    def constant(self, weights):
+        return sum(math.log(w / self.mu) for w in weights)
+
+
+def top_k(cursors, weights, bounds, model, k = 10, maxscore = True):
+    """
+    Document-at-a-time scoring of the query terms' cursors
+    weights, bounds: model.weight and the score upper bound of each term
+    Returns [(docId, score)] best first, ties broken by lower docId
+    """
+    n = len(cursors)
+    if n == 0 or k <= 0:
+        return []
+    # smallest bound first; prefix[i] is the sum of the first i + 1 bounds
+    order = sorted(range(n), key = lambda i: bounds[i])
+    cursors = [cursors[i] for i in order]
+    weights = [weights[i] for i in order]
+    prefix = list(np.cumsum([bounds[i] for i in order]))
+    heap = []
+    threshold = -math.inf
+    # cursors[:first] are the non-essential lists
+    first = 0
+    while first < n:
+        doc = min(c.doc for c in cursors[first:])
+        if doc == END:
+            break
+        score = model.doc_score(doc, n)
+        for i in range(first, n):
+            c = cursors[i]
+            if c.doc == doc:
+                score += model.score(weights[i], c.count, doc)
+                c.next()
+        # probe the non-essential lists, highest bound first, while the
+        # doc can still beat the k-th score
+        for i in range(first - 1, -1, -1):
+            if score + prefix[i] < threshold:
+                break
+            c = cursors[i]
+            if c.skip_to(doc) == doc:
+                score += model.score(weights[i], c.count, doc)
+        entry = (score, -doc)
+        if len(heap) < k:
+            heapq.heappush(heap, entry)
+        elif entry > heap[0]:
+            heapq.heapreplace(heap, entry)
+        if len(heap) == k and maxscore:
+            threshold = heap[0][0]
+            while first < n and prefix[first] < threshold:
+                first += 1
+    const = model.constant(weights)
+    return [(-d, s + const) for s, d in sorted(heap, reverse = True)]
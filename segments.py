@@ -0,0 +1,697 @@
+"""
+File: segments.py
+Function: Segmented index with incremental updates.
+The index is a list of segments over consecutive docId ranges. The first
+one is the full build (indx.dat + lexicon.dat + doc_table.dat). New
+scenes go into a small delta segment each time add_scenes is called, and
+never touch the existing files:
+    seg_NNNNN.dat          postings, flat vbyte like indx.dat (absolute docIds)
+    seg_NNNNN.lex          lexicon.dat format (offsets into seg_NNNNN.dat)
+    seg_NNNNN_doclen.npy   length of every doc of the segment
+    seg_NNNNN_scenes.json  [sceneId, playId] of every doc of the segment
+    seg_NNNNN_deleted.npy  deletion bitmap (np.packbits), once a doc of
+                           the segment is deleted
+segments.json (the manifest) lists the live segments in docId order. It
+is rewritten to a temporary file and renamed, so readers see either the
+old or the new list.
+A term's postings are the concatenation of its lists in each segment.
+Deleting a scene only sets its bit; cursors and postings pass over
+deleted docs, df / cf / doc lengths still count them until compaction.
+Updating a scene adds the new version and deletes the old one, so it
+gets a new docId.
+Compaction merges runs of similar-sized delta segments into one
+(log-structured, MERGE_FACTOR at a time), joining each term's bytes with
+join_partials instead of re-encoding; it can run on a background thread
+while queries and additions go on. Lists with deleted docs are decoded
+and re-encoded without them, and a segment with at least PURGE_RATIO of
+its docs deleted is rewritten on its own (the base one too: indx.dat is
+left alone and a new segment file takes its place in the manifest).
+Deleted docs keep their docIds and lengths, so docIds never change.
+"""
+import heapq
+import json
+import os
+import threading
+
+import numpy as np
+
+from builder import PostingsBuilder, join_partials, first_number_size
+from batch_fetch import delta_decode_batch
+from doctable import DocTable
+from inv_util import tokenize
+from lexicon import Lexicon, write_lexicon
+from postings_codecs import INDEX_HEADER, read_index_header
+from postings_reader import PostingsReader
+from query_ops import END, FlatCursor, ListCursor, LiveCursor
+from vbyte import vbyte_encode, vbyte_decode_batch
+
+MANIFEST = 'segments.json'
+# delta segments merged at a time
+MERGE_FACTOR = 4
+# rewrite a segment once this share of its docs is deleted
+PURGE_RATIO = 0.2
+
+
+def last_doc(vals):
+    """
+    Last docId of a decoded flat list [docDelta, cnt, pos...]
+    """
+    doc = 0
+    i = 0
+    while i < len(vals):
+        doc += vals[i]
+        i += 2 + vals[i + 1]
+    return doc
+
+
+def drop_deleted(vals, deleted, first_doc):
+    """
+    A decoded flat list [docDelta, cnt, pos...] without the docs set in
+    deleted (indexed by docId - first_doc), deltas redone
+    """
+    res = []
+    doc = 0
+    prev = 0
+    i = 0
+    while i < len(vals):
+        doc += vals[i]
+        n = vals[i + 1]
+        if not deleted[doc - first_doc]:
+            res.append(doc - prev)
+            res.extend(vals[i + 1:i + 2 + n])
+            prev = doc
+        i += 2 + n
+    return res
+
+
+def drop_deleted_docs(lst, deleted, first_doc):
+    """
+    drop_deleted for a list with absolute docIds [docID, cnt, pos...]
+    """
+    res = []
+    i = 0
+    while i < len(lst):
+        n = lst[i + 1]
+        if not deleted[lst[i] - first_doc]:
+            res.extend(lst[i:i + 2 + n])
+        i += 2 + n
+    return res
+
+
+def save_bitmap(filename, deleted):
+    """
+    Write a deletion bitmap packed 8 docs a byte, atomically
+    """
+    tmp = filename + '.tmp'
+    with open(tmp, 'wb') as f:
+        np.save(f, np.packbits(deleted))
+    os.replace(tmp, filename)
+
+
+class Segment:
+    """
+    Read access to one segment
+    info: its manifest entry
+    """
+    def __init__(self, info):
+        self.info = info
+        self.name = info['name']
+        self.first_doc = info['first_doc']
+        self.last_doc = info['last_doc']
+        self.reader = PostingsReader(info['index'])
+        self.codec = read_index_header(self.reader.read(0, INDEX_HEADER.size))
+        self.lexicon = Lexicon(info['lexicon'])
+        # indexed by docId - first_doc; the full build has its lengths,
+        # sceneIds and plays in its doc table
+        self.doc_table = None
+        if 'doc_table' in info:
+            self.doc_table = DocTable(info['doc_table'])
+            self.doc_length = self.doc_table.length
+        else:
+            self.doc_length = np.load(info['doc_length'])
+        # bool array like doc_length, None while nothing is deleted
+        self.deleted = None
+        if 'deleted' in info:
+            self.deleted = np.unpackbits(np.load(info['deleted']),
+                                         count = len(self.doc_length)).astype(bool)
+        # [sceneId, playId] of every doc and sceneId -> docIds, read when
+        # first asked for
+        self.scenes = None
+        self.scene_docs = None
+
+    def data(self, term):
+        """
+        The term's bytes in this segment, or None
+        """
+        r = self.lexicon.find(term)
+        if r < 0:
+            return None
+        return self.data_at(r)
+
+    def data_at(self, r):
+        """
+        The bytes of the term at lexicon rank r
+        """
+        return self.reader.read(int(self.lexicon.offsets[r]), int(self.lexicon.sizes[r]))
+
+    def vbyte_data(self, term):
+        """
+        data(), converted to vbyte if the segment uses another codec
+        """
+        r = self.lexicon.find(term)
+        return self.vbyte_data_at(r) if r >= 0 else None
+
+    def vbyte_data_at(self, r):
+        data = self.data_at(r)
+        if self.codec.name == 'vbyte':
+            return data
+        return vbyte_encode(self.codec.decode(data).tolist())
+
+    def df(self, term):
+        r = self.lexicon.find(term)
+        return int(self.lexicon.df[r]) if r >= 0 else 0
+
+    def cf(self, term):
+        r = self.lexicon.find(term)
+        return int(self.lexicon.cf[r]) if r >= 0 else 0
+
+    def cursor(self, term):
+        data = self.data(term)
+        if data is None:
+            return None
+        if self.codec.name == 'vbyte':
+            c = FlatCursor(data)
+        else:
+            c = ListCursor(delta_decode_batch([self.vbyte_data(term)])[0])
+        if self.deleted is not None:
+            c = LiveCursor(c, self.deleted, self.first_doc)
+        return c
+
+    def scene_list(self):
+        """
+        [sceneId, playId] (or None) of every doc of the segment
+        """
+        if self.scenes is None:
+            if 'scenes' in self.info:
+                with open(self.info['scenes']) as f:
+                    self.scenes = json.load(f)
+            elif self.doc_table is not None:
+                dt = self.doc_table
+                self.scenes = [[dt.scene_id(d), dt.play_id(d)] for d in range(len(dt))]
+            else:
+                self.scenes = [None] * len(self.doc_length)
+        return self.scenes
+
+    def find_scene(self, scene_id):
+        """
+        DocIds of the segment holding scene_id, deleted ones included
+        """
+        if self.scene_docs is None:
+            self.scene_docs = dict()
+            for i, sc in enumerate(self.scene_list()):
+                if sc is not None:
+                    self.scene_docs.setdefault(sc[0], []).append(self.first_doc + i)
+        return self.scene_docs.get(scene_id, [])
+
+    def close(self):
+        self.reader.close()
+
+
+class ChainCursor:
+    """
+    One cursor over a term's lists in consecutive segments
+    parts: (last docId of the segment, cursor), in docId order
+    skip_to passes over whole segments without touching their lists
+    """
+    def __init__(self, parts):
+        self.parts = parts
+        self.k = 0
+        self.settle()
+
+    def settle(self):
+        """
+        Move on to the next segments while the current one is exhausted
+        """
+        while self.k < len(self.parts) and self.parts[self.k][1].doc == END:
+            self.k += 1
+        if self.k < len(self.parts):
+            c = self.parts[self.k][1]
+            self.doc = c.doc
+            self.count = c.count
+        else:
+            self.doc = END
+            self.count = 0
+
+    def next(self):
+        if self.doc == END:
+            return END
+        self.parts[self.k][1].next()
+        self.settle()
+        return self.doc
+
+    def skip_to(self, target):
+        if self.doc >= target:
+            return self.doc
+        while self.k < len(self.parts) and self.parts[self.k][0] < target:
+            self.k += 1
+        if self.k < len(self.parts):
+            self.parts[self.k][1].skip_to(target)
+        self.settle()
+        return self.doc
+
+    def positions(self):
+        return self.parts[self.k][1].positions()
+
+
+def base_lexicon(index_file = 'indx.dat', filename = 'lexicon.dat'):
+    """
+    Write lexicon.dat for an index built before lexicons existed, from
+    offset.json, termid.json and df.dat; cf is counted from the postings
+    """
+    with open('offset.json') as f:
+        offsets = json.load(f)
+    with open('termid.json') as f:
+        termtoid = json.load(f)
+    df = np.fromfile('df.dat', dtype = int)
+    reader = PostingsReader(index_file)
+    codec = read_index_header(reader.read(0, INDEX_HEADER.size))
+    cf = np.zeros(len(termtoid), dtype = np.int64)
+    for term, tid in termtoid.items():
+        if term in offsets:
+            vals = codec.decode(reader.read(*offsets[term])).tolist()
+            cf[tid] = sum(iter_counts(vals))
+    reader.close()
+    write_lexicon(filename, termtoid, {t: offsets.get(t, (0, 0)) for t in termtoid}, df, cf)
+
+
+def iter_counts(vals):
+    """
+    The cnt of every doc of a decoded flat list
+    """
+    i = 0
+    while i < len(vals):
+        yield vals[i + 1]
+        i += 2 + vals[i + 1]
+
+
+def create_manifest(manifest = MANIFEST, index_file = 'indx.dat', doc_table = 'doc_table.dat'):
+    """
+    Start a manifest with the full build as its only segment
+    doc_table: the build's doc table, which gives the base segment its
+    doc lengths, sceneIds and playIds
+    """
+    if not os.path.exists('lexicon.dat'):
+        base_lexicon(index_file)
+    num_docs = len(DocTable(doc_table))
+    info = {'name': 'base',
+            'index': index_file,
+            'lexicon': 'lexicon.dat',
+            'doc_table': doc_table,
+            'first_doc': 0,
+            'last_doc': num_docs - 1,
+            'bytes': os.path.getsize(index_file)}
+    state = {'next_doc': num_docs, 'next_segment': 1, 'segments': [info]}
+    write_manifest(manifest, state)
+    return state
+
+
+def write_manifest(manifest, state):
+    tmp = manifest + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(state, f, indent = 1)
+    os.replace(tmp, manifest)
+
+
+class SegmentSet:
+    def __init__(self, manifest = MANIFEST):
+        self.manifest = manifest
+        # held while the manifest is changed (add_scenes, merge swap)
+        self.lock = threading.Lock()
+        # only one compaction at a time
+        self.merge_lock = threading.Lock()
+        # bumped on every change, so users can drop what they derived
+        self.generation = 0
+        with open(manifest) as f:
+            self.state = json.load(f)
+        self.segments = [Segment(info) for info in self.state['segments']]
+        # merged away, but queries started before the swap may still read
+        # them; closed together with the set
+        self.retired = []
+
+    def close(self):
+        for seg in self.segments + self.retired:
+            seg.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def num_docs(self):
+        return self.state['next_doc']
+
+    def has_term(self, term):
+        return any(seg.lexicon.find(term) >= 0 for seg in self.segments)
+
+    def df(self, term):
+        return sum(seg.df(term) for seg in self.segments)
+
+    def cf(self, term):
+        return sum(seg.cf(term) for seg in self.segments)
+
+    def doc_lengths(self):
+        """
+        Length of every docId over all segments
+        """
+        res = np.zeros(self.state['next_doc'], dtype = np.int64)
+        for seg in self.segments:
+            res[seg.first_doc:seg.first_doc + len(seg.doc_length)] = seg.doc_length
+        return res
+
+    def cursor(self, term):
+        segments = self.segments
+        parts = []
+        for seg in segments:
+            c = seg.cursor(term)
+            if c is not None:
+                parts.append((seg.last_doc, c))
+        return ChainCursor(parts)
+
+    def postings(self, term):
+        """
+        Decoded [docID, cnt, pos1, ...] of term over all segments, without
+        deleted docs
+        """
+        segments = []
+        chunks = []
+        for seg in self.segments:
+            data = seg.vbyte_data(term)
+            if data is not None:
+                segments.append(seg)
+                chunks.append(data)
+        res = []
+        for seg, lst in zip(segments, delta_decode_batch(chunks)):
+            if seg.deleted is not None:
+                lst = drop_deleted_docs(lst, seg.deleted, seg.first_doc)
+            res.extend(lst)
+        return res
+
+    def doc_plays(self):
+        """
+        playId (or None) of every docId over all segments
+        """
+        res = [None] * self.state['next_doc']
+        for seg in self.segments:
+            for i, sc in enumerate(seg.scene_list()):
+                if sc is not None:
+                    res[seg.first_doc + i] = sc[1]
+        return res
+
+    def find_scene(self, scene_id):
+        """
+        Live docIds holding scene_id
+        """
+        return [d for seg in self.segments for d in seg.find_scene(scene_id)
+                if seg.deleted is None or not seg.deleted[d - seg.first_doc]]
+
+    def delete(self, docIds):
+        """
+        Mark docs deleted in their segments' bitmaps
+        Returns the number of docs newly deleted
+        """
+        docIds = np.unique(np.asarray(docIds, dtype = np.int64))
+        deleted = 0
+        with self.lock:
+            entries = list(self.state['segments'])
+            for k, seg in enumerate(self.segments):
+                mine = docIds[(docIds >= seg.first_doc) & (docIds <= seg.last_doc)] - seg.first_doc
+                if not mine.size:
+                    continue
+                if seg.deleted is None:
+                    bits = np.zeros(len(seg.doc_length), dtype = bool)
+                else:
+                    bits = seg.deleted.copy()
+                deleted += int((~bits[mine]).sum())
+                bits[mine] = True
+                info = dict(seg.info, deleted = seg.name + '_deleted.npy',
+                            num_deleted = int(bits.sum()))
+                save_bitmap(info['deleted'], bits)
+                # a new array, so a running merge keeps its snapshot
+                seg.deleted = bits
+                seg.info = info
+                entries[k] = info
+            if deleted:
+                state = dict(self.state, segments = entries)
+                write_manifest(self.manifest, state)
+                self.state = state
+                self.generation += 1
+        return deleted
+
+    def delete_scenes(self, scene_ids):
+        """
+        Delete the live docs of the given sceneIds, returns their docIds
+        """
+        docIds = [d for sid in scene_ids for d in self.find_scene(sid)]
+        self.delete(docIds)
+        return docIds
+
+    def update_scenes(self, scenes):
+        """
+        Replace scenes by a new version (corpus dictionaries with a
+        sceneId); the new version is added first, so a query running in
+        between sees both rather than neither
+        Returns the new docIds
+        """
+        old = [d for scd in scenes for d in self.find_scene(scd['sceneId'])]
+        docIds = self.add_scenes(scenes)
+        self.delete(old)
+        return docIds
+
+    def add_scenes(self, scenes):
+        """
+        Index new scenes into a new delta segment
+        scenes: corpus dictionaries (sceneId, playId, text); they get the
+        next free docIds, their sceneNum is not used
+        Returns the docIds given to them
+        """
+        with self.lock:
+            first = self.state['next_doc']
+            name = 'seg_%05d' % self.state['next_segment']
+            builder = PostingsBuilder()
+            lengths = []
+            scene_info = []
+            for scd in scenes:
+                tlist = tokenize(scd['text'])
+                builder.add_scene(first + len(lengths), tlist)
+                lengths.append(len(tlist))
+                scene_info.append([scd.get('sceneId'), scd.get('playId')])
+            if not lengths:
+                return []
+            info = self.write_segment(name, first, builder, lengths, scene_info)
+            state = dict(self.state, next_doc = first + len(lengths),
+                         next_segment = self.state['next_segment'] + 1,
+                         segments = self.state['segments'] + [info])
+            write_manifest(self.manifest, state)
+            self.state = state
+            self.segments = self.segments + [Segment(info)]
+            self.generation += 1
+        return list(range(first, first + len(lengths)))
+
+    def write_segment(self, name, first, builder, lengths, scene_info):
+        """
+        Write the files of a segment held by a PostingsBuilder
+        Returns its manifest entry
+        """
+        info = {'name': name,
+                'index': name + '.dat',
+                'lexicon': name + '.lex',
+                'doc_length': name + '_doclen.npy',
+                'scenes': name + '_scenes.json',
+                'first_doc': first,
+                'last_doc': first + len(lengths) - 1}
+        offsets = builder.dump(info['index'])
+        terms = list(builder.postings)
+        write_lexicon(info['lexicon'], {t: i for i, t in enumerate(terms)}, offsets,
+                      [len(builder.tf_docs[t]) for t in terms],
+                      [sum(builder.tf_counts[t]) for t in terms])
+        np.save(info['doc_length'], np.array(lengths, dtype = np.int32))
+        with open(info['scenes'], 'w') as f:
+            json.dump(scene_info, f)
+        info['bytes'] = os.path.getsize(info['index'])
+        return info
+
+    def pick_merge(self, merge_factor = MERGE_FACTOR):
+        """
+        Names of MERGE_FACTOR consecutive delta segments whose sizes are
+        within MERGE_FACTOR times of each other, the smallest such run;
+        None if there is none
+        """
+        deltas = [s for s in self.state['segments'] if s['name'] != 'base']
+        best = None
+        for i in range(len(deltas) - merge_factor + 1):
+            run = deltas[i:i + merge_factor]
+            sizes = [max(1, s['bytes']) for s in run]
+            if max(sizes) <= merge_factor * min(sizes):
+                if best is None or sum(sizes) < best[0]:
+                    best = (sum(sizes), [s['name'] for s in run])
+        return best[1] if best else None
+
+    def pick_purge(self, purge_ratio = PURGE_RATIO):
+        """
+        [name] of the segment with the largest share of deleted docs, if
+        that share is above 0 and at least purge_ratio; None otherwise
+        """
+        best = None
+        for s in self.state['segments']:
+            share = s.get('num_deleted', 0) / (s['last_doc'] - s['first_doc'] + 1)
+            if share > 0 and share >= purge_ratio and (best is None or share > best[0]):
+                best = (share, [s['name']])
+        return best[1] if best else None
+
+    def compact(self, merge_factor = MERGE_FACTOR, full = False, purge_ratio = PURGE_RATIO):
+        """
+        Merge segments until pick_merge finds nothing more to do, then
+        rewrite the segments with many deleted docs
+        full: merge every delta segment into one instead, and drop every
+        deleted doc
+        Returns the names of the segments written
+        """
+        written = []
+        with self.merge_lock:
+            while True:
+                if full:
+                    names = [s['name'] for s in self.state['segments'] if s['name'] != 'base']
+                    names = names if len(names) > 1 else None
+                else:
+                    names = self.pick_merge(merge_factor)
+                if not names:
+                    names = self.pick_purge(0 if full else purge_ratio)
+                if not names:
+                    return written
+                written.append(self.merge(names))
+
+    def compact_in_background(self, merge_factor = MERGE_FACTOR, full = False,
+                              purge_ratio = PURGE_RATIO):
+        """
+        Run compact on a daemon thread, returns the thread
+        """
+        t = threading.Thread(target = self.compact, args = (merge_factor, full, purge_ratio),
+                             daemon = True)
+        t.start()
+        return t
+
+    def merge(self, names):
+        """
+        Merge consecutive segments into a new one and swap it in, leaving
+        out their deleted docs
+        Only reads the old segments, so queries, add_scenes and deletes go
+        on; the manifest is changed under the lock at the end, and docs
+        deleted meanwhile move to the new segment's bitmap
+        Returns the new segment's name
+        """
+        by_name = {seg.name: seg for seg in self.segments}
+        old = [by_name[n] for n in names]
+        with self.lock:
+            name = 'seg_%05d' % self.state['next_segment']
+            self.state = dict(self.state, next_segment = self.state['next_segment'] + 1)
+            deleted = [seg.deleted for seg in old]
+        info = {'name': name,
+                'index': name + '.dat',
+                'lexicon': name + '.lex',
+                'doc_length': name + '_doclen.npy',
+                'scenes': name + '_scenes.json',
+                'first_doc': old[0].first_doc,
+                'last_doc': old[-1].last_doc}
+        offsets = dict()
+        df = []
+        cf = []
+        offset = 0
+        # term -> rank of every segment, one pass over each lexicon
+        # instead of a binary search per term and segment
+        ranks = [{t: r for r, t in enumerate(seg.lexicon.terms())} for seg in old]
+        # terms of all segments, in sorted order, once each
+        terms = []
+        for t in heapq.merge(*[iter(r) for r in ranks]):
+            if not terms or terms[-1] != t:
+                terms.append(t)
+        kept = []
+        with open(info['index'], 'wb') as bf:
+            for t in terms:
+                parts = []
+                tdf = tcf = 0
+                for seg, seg_ranks, bits in zip(old, ranks, deleted):
+                    r = seg_ranks.get(t)
+                    if r is None:
+                        continue
+                    data = seg.vbyte_data_at(r)
+                    vals = vbyte_decode_batch(data).tolist()
+                    if bits is None:
+                        tdf += int(seg.lexicon.df[r])
+                        tcf += int(seg.lexicon.cf[r])
+                    else:
+                        vals = drop_deleted(vals, bits, seg.first_doc)
+                        if not vals:
+                            continue
+                        data = vbyte_encode(vals)
+                        counts = list(iter_counts(vals))
+                        tdf += len(counts)
+                        tcf += sum(counts)
+                    parts.append((vals[0], last_doc(vals), data[first_number_size(data):]))
+                if not parts:
+                    # every doc of the term is deleted
+                    continue
+                kept.append(t)
+                data = join_partials(parts)
+                bf.write(data)
+                offsets[t] = (offset, len(data))
+                offset += len(data)
+                df.append(tdf)
+                cf.append(tcf)
+        write_lexicon(info['lexicon'], {t: i for i, t in enumerate(kept)}, offsets, df, cf)
+        np.save(info['doc_length'], np.concatenate([seg.doc_length for seg in old]))
+        scenes = []
+        for seg, bits in zip(old, deleted):
+            sc = seg.scene_list()
+            if bits is not None:
+                sc = [None if bits[i] else x for i, x in enumerate(sc)]
+            scenes.extend(sc)
+        with open(info['scenes'], 'w') as f:
+            json.dump(scenes, f)
+        info['bytes'] = os.path.getsize(info['index'])
+
+        with self.lock:
+            # docs deleted while the merge ran
+            late = []
+            for seg, bits in zip(old, deleted):
+                now = seg.deleted
+                if now is None:
+                    now = np.zeros(len(seg.doc_length), dtype = bool)
+                late.append(now if bits is None else now & ~bits)
+            late = np.concatenate(late)
+            if late.any():
+                info['deleted'] = name + '_deleted.npy'
+                info['num_deleted'] = int(late.sum())
+                save_bitmap(info['deleted'], late)
+            entries = self.state['segments']
+            i = [s['name'] for s in entries].index(names[0])
+            entries = entries[:i] + [info] + entries[i + len(names):]
+            state = dict(self.state, segments = entries)
+            write_manifest(self.manifest, state)
+            self.state = state
+            new_seg = Segment(info)
+            self.segments = [s for s in self.segments if s.name not in names[1:]]
+            self.segments = [new_seg if s.name == names[0] else s for s in self.segments]
+            self.retired.extend(old)
+            self.generation += 1
+        # open mappings keep the data of removed files readable
+        for seg in old:
+            # the full build's files stay, only its bitmap goes
+            if seg.name == 'base':
+                keys = ('deleted',)
+            else:
+                keys = ('index', 'lexicon', 'doc_length', 'scenes', 'deleted')
+            for key in keys:
+                if key in seg.info and os.path.exists(seg.info[key]):
+                    os.remove(seg.info[key])
+        return name
@@ -0,0 +1,143 @@
+"""
+File: spimi.py
+Function: Defines the class SpimiIndexer, which builds the compressed
+          index in external memory (single-pass in-memory indexing).
+Scenes are added to a PostingsBuilder until its memory estimate passes
+the budget. The builder is then written to a temporary run file, sorted
+by term, and a new one is started. At the end the runs are k-way merged
+(heapq.merge on the term) straight into the index file, so only one
+record per run is in memory during the merge.
+Run file record:
+    struct RUN_HEADER: termLen, firstDoc, lastDoc, df, cf, restLen
+    term (utf-8), rest (the term's bytes after its first docDelta)
+The merged index has the same per-term bytes as the in-memory build, but
+terms are written in sorted order, so offsets differ.
+"""
+import heapq
+import json
+import os
+import shutil
+import struct
+import tempfile
+
+from builder import PostingsBuilder, join_partials, transcode
+from postings_codecs import index_header
+
+# bytes of postings the in-memory builder may hold before a run is flushed
+MEMORY_BUDGET = 64 * 1024 * 1024
+
+RUN_HEADER = struct.Struct('<IIIIQI')
+
+
+def write_run(filename, entries):
+    """
+    Write (term, firstDoc, lastDoc, df, cf, rest) entries to a run file
+    """
+    with open(filename, 'wb') as f:
+        for term, first, last, df, cf, rest in entries:
+            tb = term.encode('utf-8')
+            f.write(RUN_HEADER.pack(len(tb), first, last, df, cf, len(rest)))
+            f.write(tb)
+            f.write(rest)
+
+
+def read_run(filename):
+    """
+    Yield the entries of a run file in order
+    """
+    with open(filename, 'rb') as f:
+        while True:
+            head = f.read(RUN_HEADER.size)
+            if not head:
+                return
+            tlen, first, last, df, cf, rlen = RUN_HEADER.unpack(head)
+            term = f.read(tlen).decode('utf-8')
+            yield term, first, last, df, cf, f.read(rlen)
+
+
+class SpimiIndexer:
+    def __init__(self, dump_file = 'indx.dat',
+                 memory_budget = MEMORY_BUDGET,
+                 tmp_dir = None,
+                 codec = None):
+        # final index file
+        self.dump_file = dump_file
+        # postings codec of the final index, None for vbyte
+        self.codec = codec
+        self.memory_budget = memory_budget
+        # directory holding the run files
+        self.run_dir = tempfile.mkdtemp(prefix = 'spimi-', dir = tmp_dir)
+        self.runs = []
+        self.builder = PostingsBuilder()
+        # filled by merge(): (term, (offset, size)), df and cf per term
+        self.term_offset_size = dict()
+        self.df = dict()
+        self.cf = dict()
+
+    def add_scene(self, docId, tlist):
+        """
+        Add one tokenized scene, scenes in increasing docId order
+        """
+        self.builder.add_scene(docId, tlist)
+        if self.builder.nbytes() >= self.memory_budget:
+            self.flush_run()
+
+    def flush_run(self):
+        """
+        Write the in-memory partial index as a sorted run
+        """
+        if len(self.builder) == 0:
+            return
+        filename = os.path.join(self.run_dir, 'run%05d.dat' % len(self.runs))
+        write_run(filename, self.builder.iter_partial(sort_terms = True))
+        self.runs.append(filename)
+        self.builder = PostingsBuilder()
+
+    def merge(self):
+        """
+        k-way merge the runs into self.dump_file
+        Returns the (term, (offset, size)) dictionary
+        """
+        # runs hold increasing docId ranges, and heapq.merge keeps the
+        # order of the runs for equal terms
+        merged = heapq.merge(*[read_run(r) for r in self.runs], key = lambda e: e[0])
+        header = b'' if self.codec is None else index_header(self.codec)
+        offset = len(header)
+        with open(self.dump_file, 'wb') as bf:
+            bf.write(header)
+            term = None
+            parts = []
+            for entry in merged:
+                if entry[0] != term:
+                    offset = self.write_term(bf, offset, term, parts)
+                    term = entry[0]
+                    parts = []
+                    self.df[term] = 0
+                    self.cf[term] = 0
+                parts.append((entry[1], entry[2], entry[5]))
+                self.df[term] += entry[3]
+                self.cf[term] += entry[4]
+            self.write_term(bf, offset, term, parts)
+        return self.term_offset_size
+
+    def write_term(self, bf, offset, term, parts):
+        if term is None:
+            return offset
+        data = transcode(join_partials(parts), self.codec)
+        bf.write(data)
+        self.term_offset_size[term] = (offset, len(data))
+        return offset + len(data)
+
+    def finish(self):
+        """
+        Flush the last run, merge everything and remove the run files
+        """
+        self.flush_run()
+        try:
+            return self.merge()
+        finally:
+            shutil.rmtree(self.run_dir, ignore_errors = True)
+
+    def dump_offsets(self, filename = 'offset.json'):
+        with open(filename, 'w') as f:
+            json.dump(self.term_offset_size, f)
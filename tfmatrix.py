@@ -0,0 +1,124 @@
+"""
+File: tfmatrix.py
+Function: Defines the class CSRMatrix, the term x document tf table in
+          compressed sparse row form.
+Row t holds the documents term t occurs in (indices, sorted) and how many
+times it occurs there (data); indptr[t]:indptr[t+1] is the slice of row t.
+The three arrays are saved with np.save so they can be memory-mapped.
+"""
+import numpy as np
+
+
+class CSRMatrix:
+    def __init__(self, indptr, indices, data, shape):
+        # row t is indices[indptr[t]:indptr[t+1]]
+        self.indptr = indptr
+        # column (docId) of every non-zero entry
+        self.indices = indices
+        # value (tf) of every non-zero entry
+        self.data = data
+        # (#terms, #docs)
+        self.shape = tuple(int(x) for x in shape)
+
+    @staticmethod
+    def from_rows(rows, num_cols):
+        """
+        Build from an iterable of (columns, values) pairs, one per row,
+        columns sorted
+        """
+        indptr = [0]
+        indices = []
+        data = []
+        for cols, vals in rows:
+            indices.append(np.asarray(cols, dtype = np.int32))
+            data.append(np.asarray(vals, dtype = np.int32))
+            indptr.append(indptr[-1] + len(cols))
+        if indices:
+            indices = np.concatenate(indices)
+            data = np.concatenate(data)
+        else:
+            indices = np.zeros(0, dtype = np.int32)
+            data = np.zeros(0, dtype = np.int32)
+        return CSRMatrix(np.array(indptr, dtype = np.int64), indices, data,
+                         (len(indptr) - 1, num_cols))
+
+    def save(self, prefix = 'tf'):
+        """
+        Save as prefix_indptr.npy, prefix_indices.npy, prefix_data.npy
+        and prefix_shape.npy
+        """
+        np.save(prefix + '_indptr.npy', self.indptr)
+        np.save(prefix + '_indices.npy', self.indices)
+        np.save(prefix + '_data.npy', self.data)
+        np.save(prefix + '_shape.npy', np.array(self.shape, dtype = np.int64))
+
+    @staticmethod
+    def load(prefix = 'tf', mmap_mode = 'r'):
+        """
+        Load what save() wrote, memory-mapped by default
+        """
+        return CSRMatrix(np.load(prefix + '_indptr.npy', mmap_mode = mmap_mode),
+                         np.load(prefix + '_indices.npy', mmap_mode = mmap_mode),
+                         np.load(prefix + '_data.npy', mmap_mode = mmap_mode),
+                         np.load(prefix + '_shape.npy'))
+
+    @property
+    def nnz(self):
+        return int(self.indptr[-1])
+
+    @property
+    def nbytes(self):
+        return self.indptr.nbytes + self.indices.nbytes + self.data.nbytes
+
+    def row_indices(self, row):
+        """
+        Sorted docIds of row (a view, no copy)
+        """
+        return self.indices[self.indptr[row]:self.indptr[row + 1]]
+
+    def row_data(self, row):
+        """
+        tf values matching row_indices(row)
+        """
+        return self.data[self.indptr[row]:self.indptr[row + 1]]
+
+    def row_nnz(self):
+        """
+        Number of non-zero entries of every row (the df array for tf)
+        """
+        return np.diff(self.indptr)
+
+    def row_sums(self):
+        """
+        Sum of every row (the collection frequency of each term for tf)
+        """
+        rows = np.repeat(np.arange(self.shape[0]), self.row_nnz())
+        return np.bincount(rows, weights = self.data, minlength = self.shape[0]).astype(int)
+
+    def group_columns(self, groups, num_groups):
+        """
+        Sum the columns of the same group: groups[col] is the new column
+        of col, e.g. term x scene tf into term x play tf
+        """
+        rows = np.repeat(np.arange(self.shape[0], dtype = np.int64), self.row_nnz())
+        keys = rows * num_groups + np.asarray(groups, dtype = np.int64)[self.indices]
+        # sorted unique keys keep rows in order and columns sorted in rows
+        keys, inverse = np.unique(keys, return_inverse = True)
+        data = np.bincount(inverse, weights = self.data).astype(np.int32)
+        indptr = np.searchsorted(keys // num_groups, np.arange(self.shape[0] + 1))
+        return CSRMatrix(indptr.astype(np.int64), (keys % num_groups).astype(np.int32),
+                         data, (self.shape[0], num_groups))
+
+    def __getitem__(self, row):
+        """
+        Dense copy of one row, what tf[tid] used to return
+        """
+        res = np.zeros(self.shape[1], dtype = int)
+        res[self.row_indices(row)] = self.row_data(row)
+        return res
+
+    def toarray(self):
+        res = np.zeros(self.shape, dtype = int)
+        rows = np.repeat(np.arange(self.shape[0]), self.row_nnz())
+        res[rows, self.indices] = self.data
+        return res
@@ -0,0 +1,127 @@
+"""
+File: vbyte.py
+Function: VByte encoding and decoding shared by Indexer and Querier.
+Each integer is written as 7-bit groups, lowest group first; the last
+byte of a number has its high bit (0x80) set.
+Decoding comes in two modes:
+- batch: decodes a whole postings list at once with NumPy
+- stream: decodes in one linear pass in plain Python, cheaper for short
+  lists and usable as a lazy iterator
+"""
+import numpy as np
+
+from inv_util import rshift
+
+# lists shorter than this many bytes are decoded in stream mode by 'auto'
+BATCH_THRESHOLD = 64
+
+
+def vbyte_encode(arr):
+    """
+    Encode a list of non-negative integers, return a bytearray
+    """
+    ol = bytearray()
+    for i in arr:
+        while i >= 128:
+            ol.append(i & 0x7F)
+            i = rshift(i, 7)
+        ol.append(i | 0x80)
+    return ol
+
+
+def vbyte_encode_batch(arr):
+    """
+    Encode an array of non-negative integers with NumPy
+    Returns (uint8 ndarray of the bytes, bytes used by every number); the
+    bytes are the same as vbyte_encode's
+    """
+    arr = np.asarray(arr, dtype = np.int64)
+    nbytes = np.ones(len(arr), dtype = np.int64)
+    rest = arr >> 7
+    while rest.any():
+        nbytes += rest > 0
+        rest >>= 7
+    ends = np.cumsum(nbytes)
+    starts = ends - nbytes
+    out = np.zeros(int(ends[-1]) if len(arr) else 0, dtype = np.uint8)
+    k = 0
+    idx = np.arange(len(arr))
+    while idx.size:
+        out[starts[idx] + k] = (arr[idx] >> (7 * k)) & 0x7F
+        k += 1
+        idx = idx[nbytes[idx] > k]
+    out[ends - 1] |= 0x80
+    return out, nbytes
+
+
+def vbyte_decode_batch(byarr):
+    """
+    Decode a whole byte string with NumPy, return an int64 ndarray
+    Terminator bytes are found with flatnonzero, every byte is shifted by
+    7 x (its index inside the number) and the groups are summed per number
+    """
+    buf = np.frombuffer(byarr, dtype = np.uint8)
+    ends = np.flatnonzero(buf & 0x80)
+    if ends.size == 0 or ends[-1] != buf.size - 1:
+        if buf.size == 0:
+            return np.zeros(0, dtype = np.int64)
+        raise ValueError("truncated vbyte data")
+    starts = np.empty_like(ends)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+    # index of each byte inside the number it belongs to
+    group = np.arange(buf.size) - np.repeat(starts, ends - starts + 1)
+    values = (buf & 0x7F).astype(np.int64) << (7 * group)
+    return np.add.reduceat(values, starts)
+
+
+def vbyte_decode_stream(byarr):
+    """
+    Decode a byte string in one linear pass, return a list of ints
+    """
+    ol = []
+    res = 0
+    shift = 0
+    for b in byarr:
+        res |= (b & 0x7F) << shift
+        if b & 0x80:
+            ol.append(res)
+            res = 0
+            shift = 0
+        else:
+            shift += 7
+    if shift:
+        raise ValueError("truncated vbyte data")
+    return ol
+
+
+def iter_vbyte(byarr):
+    """
+    Lazy version of vbyte_decode_stream, yields one integer at a time
+    """
+    res = 0
+    shift = 0
+    for b in byarr:
+        res |= (b & 0x7F) << shift
+        if b & 0x80:
+            yield res
+            res = 0
+            shift = 0
+        else:
+            shift += 7
+    if shift:
+        raise ValueError("truncated vbyte data")
+
+
+def vbyte_decode(byarr, mode = 'auto'):
+    """
+    Decode a byte string, return a list of ints
+    mode: 'batch', 'stream' or 'auto' (picks by length)
+    """
+    if mode == 'auto':
+        mode = 'batch' if len(byarr) >= BATCH_THRESHOLD else 'stream'
+    if mode == 'batch':
+        return vbyte_decode_batch(byarr).tolist()
+    if mode == 'stream':
+        return vbyte_decode_stream(byarr)
+    raise ValueError("unknown vbyte decoding mode: {}".format(mode))